@@ -0,0 +1,328 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from lib.encoding import PLANES, ObservationEncoder
+from lib.engine import FIELD_SIZE, SHIP_TYPES
+from lib.player_base import Player
+from lib.rng import RandomStream
+
+#
+# 同じプロセスで並行に進む多数のゲームの推論をまとめて行う．
+# 各ゲームのプレイヤーは観測と合法手のマスクを渡して結果を待ち，推論のスレッドが
+# 溜まった要求を最大max_batch個ずつ1つのNumPyの配列にして，モデルを1回だけ呼ぶ．
+# 最初の要求からmax_latency秒たったら，max_batchに満たなくても推論する．
+#
+# 行動は100通りで，番号は
+#   艦種kの艦をマスcellへ移動  k * 25 + cell
+#   マスcellを攻撃            75 + cell
+# である．マスの番号はx * 5 + yである．
+#
+
+# マスの数．
+CELLS = FIELD_SIZE * FIELD_SIZE
+# 攻撃の行動の番号の始まり．
+ATTACK = len(SHIP_TYPES) * CELLS
+# 行動の数．
+ACTIONS = ATTACK + CELLS
+
+
+# 行動の番号を行動の連想配列(Player.moveやPlayer.attackが返す形)にする．
+def decode_action(index):
+    cell = index % CELLS
+    to = [cell // FIELD_SIZE, cell % FIELD_SIZE]
+    if index >= ATTACK:
+        return {"attack": {"to": to}}
+    return {"move": {"ship": SHIP_TYPES[index // CELLS], "to": to}}
+
+
+#
+# 推論の要求をまとめて処理するクラスである．
+# modelは(観測の配列(n, 面の数, 5, 5), マスクの配列(n, 100))を受け取り，
+# 各行動の点数の配列(n, 100)を返す関数である．観測とマスクの配列は使い回すので，
+# modelの中で保持してはいけない．
+#
+class BatchedInference:
+
+    def __init__(self, model, max_batch=64, max_latency=0.002):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._observations = np.zeros((max_batch, len(PLANES), FIELD_SIZE, FIELD_SIZE), dtype=np.float32)
+        self._masks = np.zeros((max_batch, ACTIONS), dtype=bool)
+        self._requests = queue.Queue()
+        # closeの後に要求が積まれないように，closeとsubmitはこのロックの中で行う．
+        self._lock = threading.Lock()
+        self._closed = False
+        # 推論した回数と，処理した要求の数．
+        self.batches = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    #
+    # 観測(面の数, 5, 5)とマスク(100)を渡して推論を要求する．点数の配列をresultに持つFutureを返す．
+    # 結果が出るまで観測とマスクを書き換えてはいけない．closeの後に呼ぶとRuntimeErrorを送出する．
+    #
+    def submit(self, observation, mask):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("BatchedInference is closed")
+            self._requests.put((observation, mask, future))
+        return future
+
+    # イベントループから使う版．点数の配列を返す．
+    async def infer(self, observation, mask):
+        return await asyncio.wrap_future(self.submit(observation, mask))
+
+    # 推論のスレッドを止める．それまでに受け付けた要求はすべて処理してから止まる．
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._requests.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # 要求を集めて推論することを繰り返す．
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.max_latency
+            closing = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    request = self._requests.get(timeout=remaining) if remaining > 0 else self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                batch.append(request)
+            self._evaluate(batch)
+            if closing:
+                return
+
+    #
+    # まとめた要求を1回のmodelの呼び出しで処理し，結果をそれぞれのFutureに渡す．
+    # 形の合わない要求はそのFutureだけをValueErrorにして，残りの要求で推論する．
+    #
+    def _evaluate(self, batch):
+        futures = []
+        for observation, mask, future in batch:
+            k = len(futures)
+            try:
+                if np.shape(observation) != self._observations.shape[1:] or np.shape(mask) != (ACTIONS,):
+                    raise ValueError(f"observation {np.shape(observation)} or mask {np.shape(mask)} has a wrong shape")
+                self._observations[k] = observation
+                self._masks[k] = mask
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            futures.append(future)
+        n = len(futures)
+        if n == 0:
+            return
+        try:
+            scores = self.model(self._observations[:n], self._masks[:n])
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.requests += n
+        for k, future in enumerate(futures):
+            future.set_result(scores[k])
+
+
+#
+# BatchedInferenceで行動を決めるプレイヤーである．観測はlib.encodingの特徴量で，
+# 合法でない行動を除いた中で点数が最も高い行動を選ぶ(同点なら乱数で選ぶ)．
+# スレッドから使う時はaction，イベントループから使う時はaction_asyncを呼ぶ．
+#
+class BatchedPlayer(Player):
+
+    def __init__(self, service, positions=None, seed=0, rng=None, decay=0.9):
+        self.service = service
+        self.rng = RandomStream(seed) if rng is None else rng
+        if positions is None:
+            field = [(x, y) for x in range(FIELD_SIZE) for y in range(FIELD_SIZE)]
+            positions = dict(zip(SHIP_TYPES, self.rng.sample(field, len(SHIP_TYPES))))
+        super().__init__(positions)
+        self.encoder = ObservationEncoder(1, decay)
+        self.mask = np.zeros(ACTIONS, dtype=bool)
+        # 次にupdateで受け取るのが自分の行動の結果かどうか．
+        self._acted = False
+
+    # 合法な行動のマスクを作る．
+    def legal_mask(self):
+        self.mask[:] = False
+        for x in range(FIELD_SIZE):
+            for y in range(FIELD_SIZE):
+                cell = x * FIELD_SIZE + y
+                to = (x, y)
+                self.mask[ATTACK + cell] = self.can_attack(to)
+                if self.overlap(to) is not None:
+                    continue
+                for k, t in enumerate(SHIP_TYPES):
+                    ship = self.ships.get(t)
+                    if ship is not None and ship.can_reach(to):
+                        self.mask[k * CELLS + cell] = True
+        return self.mask
+
+    def action(self):
+        return self._choose(self.service.submit(self.encoder.state[0], self.legal_mask()).result())
+
+    async def action_async(self):
+        return self._choose(await self.service.infer(self.encoder.state[0], self.legal_mask()))
+
+    def update(self, json_):
+        super().update(json_)
+        self.encoder.update(0, json_, self._acted)
+        self._acted = False
+
+    #
+    # 点数から行動を選んでJSONにする．NaNの点数は選ばない．合法な行動の点数がすべて
+    # NaNか-infなら合法な行動から乱数で選び，合法な行動が無ければValueErrorを送出する．
+    #
+    def _choose(self, scores):
+        if not self.mask.any():
+            raise ValueError("no legal action")
+        masked = np.where(self.mask & ~np.isnan(scores), scores, -np.inf)
+        top = masked.max()
+        best = np.flatnonzero(self.mask if top == -np.inf else masked == top)
+        act = decode_action(int(self.rng.choice(best)))
+        self._acted = True
+        if "attack" in act:
+            return json.dumps(self.attack(act["attack"]["to"]))
+        return json.dumps(self.move(act["move"]["ship"], act["move"]["to"]))
+
+
+if __name__ == '__main__':
+    import unittest
+    from concurrent.futures import ThreadPoolExecutor
+
+    from lib.simulation import play
+
+    # 重みを固定した線形のモデル．
+    def linear_model(seed=0):
+        weights = np.random.default_rng(seed).standard_normal((len(PLANES) * CELLS, ACTIONS)).astype(np.float32)
+        calls = []
+
+        def model(observations, masks):
+            calls.append(len(observations))
+            return observations.reshape(len(observations), -1) @ weights
+
+        return model, calls
+
+    class BatchingTest(unittest.TestCase):
+
+        def test_decode_action(self):
+            self.assertEqual(decode_action(0), {"move": {"ship": "w", "to": [0, 0]}})
+            self.assertEqual(decode_action(CELLS + 7), {"move": {"ship": "c", "to": [1, 2]}})
+            self.assertEqual(decode_action(ACTIONS - 1), {"attack": {"to": [4, 4]}})
+
+        def test_legal_mask(self):
+            player = BatchedPlayer(None, positions={"w": [0, 0], "c": [0, 1], "s": [4, 4]})
+            mask = player.legal_mask()
+            self.assertFalse(mask[0 * CELLS + 1])            # cのいるマスには移動できない
+            self.assertTrue(mask[0 * CELLS + 4])
+            self.assertFalse(mask[0 * CELLS + 6])            # 斜めには移動できない
+            self.assertTrue(mask[ATTACK + 1 * FIELD_SIZE + 1])
+            self.assertFalse(mask[ATTACK + 2 * FIELD_SIZE + 2])
+
+        def test_threads(self):
+            model, calls = linear_model()
+            with BatchedInference(model, max_batch=16, max_latency=0.05) as service:
+                def game(g):
+                    rng = RandomStream(g)
+                    players = [BatchedPlayer(service, rng=rng.spawn(0)), BatchedPlayer(service, rng=rng.spawn(1))]
+                    return play(players, max_turns=200)
+
+                with ThreadPoolExecutor(16) as pool:
+                    results = list(pool.map(game, range(16)))
+            self.assertTrue(all(r.reason != "foul" for r in results))
+            self.assertEqual(sum(calls), service.requests)
+            self.assertGreater(max(calls), 1)
+
+        def test_asyncio(self):
+            model, calls = linear_model()
+
+            async def run(service):
+                players = [BatchedPlayer(service, seed=k) for k in range(8)]
+                return await asyncio.gather(*[p.action_async() for p in players])
+
+            with BatchedInference(model, max_batch=8, max_latency=0.5) as service:
+                actions = asyncio.run(run(service))
+            self.assertEqual(len(actions), 8)
+            self.assertEqual(calls, [8])
+
+        def test_close(self):
+            model, calls = linear_model()
+            service = BatchedInference(model, max_batch=8, max_latency=0.5)
+            player = BatchedPlayer(service, seed=0)
+            observation, mask = player.encoder.state[0], player.legal_mask()
+            futures = [service.submit(observation, mask) for _ in range(3)]
+            service.close()
+            # closeの前の要求は処理され，後の要求は受け付けない
+            self.assertTrue(all(f.done() and f.exception() is None for f in futures))
+            with self.assertRaises(RuntimeError):
+                service.submit(observation, mask)
+            service.close()
+
+        def test_bad_request(self):
+            model, calls = linear_model()
+            with BatchedInference(model, max_batch=8, max_latency=0.01) as service:
+                future = service.submit(np.zeros(3), np.zeros(ACTIONS, dtype=bool))
+                with self.assertRaises(ValueError):
+                    future.result(timeout=5)
+            self.assertEqual(calls, [])
+
+        def test_bad_request_in_batch(self):
+            model, calls = linear_model()
+            player = BatchedPlayer(None, seed=0)
+            observation, mask = player.encoder.state[0], player.legal_mask()
+            with BatchedInference(model, max_batch=4, max_latency=0.5) as service:
+                good = service.submit(observation, mask)
+                bad = service.submit(observation, np.zeros(3, dtype=bool))
+                other = service.submit(observation, mask)
+                with self.assertRaises(ValueError):
+                    bad.result(timeout=5)
+                # 同じまとまりの他の要求は推論される
+                self.assertEqual(good.result(timeout=5).shape, (ACTIONS,))
+                self.assertEqual(other.result(timeout=5).shape, (ACTIONS,))
+            self.assertEqual(calls, [2])
+
+        def test_choose_without_scores(self):
+            player = BatchedPlayer(None, positions={"w": [0, 0], "c": [0, 1], "s": [4, 4]})
+            for scores in (np.full(ACTIONS, np.nan), np.full(ACTIONS, -np.inf)):
+                mask = player.legal_mask().copy()
+                act = json.loads(player._choose(scores))
+                index = ATTACK + act["attack"]["to"][0] * FIELD_SIZE + act["attack"]["to"][1] if "attack" in act \
+                    else SHIP_TYPES.index(act["move"]["ship"]) * CELLS + act["move"]["to"][0] * FIELD_SIZE + act["move"]["to"][1]
+                self.assertTrue(mask[index])
+            player.legal_mask()
+            # NaNを除いた中で最も高い行動を選ぶ
+            scores = np.full(ACTIONS, np.nan)
+            scores[ATTACK + 1] = 1.0
+            self.assertEqual(json.loads(player._choose(scores)), {"attack": {"to": [0, 1]}})
+            player.mask[:] = False
+            with self.assertRaises(ValueError):
+                player._choose(np.zeros(ACTIONS))
+
+    unittest.main()
@@ -0,0 +1,187 @@
+import json
+import socket
+import threading
+
+from lib.player_base import Player
+from lib.tracing import NULL_TRACER
+from lib.transport import Connection, SharedMemoryConnection
+
+#
+# プレイヤーをサーバにつないで対戦させる．通信の手順はdoc/client_doc.mdの仕様に従う．
+#
+
+
+#
+# サーバに接続する．TCPではTCP_NODELAYを設定するので，行動を送るとすぐにサーバに届く．
+# unixを与えるとhostとportの代わりにそのパスのUnixドメインソケットに接続する．
+# shmならサーバが作った共有メモリのリングバッファでメッセージをやりとりする(サーバも--shmで起動すること)．
+#
+def connect(host, port, nodelay=True, unix=None, shm=False):
+    if unix is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(unix)
+    else:
+        sock = socket.create_connection((host, port))
+    if shm:
+        return SharedMemoryConnection.attach(sock)
+    return Connection(sock, nodelay=nodelay)
+
+
+#
+# 相手の手番の間，別のスレッドでplayer.ponderを動かす．withを抜ける時に止めて終わるのを待つので，
+# その後のPlayer.updateがponderと同時に動くことはない．ponderの中で起きた例外はwithを抜ける時に送出する．
+# ponderを上書きしていないプレイヤーではスレッドを作らない．
+#
+class Pondering:
+
+    def __init__(self, player, tracer=NULL_TRACER, turn=0):
+        self.player = player
+        self.tracer = tracer
+        self.turn = turn
+        self.stop = threading.Event()
+        self._thread = None
+        self._error = None
+
+    def __enter__(self):
+        if type(self.player).ponder is not Player.ponder:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is None:
+            return
+        self.stop.set()
+        self._thread.join()
+        if self._error is not None and exc[0] is None:
+            raise self._error
+
+    def _run(self):
+        try:
+            with self.tracer.span("Player.ponder", turn=self.turn):
+                self.player.ponder(self.stop)
+        except Exception as e:
+            self._error = e
+
+
+#
+# connの上でplayerを最後まで対戦させる．
+# 最後に受け取ったメッセージ("you win"，"you lose"，"even"のいずれか)を返す．
+# 名前を送ったプレイヤーは最初に対戦相手の名前を受け取り，player.meetに渡す．
+# verboseなら受け取ったメッセージを出力する．
+# tracer(lib.tracing.Tracer)を与えると，Player.actionとPlayer.update，通信にかかった時間を記録する．
+# "waiting"を受け取ってから相手の行動の結果が届くまでの間はplayer.ponderを動かす．
+#
+def play(player, conn, verbose=True, tracer=NULL_TRACER):
+    get_msg = conn.readline()
+    if verbose:
+        print(get_msg)
+    conn.write(player.initial_condition()+'\n')
+
+    turn = 0
+    while True:
+        with tracer.span("read"):
+            info = conn.readline().rstrip()
+        if verbose:
+            print(info)
+        if info == "your turn":
+            with tracer.span("Player.action", turn=turn):
+                act = player.action()
+            with tracer.span("write"):
+                conn.write(act+'\n')
+            with tracer.span("read"):
+                get_msg = conn.readline()
+            with tracer.span("Player.update", turn=turn):
+                player.update(get_msg)
+        elif info == "waiting":
+            with Pondering(player, tracer, turn):
+                with tracer.span("read"):
+                    get_msg = conn.readline()
+            with tracer.span("Player.update", turn=turn):
+                player.update(get_msg)
+        elif info in ("you win", "you lose", "even"):
+            return info
+        elif info.startswith("{"):
+            # 対戦相手の名前．ターンは進まない
+            player.meet(json.loads(info)["opponent"]["name"])
+            continue
+        else:
+            raise RuntimeError("unknown information")
+        turn += 1
+
+
+if __name__ == '__main__':
+    import unittest
+
+    class ScriptedPlayer(Player):
+
+        def __init__(self):
+            super().__init__({"w": [0, 0], "c": [1, 1], "s": [2, 2]})
+            self.events = []
+
+        def action(self):
+            self.events.append("action")
+            return json.dumps(self.attack([1, 0]))
+
+        def ponder(self, stop):
+            self.events.append("ponder")
+            stop.wait()
+            self.events.append("stopped")
+
+        def update(self, json_):
+            self.events.append("update")
+            super().update(json_)
+
+    class ClientTest(unittest.TestCase):
+
+        def test_protocol_and_ponder(self):
+            a, b = socket.socketpair()
+            player = ScriptedPlayer()
+            result = {}
+            thread = threading.Thread(target=lambda: result.update(info=play(player, Connection(b), verbose=False)))
+            thread.start()
+
+            server = Connection(a)
+            condition = json.dumps({"condition": {"me": {"w": {"hp": 3, "position": [0, 0]},
+                                                         "c": {"hp": 2, "position": [1, 1]}},
+                                                  "enemy": {"w": {"hp": 3}}}})
+            server.write("you are connected. please send me initial state.\n")
+            self.assertEqual(json.loads(server.readline())["w"], [0, 0])
+            server.write("your turn\n")
+            self.assertIn("attack", json.loads(server.readline()))
+            server.write(condition + "\n")
+            server.write("waiting\n")
+            # 相手が考えている間にponderが始まっている
+            while "ponder" not in player.events:
+                threading.Event().wait(0.001)
+            server.write(condition + "\n")
+            server.write("you win\n")
+            thread.join()
+            server.close()
+
+            self.assertEqual(result["info"], "you win")
+            self.assertEqual(player.events, ["action", "update", "ponder", "stopped", "update"])
+            self.assertNotIn("s", player.ships)
+
+        def test_meet(self):
+            a, b = socket.socketpair()
+            player = ScriptedPlayer()
+            player.name = "scripted"
+            thread = threading.Thread(target=play, args=(player, Connection(b)), kwargs={"verbose": False})
+            thread.start()
+            server = Connection(a)
+            server.write("you are connected. please send me initial state.\n")
+            self.assertEqual(json.loads(server.readline())["name"], "scripted")
+            server.write(json.dumps({"opponent": {"name": "random"}}) + "\n")
+            server.write("even\n")
+            thread.join()
+            server.close()
+            self.assertEqual(player.opponent, "random")
+            self.assertEqual(player.events, [])
+
+        def test_no_thread_without_ponder(self):
+            pondering = Pondering(Player({"w": [0, 0]}))
+            with pondering:
+                self.assertIsNone(pondering._thread)
+
+    unittest.main()
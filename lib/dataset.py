@@ -0,0 +1,303 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+
+#
+# 自己対戦で集めた(観測, 行動, 勝敗)の組を，固定長のシャードに列ごとに保存する．
+# シャードは列の配列を順に並べただけのファイルで，各列はNumPyのmemmapやfrombufferでそのまま読める．
+# 書き込み中に保持するのは1シャード分と対戦中の1ゲーム分だけである．
+#
+
+# 艦の種類．添字が列の中での順番になる．
+SHIP_TYPES = ("w", "c", "s")
+
+#
+# 列の定義．(名前, arrayの型コード, 1行あたりの要素数)である．
+# 型の大きい列から並べて，各列がシャードの中で整列するようにしている．
+#
+#   game     通し番号
+#   turn     ゲーム内のターン数
+#   player   行動したプレイヤーの番号
+#   me       自分の艦の(x, y, hp)を艦種順に並べたもの．沈没した艦は-1
+#   enemy    相手の艦のHPを艦種順に並べたもの．沈没した艦は0
+#   last     直前に受け取った相手の行動の結果．(種類, x, y, 艦, 近く)
+#            種類は0なら無し，1なら攻撃され(x, y, 命中した艦, 近くの艦のビット列)，
+#            2なら移動され(dx, dy, 移動した艦, 0)．艦がなければ-1
+#   action   行動．(種類, 艦, x, y)．種類は0なら移動，1なら攻撃で，攻撃の艦は-1
+#   outcome  行動したプレイヤーから見た勝敗．勝ちなら1，負けなら-1，引き分けなら0
+#
+COLUMNS = (
+    ("game", "I", 1),
+    ("turn", "H", 1),
+    ("player", "b", 1),
+    ("me", "b", 9),
+    ("enemy", "b", 3),
+    ("last", "b", 5),
+    ("action", "b", 4),
+    ("outcome", "b", 1),
+)
+
+MANIFEST = "manifest.json"
+
+
+# 直前に受け取ったJSONを観測の列(me, enemy, last)に変換する．
+def encode_observation(message):
+    info = json.loads(message)
+    cond = info["condition"]
+    me = []
+    for t in SHIP_TYPES:
+        ship = cond["me"].get(t)
+        me.extend([-1, -1, -1] if ship is None else [ship["position"][0], ship["position"][1], ship["hp"]])
+    enemy = [cond["enemy"][t]["hp"] if t in cond["enemy"] else 0 for t in SHIP_TYPES]
+
+    last = [0, 0, 0, -1, 0]
+    result = info.get("result")
+    if result is not None and result.get("attacked"):
+        attacked = result["attacked"]
+        hit = SHIP_TYPES.index(attacked["hit"]) if "hit" in attacked else -1
+        near = sum(1 << SHIP_TYPES.index(t) for t in attacked.get("near", []))
+        last = [1, attacked["position"][0], attacked["position"][1], hit, near]
+    elif result is not None and result.get("moved"):
+        moved = result["moved"]
+        last = [2, moved["distance"][0], moved["distance"][1], SHIP_TYPES.index(moved["ship"]), 0]
+    return me, enemy, last
+
+
+# 行動のJSONを行動の列に変換する．
+def encode_action(message):
+    act = json.loads(message)
+    if "attack" in act:
+        to = act["attack"]["to"]
+        return [1, -1, to[0], to[1]]
+    to = act["move"]["to"]
+    return [0, SHIP_TYPES.index(act["move"]["ship"]), to[0], to[1]]
+
+
+# 列の名前から空のarrayへの連想配列を作る．行をためてShardWriter.extendに渡すのに使う．
+def empty_columns():
+    return {name: array(code) for name, code, _ in COLUMNS}
+
+
+#
+# 1ゲーム分の行動movesを勝者winner(引き分けなら-1)とともに列の連想配列columnsに足す．
+# movesの各要素は(game, turn, player, observation, action)である．足した行数を返す．
+#
+def encode_game(moves, winner, columns):
+    for game, turn, player, observation, action in moves:
+        me, enemy, last = encode_observation(observation)
+        columns["game"].append(game)
+        columns["turn"].append(turn)
+        columns["player"].append(player)
+        columns["me"].extend(me)
+        columns["enemy"].extend(enemy)
+        columns["last"].extend(last)
+        columns["action"].extend(encode_action(action))
+        columns["outcome"].append(0 if winner == -1 else (1 if winner == player else -1))
+    return len(moves)
+
+
+#
+# シャードを書き出すクラスである．shard_size行たまるごとに1つのシャードファイルにするので，
+# 短いのは最後のシャードだけである．
+# 勝敗はゲームが終わるまで決まらないので，1ゲーム分の行はend_gameまで別に持っておく．
+# 別のプロセスでempty_columnsとencode_gameでためた行は，extendでまとめて渡せる．
+#
+class ShardWriter:
+
+    def __init__(self, directory, prefix, shard_size=65536):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        # 書き出したシャードの一覧．マニフェストに載せる．
+        self.shards = []
+        self._rows = 0
+        self._buffers = empty_columns()
+        self._game = []
+
+    # 1回の行動を記録する．
+    def append(self, game, turn, player, observation, action):
+        self._game.append((game, turn, player, observation, action))
+
+    # ゲームの勝者(引き分けなら-1)を与えて，そのゲームの行をシャードに移す．
+    def end_game(self, winner):
+        columns = empty_columns()
+        encode_game(self._game, winner, columns)
+        self.extend(columns)
+        self._game = []
+
+    # 列の連想配列columnsの行を順に足す．shard_sizeに達するたびにシャードにする．
+    def extend(self, columns):
+        rows = len(columns["game"])
+        i = 0
+        while i < rows:
+            take = min(self.shard_size - self._rows, rows - i)
+            for name, _, width in COLUMNS:
+                self._buffers[name].extend(columns[name][i * width:(i + take) * width])
+            self._rows += take
+            i += take
+            if self._rows == self.shard_size:
+                self._flush()
+
+    # 残りの行を書き出して，シャードの一覧を返す．
+    def close(self):
+        if self._rows > 0:
+            self._flush()
+        return self.shards
+
+    def _flush(self):
+        name = f"{self.prefix}-{len(self.shards):05d}.bin"
+        with open(os.path.join(self.directory, name), "wb") as f:
+            for column, _, _ in COLUMNS:
+                self._buffers[column].tofile(f)
+        self.shards.append({"path": name, "rows": self._rows})
+        self._buffers = empty_columns()
+        self._rows = 0
+
+
+# シャードの一覧からマニフェストを書き出す．
+def write_manifest(directory, shards, **meta):
+    manifest = dict(meta)
+    manifest["byteorder"] = sys.byteorder
+    manifest["columns"] = [{"name": name, "typecode": code, "width": width}
+                           for name, code, width in COLUMNS]
+    manifest["shards"] = shards
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f)
+
+
+#
+# メモリマップしたシャード1つを表すクラスである．
+# columnsは列の名前から(行数, 要素数)の形のmemoryviewへの連想配列で，値はview[i, j]で読める．
+# メモリマップはシャードと列から作った配列(np.frombufferなど)がすべて捨てられた時に解放される．
+# closeで先に解放することもできるが，その時点で列から作った配列が残っていてはいけない．
+#
+class Shard:
+
+    def __init__(self, path, rows, columns):
+        self.rows = rows
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        self.columns = {}
+        offset = 0
+        for column in columns:
+            size = array(column["typecode"]).itemsize * column["width"] * rows
+            self.columns[column["name"]] = view[offset:offset + size].cast(
+                column["typecode"], [rows, column["width"]])
+            offset += size
+
+    def close(self):
+        for column in self.columns.values():
+            column.release()
+        self.columns = {}
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#
+# マニフェストを読み，シャードを順にメモリマップして返すクラスである．
+# withの中で使うと，抜ける時に開いたシャードをすべて閉じる．それまでに列から作った配列を
+# 捨てておくこと(withの外でも使う値はコピーしておく)．
+#
+class Dataset:
+
+    def __init__(self, directory):
+        self.directory = directory
+        # 開いたシャード．closeで閉じる．
+        self._shards = []
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest["byteorder"] != sys.byteorder:
+            raise ValueError("dataset was written on a machine with different byte order")
+
+    # 全体の行数を返す．
+    def __len__(self):
+        return sum(shard["rows"] for shard in self.manifest["shards"])
+
+    #
+    # シャードを1つずつ開いて返す．返したシャードは次に進んでも閉じないので，列から作った配列を
+    # closeまで使える．
+    #
+    def __iter__(self):
+        for shard in self.manifest["shards"]:
+            opened = Shard(os.path.join(self.directory, shard["path"]), shard["rows"],
+                           self.manifest["columns"])
+            self._shards.append(opened)
+            yield opened
+
+    # 開いたシャードをすべて閉じる．
+    def close(self):
+        while self._shards:
+            self._shards.pop().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    class DatasetTest(unittest.TestCase):
+
+        def setUp(self):
+            self.directory = tempfile.TemporaryDirectory()
+            condition = json.dumps({"condition": {"me": {"w": {"hp": 3, "position": [1, 2]}},
+                                                  "enemy": {"w": {"hp": 3}, "c": {"hp": 2}}}})
+            writer = ShardWriter(self.directory.name, "part", shard_size=3)
+            for game in range(2):
+                for turn in range(2):
+                    writer.append(game, turn, turn % 2, condition, json.dumps({"attack": {"to": [2, 2]}}))
+                writer.end_game(0)
+            write_manifest(self.directory.name, writer.close())
+
+        def tearDown(self):
+            self.directory.cleanup()
+
+        def test_read(self):
+            with Dataset(self.directory.name) as dataset:
+                self.assertEqual(len(dataset), 4)
+                shards = list(dataset)
+                self.assertEqual([s.rows for s in shards], [3, 1])
+                self.assertEqual(shards[0].columns["me"][0, 2], 3)
+                self.assertEqual(list(shards[0].columns["outcome"].cast("B").cast("b")), [1, -1, 1])
+            self.assertTrue(all(s._mmap.closed for s in shards))
+
+        def test_keep_views_across_shards(self):
+            # 列から作ったview(np.frombufferと同じく元のバッファを参照する)を次のシャードに進んだ後も使う
+            with Dataset(self.directory.name) as dataset:
+                views = [memoryview(shard.columns["game"]) for shard in dataset]
+                self.assertEqual([v.tolist() for v in views], [[[0], [0], [1]], [[1]]])
+                for v in views:
+                    v.release()
+
+        def test_extend(self):
+            # 別にためた行を渡しても，短いのは最後のシャードだけになる
+            directory = os.path.join(self.directory.name, "extended")
+            os.makedirs(directory)
+            condition = json.dumps({"condition": {"me": {}, "enemy": {}}})
+            writer = ShardWriter(directory, "part", shard_size=4)
+            for task in range(3):
+                columns = empty_columns()
+                for game in range(task * 2, task * 2 + 2):
+                    moves = [(game, turn, turn % 2, condition, json.dumps({"attack": {"to": [0, 0]}}))
+                             for turn in range(3)]
+                    encode_game(moves, -1, columns)
+                writer.extend(columns)
+            write_manifest(directory, writer.close())
+            with Dataset(directory) as dataset:
+                self.assertEqual([s.rows for s in dataset], [4, 4, 4, 4, 2])
+                self.assertEqual([g for s in dataset._shards for g in s.columns["game"].cast("B").cast("I")],
+                                 [g for g in range(6) for _ in range(3)])
+
+    unittest.main()
@@ -0,0 +1,162 @@
+import json
+
+import numpy as np
+
+from lib.engine import FIELD_SIZE, MAX_HPS, SHIP_TYPES
+
+#
+# プレイヤーから見た局面を固定の形の特徴量(5x5の面をいくつも重ねたもの)にする．
+# 多数のゲームの特徴量を1つの配列にまとめて持ち，ゲームごとのupdateでは
+# 確保済みの配列をその場で書き換えるだけなので，ゲームごとに配列を作ることはない．
+# 学習や推論ではencodeで(ゲーム数, 面の数, 5, 5)のfloat32の配列にまとめて取り出す．
+#
+
+#
+# 面の定義．
+#
+#   me_w, me_c, me_s          自分の艦の位置に残りHP/最大HP
+#   enemy_w, enemy_c, enemy_s 相手の艦の残りHP/最大HP(面全体に同じ値)
+#   attacked                  自分が攻撃したマス
+#   hit                       自分の攻撃が命中したマス
+#   near                      自分の攻撃で近くに艦があると報告されたマス(艦の数/3)
+#   enemy_attacked            相手が攻撃したマス
+#   enemy_hit                 相手の攻撃が命中したマス
+#   enemy_near                相手の攻撃で近くに艦があると報告されたマス(艦の数/3)
+#   moved_w_x, moved_w_y, ... 相手の艦が最後に移動した量/4(面全体に同じ値)
+#
+# attacked以降の履歴の面は，updateのたびにdecay倍して古い情報ほど小さくする．
+#
+PLANES = (
+    ("me_w", "me_c", "me_s", "enemy_w", "enemy_c", "enemy_s",
+     "attacked", "hit", "near", "enemy_attacked", "enemy_hit", "enemy_near")
+    + tuple(f"moved_{t}_{axis}" for t in SHIP_TYPES for axis in ("x", "y"))
+)
+
+_ME = PLANES.index("me_w")
+_ENEMY = PLANES.index("enemy_w")
+_HISTORY = PLANES.index("attacked")
+_MOVED = PLANES.index("moved_w_x")
+
+# 艦種の番号．
+_TYPE_INDEX = {t: i for i, t in enumerate(SHIP_TYPES)}
+# 移動量を正規化する値．
+_MAX_DISTANCE = FIELD_SIZE - 1
+
+
+# 多数のゲームの特徴量を持つクラスである．games個のゲームを番号0からgames-1で区別する．
+class ObservationEncoder:
+
+    def __init__(self, games, decay=0.9):
+        self.decay = decay
+        self.state = np.zeros((games, len(PLANES), FIELD_SIZE, FIELD_SIZE), dtype=np.float32)
+
+    # 出力の形．
+    @property
+    def shape(self):
+        return self.state.shape
+
+    # ゲームiの特徴量を消す．新しいゲームを始める時に呼ぶ．iを与えなければすべてのゲームを消す．
+    def reset(self, i=None):
+        if i is None:
+            self.state[...] = 0
+        else:
+            self.state[i] = 0
+
+    #
+    # ゲームiのプレイヤーが受け取ったJSON(Player.updateに渡すもの)を特徴量に反映する．
+    # mineは自分の行動の結果ならTrue，相手の行動の結果ならFalseである．
+    #
+    def update(self, i, message, mine):
+        info = json.loads(message) if isinstance(message, str) else message
+        planes = self.state[i]
+        cond = info["condition"]
+
+        planes[_ME:_ME + 3] = 0
+        for t, ship in cond["me"].items():
+            x, y = ship["position"]
+            planes[_ME + _TYPE_INDEX[t], x, y] = ship["hp"] / MAX_HPS[t]
+        for k, t in enumerate(SHIP_TYPES):
+            ship = cond["enemy"].get(t)
+            planes[_ENEMY + k] = 0 if ship is None else ship["hp"] / MAX_HPS[t]
+
+        planes[_HISTORY:] *= self.decay
+        result = info.get("result")
+        if result is None:
+            return
+        attacked = result.get("attacked")
+        if attacked:
+            x, y = attacked["position"]
+            base = _HISTORY if mine else _HISTORY + 3
+            planes[base, x, y] = 1
+            if "hit" in attacked:
+                planes[base + 1, x, y] = 1
+            if attacked.get("near"):
+                planes[base + 2, x, y] = len(attacked["near"]) / len(SHIP_TYPES)
+        moved = result.get("moved")
+        if moved and not mine:
+            k = _MOVED + 2 * _TYPE_INDEX[moved["ship"]]
+            planes[k] = moved["distance"][0] / _MAX_DISTANCE
+            planes[k + 1] = moved["distance"][1] / _MAX_DISTANCE
+
+    #
+    # ゲームの特徴量をoutに書き出して返す．indicesを与えるとそのゲームだけをその順に書き出す．
+    # outを与えなければ新しく配列を作る．学習のループでは同じoutを使い回す．
+    #
+    def encode(self, out=None, indices=None):
+        if indices is None:
+            if out is None:
+                return self.state.copy()
+            np.copyto(out, self.state)
+            return out
+        if out is None:
+            out = np.empty((len(indices),) + self.state.shape[1:], dtype=self.state.dtype)
+        np.take(self.state, indices, axis=0, out=out)
+        return out
+
+
+if __name__ == '__main__':
+    import unittest
+
+    class ObservationEncoderTest(unittest.TestCase):
+
+        def setUp(self):
+            self.encoder = ObservationEncoder(3, decay=0.5)
+
+        def message(self, result=None):
+            info = {"condition": {"me": {"w": {"hp": 2, "position": [1, 2]}, "s": {"hp": 1, "position": [4, 4]}},
+                                  "enemy": {"w": {"hp": 3}, "c": {"hp": 1}}}}
+            if result is not None:
+                info["result"] = result
+            return json.dumps(info)
+
+        def test_condition(self):
+            self.encoder.update(1, self.message(), True)
+            planes = self.encoder.encode()
+            self.assertEqual(planes.shape, (3, len(PLANES), FIELD_SIZE, FIELD_SIZE))
+            self.assertAlmostEqual(planes[1, PLANES.index("me_w"), 1, 2], 2 / 3)
+            self.assertEqual(planes[1, PLANES.index("me_s"), 4, 4], 1)
+            self.assertEqual(planes[1, PLANES.index("me_c")].sum(), 0)
+            self.assertTrue((planes[1, PLANES.index("enemy_c")] == 0.5).all())
+            self.assertTrue((planes[1, PLANES.index("enemy_s")] == 0).all())
+            self.assertEqual(planes[0].sum(), 0)
+
+        def test_history(self):
+            attack = {"attacked": {"position": [0, 1], "hit": "w", "near": ["c"]}}
+            self.encoder.update(0, self.message(attack), True)
+            self.encoder.update(0, self.message({"moved": {"ship": "c", "distance": [0, -2]}}), False)
+            planes = self.encoder.encode()
+            self.assertEqual(planes[0, PLANES.index("attacked"), 0, 1], 0.5)
+            self.assertEqual(planes[0, PLANES.index("hit"), 0, 1], 0.5)
+            self.assertEqual(planes[0, PLANES.index("enemy_attacked")].sum(), 0)
+            self.assertTrue((planes[0, PLANES.index("moved_c_y")] == -0.5).all())
+
+        def test_encode_into(self):
+            self.encoder.update(2, self.message(), False)
+            out = np.empty((2, len(PLANES), FIELD_SIZE, FIELD_SIZE), dtype=np.float32)
+            self.assertIs(self.encoder.encode(out, indices=[2, 0]), out)
+            self.assertEqual(out[0, PLANES.index("me_s"), 4, 4], 1)
+            self.assertEqual(out[1].sum(), 0)
+            self.encoder.reset(2)
+            self.assertEqual(self.encoder.encode().sum(), 0)
+
+    unittest.main()
@@ -0,0 +1,394 @@
+import json
+import random
+
+#
+# ゲームの規則を処理するエンジン．server.py，visual_server.py，player_base.pyで共通に使う．
+# 大量の対戦を同時にメモリに持てるように，艦と艦隊は__slots__を持つクラスにし，
+# 座標はタプルで保持する．JSONから受け取った座標は入口でタプルに変換する．
+#
+
+# フィールドの大きさを定義している．
+FIELD_SIZE = 5
+
+# 船の種類と最大HPを定義している．
+SHIP_TYPES = ("w", "c", "s")
+MAX_HPS = {"w": 3, "c": 2, "s": 1}
+
+
+#
+# Zobristハッシュの乱数表．(プレイヤー, 艦種, HP, 座標)ごとに64bitの乱数を割り当てる．
+# 局面のハッシュは盤上の艦に対応する乱数の排他的論理和で，行動のたびに差分だけ更新する．
+# どのプロセスでも同じ値になるように種を固定している．
+#
+def _zobrist_table(seed=20240101):
+    rng = random.Random(seed)
+    table = {}
+    for player in range(2):
+        for ship_type in SHIP_TYPES:
+            for hp in range(1, MAX_HPS[ship_type] + 1):
+                for x in range(FIELD_SIZE):
+                    for y in range(FIELD_SIZE):
+                        table[(player, ship_type, hp, (x, y))] = rng.getrandbits(64)
+    return table, (rng.getrandbits(64), rng.getrandbits(64))
+
+
+ZOBRIST, ZOBRIST_SIDE = _zobrist_table()
+
+
+# 与えられた座標がフィールド内かどうかを返す．
+def in_field(position):
+    return 0 <= position[0] < FIELD_SIZE and 0 <= position[1] < FIELD_SIZE
+
+
+# 艦を表すクラスである．
+class Ship:
+    __slots__ = ("type", "position", "hp")
+
+    MAX_HPS = MAX_HPS
+
+    # 種類と場所を与えられる．HPは自動で決まる．
+    def __init__(self, ship_type, position):
+        if ship_type not in MAX_HPS:
+            raise ValueError("invalid type supecified")
+
+        # 種類と座標とHPにアクセスできる．
+        self.type = ship_type
+        self.position = (position[0], position[1])
+        self.hp = MAX_HPS[ship_type]
+
+    # 座標を変更する．
+    def moved(self, to):
+        self.position = (to[0], to[1])
+
+    # ダメージを受けてHPが減る．
+    def damaged(self, d):
+        self.hp -= d
+
+    # 座標が移動できる範囲(縦横)にあるか確認する．
+    def reachable(self, to):
+        return self.position[0] == to[0] or self.position[1] == to[1]
+
+    # 座標が攻撃できる範囲(自分の座標及び周囲1マス)にあるか確認する．
+    def attackable(self, to):
+        return abs(to[0] - self.position[0]) <= 1 and abs(to[1] - self.position[1]) <= 1
+
+
+# プレイヤーの艦隊を表すクラスである．艦を複数保持している．
+class Client:
+    __slots__ = ("ships",)
+
+    FIELD_SIZE = FIELD_SIZE
+
+    #
+    # 艦種ごとに座標を与えられるので，Shipオブジェクトを作成し，連想配列に加える．
+    # 艦のtypeがkeyになる．
+    #
+    def __init__(self, positions):
+        self.ships = {}
+        for ship_type, position in positions.items():
+            position = (position[0], position[1])
+            if self._overlap(position):
+                raise Exception("given overlapping positions")
+            if not in_field(position):
+                raise Exception("given position out of the field")
+            self.ships[ship_type] = Ship(ship_type, position)
+
+    # 艦が座標に移動可能か確かめてから移動させる．相手プレイヤーに渡す情報を連想配列で返す．
+    def move(self, ship_type, to):
+        ship = self.ships.get(ship_type)
+        to = (to[0], to[1])
+
+        if (ship is None) or (not in_field(to)) or (not ship.reachable(to)) or (self._overlap(to) is not None):
+            return False
+
+        distance = [to[0] - ship.position[0], to[1] - ship.position[1]]
+        ship.moved(to)
+        return {"ship": ship_type, "distance": distance}
+
+    #
+    # 攻撃された時の処理．攻撃を受けた艦，あるいは周囲1マスにいる艦を調べ，状態を更新する．
+    # 相手プレイヤーに渡す情報を連想配列で返す．
+    #
+    def attacked(self, to):
+        if not in_field(to):
+            return False
+
+        to = (to[0], to[1])
+        info = {"position": to}
+        ship = self._overlap(to)
+        near = [s.type for s in self.ships.values()
+                if s.position != to and s.attackable(to)]
+
+        if ship is not None:
+            ship.damaged(1)
+            info["hit"] = ship.type
+            if ship.hp == 0:
+                del self.ships[ship.type]
+
+        info["near"] = near
+
+        return info
+
+    # 艦の座標とHPを返す．meで自分かどうかを判定し，違うならpositionは教えない．
+    def condition(self, me):
+        if me:
+            return {ship.type: {"hp": ship.hp, "position": ship.position}
+                    for ship in self.ships.values()}
+        return {ship.type: {"hp": ship.hp} for ship in self.ships.values()}
+
+    # 艦隊の攻撃可能な範囲を返す．
+    def attackable(self, to):
+        return in_field(to) and any(ship.attackable(to) for ship in self.ships.values())
+
+    # 与えられた座標にいる艦を返す．
+    def _overlap(self, position):
+        for ship in self.ships.values():
+            if ship.position == position:
+                return ship
+        return None
+
+    # 与えられた座標がフィールド内かどうかを返す．
+    in_field = staticmethod(in_field)
+
+
+#
+# 処理を行うクラスである．プレイヤー2人を保持している．
+#
+class Server:
+    __slots__ = ("clients", "names", "seeds", "hash")
+
+    #
+    # プレイヤーの配列である．
+    # 行動プレイヤーのインデックスをcとする．
+    # 今プレイヤーが2人であるという前提なので， 待機プレイヤーのインデックスは1-cである．
+    #
+
+    #
+    # 両プレイヤーからJSONを受け取って初期配置を設定する．
+    # JSONに"name"があればプレイヤーの名前として，"seed"があれば乱数の種として取り出す．無ければNoneである．
+    #
+    def __init__(self, json1, json2):
+        positions = (json.loads(json1), json.loads(json2))
+        self.names = tuple(p.pop("name", None) for p in positions)
+        self.seeds = tuple(p.pop("seed", None) for p in positions)
+        self.clients = (Client(positions[0]), Client(positions[1]))
+        # 両プレイヤーの艦の配置とHPのZobristハッシュ．手番は含まない．
+        self.hash = self.full_hash()
+
+    # 勝者が決まった理由を返す．負けた側の艦が残っていれば違反による負けである．
+    def decided_reason(self, winner):
+        return SUNK if len(self.clients[1-winner].ships) == 0 else FOUL
+
+    # 局面のハッシュを最初から計算する．
+    def full_hash(self):
+        h = 0
+        for player, client in enumerate(self.clients):
+            for ship in client.ships.values():
+                h ^= ZOBRIST[(player, ship.type, ship.hp, ship.position)]
+        return h
+
+    # プレイヤーcの手番の局面のハッシュを返す．
+    def position_hash(self, c):
+        return self.hash ^ ZOBRIST_SIDE[c]
+
+    # プレイヤーcの艦の残りHPの合計を返す．
+    def total_hp(self, c):
+        return sum(ship.hp for ship in self.clients[c].ships.values())
+
+    # 初期配置をJSONで返す．
+    def initial_condition(self, c):
+        return [json.dumps(self.condition(c)), json.dumps(self.condition(1-c))]
+
+    #
+    # 可能かどうかチェックしてから攻撃，あるいは移動の処理を行い，両プレイヤーに結果を通知するJSONを作る．
+    # JSONの配列を返す．0番目の要素が行動プレイヤー宛，1番目の要素が待機プレイヤー宛である．
+    # 処理はJSONの解釈，apply，respondに分かれていて，server.pyのトレースではそれぞれを計る．
+    #
+    def action(self, c, json_str):
+        return self.respond(c, self.apply(c, json.loads(json_str)))
+
+    #
+    # 解釈済みの行動actを処理し，各プレイヤーに通知する内容(状態を除く)をプレイヤーの番号順に返す．
+    # 勝敗が決まれば"outcome"が入っている．
+    #
+    def apply(self, c, act):
+        info = [{}, {}]
+        active = self.clients[c]
+        passive = self.clients[1-c]
+        result = False
+
+        if "attack" in act:
+            to = act["attack"]["to"]
+
+            if not active.attackable(to):
+                result = False
+            else:
+                result = passive.attacked(to)
+                if result and "hit" in result:
+                    self._update_hash_hit(1-c, result["hit"], result["position"])
+
+            info[c]["result"] = {"attacked": result}
+            info[1-c]["result"] = {"attacked": result}
+
+            if len(passive.ships) == 0:
+                info[c]["outcome"] = True
+                info[1-c]["outcome"] = False
+
+        elif "move" in act:
+            result = active.move(act["move"]["ship"], act["move"]["to"])
+            info[1-c]["result"] = {"moved": result}
+            if result:
+                self._update_hash_move(c, result["ship"], result["distance"])
+
+        if not result:
+            info[c]["outcome"] = False
+            info[1-c]["outcome"] = True
+
+        return info
+
+    # applyが返した内容に両プレイヤーの状態を加えてJSONにする．順番はactionと同じである．
+    def respond(self, c, info):
+        info[c].update(self.condition(c))
+        info[1-c].update(self.condition(1-c))
+
+        return [json.dumps(info[c]), json.dumps(info[1-c])]
+
+    # プレイヤーpの艦ship_typeが座標toで攻撃を受けた分だけハッシュを更新する．
+    def _update_hash_hit(self, p, ship_type, to):
+        ship = self.clients[p].ships.get(ship_type)
+        hp = 0 if ship is None else ship.hp
+        self.hash ^= ZOBRIST[(p, ship_type, hp + 1, to)]
+        if hp > 0:
+            self.hash ^= ZOBRIST[(p, ship_type, hp, to)]
+
+    # プレイヤーpの艦ship_typeがdistanceだけ移動した分だけハッシュを更新する．
+    def _update_hash_move(self, p, ship_type, distance):
+        ship = self.clients[p].ships[ship_type]
+        before = (ship.position[0] - distance[0], ship.position[1] - distance[1])
+        self.hash ^= ZOBRIST[(p, ship_type, ship.hp, before)] ^ ZOBRIST[(p, ship_type, ship.hp, ship.position)]
+
+    # 自分と相手の状態を連想配列で返す．
+    def condition(self, c):
+        return {
+            "condition": {
+                "me": self.clients[c].condition(True),
+                "enemy": self.clients[1-c].condition(False)
+            }
+        }
+
+
+# 試合が終わった理由．
+SUNK = "sunk"
+FOUL = "foul"
+TURNS = "turns"
+REPETITION = "repetition"
+QUIET = "quiet"
+
+
+#
+# 同じ局面の繰り返しや膠着による引き分けを判定するクラスである．1試合ごとに作る．
+# 手番を含めて同じ局面がrepetitions回現れるか，quiet_turnsターンの間どちらの艦もダメージを
+# 受けなければ引き分けとする．0を与えた条件は使わない．
+# adjudicateなら，決着がつかなかった時に残りHPの合計が多い方を勝ちとする．
+#
+class DrawRule:
+    __slots__ = ("repetitions", "quiet_turns", "adjudicate", "_counts", "_quiet", "_hp")
+
+    def __init__(self, repetitions=0, quiet_turns=0, adjudicate=False):
+        self.repetitions = repetitions
+        self.quiet_turns = quiet_turns
+        self.adjudicate = adjudicate
+        # 局面のハッシュごとの出現回数．
+        self._counts = {}
+        # ダメージが無いまま続いたターン数と，その間の残りHPの合計．
+        self._quiet = 0
+        self._hp = None
+
+    # 試合開始時の局面を登録する．cは先手のプレイヤーである．
+    def start(self, server, c):
+        self.update(server, 1-c)
+
+    # プレイヤーcの行動を処理した後に呼ぶ．引き分けならその理由を，そうでなければNoneを返す．
+    def update(self, server, c):
+        if self.repetitions > 0:
+            key = server.position_hash(1-c)
+            n = self._counts.get(key, 0) + 1
+            self._counts[key] = n
+            if n >= self.repetitions:
+                return REPETITION
+
+        if self.quiet_turns > 0:
+            hp = server.total_hp(0) + server.total_hp(1)
+            if hp == self._hp:
+                self._quiet += 1
+            else:
+                self._hp = hp
+                self._quiet = 0
+            if self._quiet >= self.quiet_turns:
+                return QUIET
+
+        return None
+
+    # 決着がつかなかった時の勝者を返す．判定しない時や残りHPが同じ時は-1を返す．
+    def adjudicated_winner(self, server):
+        if not self.adjudicate:
+            return -1
+        hps = (server.total_hp(0), server.total_hp(1))
+        if hps[0] == hps[1]:
+            return -1
+        return 0 if hps[0] > hps[1] else 1
+
+
+if __name__ == '__main__':
+    import unittest
+
+    class ShipTest(unittest.TestCase):
+
+        def test_attackable(self):
+            w = Ship("w", [2, 2])
+            self.assertTrue(w.attackable((3, 3)))
+            self.assertTrue(w.attackable([1, 2]))
+            self.assertFalse(w.attackable((0, 2)))
+            self.assertFalse(w.attackable((4, 4)))
+
+    class ServerTest(unittest.TestCase):
+
+        def setUp(self):
+            self.server = Server(json.dumps({"w": [0, 0], "c": [0, 1], "s": [1, 0]}),
+                                 json.dumps({"w": [4, 4], "c": [4, 3], "s": [1, 1]}))
+
+        def test_hash_follows_actions(self):
+            self.server.action(0, json.dumps({"attack": {"to": [1, 1]}}))
+            self.assertEqual(self.server.full_hash(), self.server.hash)
+            self.server.action(1, json.dumps({"move": {"ship": "w", "to": [4, 0]}}))
+            self.assertEqual(self.server.full_hash(), self.server.hash)
+            self.server.action(0, json.dumps({"attack": {"to": [1, 0]}}))
+            self.assertEqual(self.server.full_hash(), self.server.hash)
+
+        def test_far_attack_is_foul(self):
+            results = self.server.action(0, json.dumps({"attack": {"to": [4, 4]}}))
+            self.assertFalse(json.loads(results[0])["outcome"])
+            self.assertEqual(FOUL, self.server.decided_reason(1))
+
+        def test_repetition(self):
+            rule = DrawRule(repetitions=2)
+            rule.start(self.server, 0)
+            moves = [(0, "w", [0, 2]), (1, "w", [4, 2]), (0, "w", [0, 0]), (1, "w", [4, 4])]
+            drawn = None
+            for c, ship, to in moves:
+                self.server.action(c, json.dumps({"move": {"ship": ship, "to": to}}))
+                drawn = rule.update(self.server, c)
+            self.assertEqual(REPETITION, drawn)
+
+        def test_quiet_and_adjudicate(self):
+            rule = DrawRule(quiet_turns=2, adjudicate=True)
+            rule.start(self.server, 0)
+            self.server.action(0, json.dumps({"attack": {"to": [1, 1]}}))
+            self.assertIsNone(rule.update(self.server, 0))
+            self.server.action(1, json.dumps({"move": {"ship": "w", "to": [4, 0]}}))
+            self.assertIsNone(rule.update(self.server, 1))
+            self.server.action(0, json.dumps({"move": {"ship": "w", "to": [0, 4]}}))
+            self.assertEqual(QUIET, rule.update(self.server, 0))
+            self.assertEqual(0, rule.adjudicated_winner(self.server))
+
+    unittest.main()
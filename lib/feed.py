@@ -0,0 +1,206 @@
+import itertools
+import json
+import os
+import socket
+import time
+from collections import OrderedDict
+
+#
+# サーバの試合の進み具合をUDPのデータグラムで送り，visual_server.pyの--dashboardで表示する．
+# 1つのデータグラムは次のどちらかのJSONである．keyは"プロセスID-試合の番号"で試合を区別する．
+#
+#   {"key": key, "turn": ターン数, "c": 行動プレイヤー, "results": [プレイヤー1への結果, プレイヤー2への結果]}
+#   {"key": key, "message": 試合の結果}
+#
+# 受け手がいなかったり遅れたりしても試合は止まらず，届かなかった盤面は表示されないだけである．
+#
+
+# 1つのデータグラムの大きさの上限．
+MAX_DATAGRAM = 65507
+
+# このプロセスで始めた試合の番号．
+_matches = itertools.count()
+
+
+# "host:port"を(host, port)にする．
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+# 1試合の進み具合をaddressに送るクラスである．
+class MatchFeed:
+
+    def __init__(self, address):
+        self.address = address
+        self.key = f"{os.getpid()}-{next(_matches)}"
+        # 送った盤面の数．
+        self.turns = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Server.actionの結果resultsと行動プレイヤーcを送る．ターン数は送った盤面の数である．
+    def report(self, c, results):
+        self._send({"key": self.key, "turn": self.turns, "c": c, "results": list(results)})
+        self.turns += 1
+
+    # 試合の結果を送る．
+    def end(self, message):
+        self._send({"key": self.key, "message": message})
+
+    def close(self):
+        self._sock.close()
+
+    def _send(self, message):
+        try:
+            self._sock.sendto(json.dumps(message).encode("utf-8"), self.address)
+        except OSError:
+            pass
+
+
+#
+# データグラムの中身がMatchFeedの送る形ならTrueを返す．盤面の結果は描く時に読むので，
+# ここでJSONとして読めて自分の艦の状態があることまで確かめる．
+#
+def _valid(message):
+    if not isinstance(message, dict) or not isinstance(message.get("key"), str):
+        return False
+    if "message" in message:
+        return isinstance(message["message"], str)
+    results = message.get("results")
+    if not (isinstance(message.get("turn"), int) and message.get("c") in (0, 1)
+            and isinstance(results, list) and len(results) == 2):
+        return False
+    try:
+        return all(isinstance(json.loads(result)["condition"]["me"], dict) for result in results)
+    except (ValueError, TypeError, KeyError):
+        return False
+
+
+# addressで待ち受けて，MatchFeedが送ったデータグラムを受け取るクラスである．
+class FeedReceiver:
+
+    def __init__(self, address):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(address)
+        self.address = self._sock.getsockname()
+
+    #
+    # 次のデータグラムを連想配列で返す．途中で切れたものや関係の無いものなど，
+    # MatchFeedの送る形でないデータグラムは読み飛ばす．timeout秒待っても届かなければNoneを返す．
+    #
+    def receive(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._sock.settimeout(None if deadline is None else max(deadline - time.monotonic(), 0.001))
+            try:
+                data = self._sock.recv(MAX_DATAGRAM)
+            except socket.timeout:
+                return None
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            if _valid(message):
+                return message
+
+    def close(self):
+        self._sock.close()
+
+
+#
+# 試合をN個の盤面に割り当てるクラスである．新しい試合には空いている盤面，
+# 無ければ終わった試合の盤面，それも無ければ最も長く更新のない試合の盤面を割り当てる．
+#
+class Boards:
+
+    def __init__(self, n):
+        self._free = list(range(n))
+        # 進行中の試合のkeyから盤面への連想配列．更新の古い順に並ぶ．
+        self._active = OrderedDict()
+        # 終わった試合の盤面．終わった順に並ぶ．
+        self._finished = OrderedDict()
+
+    # 試合keyの盤面の番号を返す．
+    def board(self, key):
+        if key in self._active:
+            self._active.move_to_end(key)
+            return self._active[key]
+        if key in self._finished:
+            return self._finished[key]
+        if self._free:
+            board = self._free.pop(0)
+        elif self._finished:
+            _, board = self._finished.popitem(last=False)
+        else:
+            _, board = self._active.popitem(last=False)
+        self._active[key] = board
+        return board
+
+    # 試合keyが終わったことを記録し，その盤面の番号を返す．
+    def finish(self, key):
+        board = self.board(key)
+        if key not in self._active:
+            return board
+        del self._active[key]
+        self._finished[key] = board
+        return board
+
+
+if __name__ == '__main__':
+    import unittest
+
+    class FeedTest(unittest.TestCase):
+
+        def test_parse_address(self):
+            self.assertEqual(parse_address("localhost:2001"), ("localhost", 2001))
+            self.assertEqual(parse_address(":2001"), ("127.0.0.1", 2001))
+
+        def test_send(self):
+            receiver = FeedReceiver(("127.0.0.1", 0))
+            feed = MatchFeed(receiver.address)
+            first = json.dumps({"condition": {"me": {"w": {"hp": 3, "position": [0, 0]}}, "enemy": {}}})
+            second = json.dumps({"condition": {"me": {}, "enemy": {}}})
+            feed.report(0, (first, first))
+            feed.report(1, (first, second))
+            feed.end("PLAYER 2 WIN")
+            self.assertEqual(receiver.receive(5)["turn"], 0)
+            self.assertEqual(receiver.receive(5), {"key": feed.key, "turn": 1, "c": 1,
+                                                   "results": [first, second]})
+            self.assertEqual(receiver.receive(5), {"key": feed.key, "message": "PLAYER 2 WIN"})
+            self.assertIsNone(receiver.receive(0.01))
+            self.assertNotEqual(MatchFeed(receiver.address).key, feed.key)
+            receiver.close()
+            # 受け手がいなくても送れる
+            feed.report(0, ("{}", "{}"))
+            feed.close()
+
+        def test_skip_bad_datagrams(self):
+            receiver = FeedReceiver(("127.0.0.1", 0))
+            condition = json.dumps({"condition": {"me": {}, "enemy": {}}})
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                for data in (b'{"key": "1-0", "turn"', b"\xff\xfe", b"[1, 2]", b'{"key": "1-0"}',
+                             json.dumps({"key": "1-0", "turn": 0, "c": 0, "results": ["{", "{}"]}).encode(),
+                             json.dumps({"key": "1-0", "turn": 0, "c": 2, "results": [condition] * 2}).encode()):
+                    sock.sendto(data, receiver.address)
+                feed = MatchFeed(receiver.address)
+                feed.report(1, (condition, condition))
+                self.assertEqual(receiver.receive(5), {"key": feed.key, "turn": 0, "c": 1,
+                                                       "results": [condition, condition]})
+                sock.sendto(b"garbage", receiver.address)
+                self.assertIsNone(receiver.receive(0.05))
+            feed.close()
+            receiver.close()
+
+        def test_boards(self):
+            boards = Boards(2)
+            self.assertEqual([boards.board(k) for k in ("a", "b", "a")], [0, 1, 0])
+            # 盤面が足りなければ最も長く更新のない試合の盤面を使う
+            self.assertEqual(boards.board("c"), 1)
+            self.assertEqual(boards.finish("a"), 0)
+            self.assertEqual(boards.board("a"), 0)
+            self.assertEqual(boards.finish("a"), 0)
+            # 終わった試合の盤面は進行中の試合より先に使う
+            self.assertEqual(boards.board("d"), 0)
+            self.assertEqual(boards.board("e"), 1)
+
+    unittest.main()
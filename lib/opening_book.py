@@ -0,0 +1,138 @@
+import functools
+import json
+import random
+
+#
+# 自己対戦で評価した初期配置の定跡(オープニングブック)を扱う．
+# 定跡ファイルはtools/build_opening_book.pyで事前に作っておく．
+# 配置ごとの勝率で重み付けしたエイリアス表を読み込み時に作るので，抽選はO(1)である．
+#
+
+
+# 配置の評価値．引き分けを半分の勝ちとして数え，対戦数が少ない配置は0.5に寄せる．
+def score(entry):
+    return (entry["wins"] + 0.5 * entry["draws"] + 1) / (entry["games"] + 2)
+
+
+# 定跡を表すクラスである．
+class OpeningBook:
+
+    # 艦の種類．配置の連想配列のkeyになる．
+    SHIP_TYPES = ("w", "c", "s")
+
+    #
+    # 評価値の高い順に並んだ配置の一覧を与えられる．topを与えると上位top件だけから抽選する．
+    #
+    def __init__(self, entries, top=None):
+        self.entries = entries if top is None else entries[:top]
+        if len(self.entries) == 0:
+            raise ValueError("empty opening book")
+        self._build_alias([score(entry) for entry in self.entries])
+
+    # 定跡ファイルを読み込む．同じファイルは一度しか読まない．
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def load(path, top=None):
+        with open(path) as f:
+            book = json.load(f)
+        return OpeningBook(book["placements"], top=top)
+
+    # 評価値で重み付けして配置を1つ選び，initial_conditionと同じ形の連想配列で返す．
+    def sample(self, rng=random):
+        i = rng.randrange(len(self.entries))
+        if rng.random() >= self._prob[i]:
+            i = self._alias[i]
+        entry = self.entries[i]
+        return {t: list(entry[t]) for t in OpeningBook.SHIP_TYPES}
+
+    # 配置の統計を評価値の高い順に並べて定跡ファイルに書き出す．metaはそのまま保存される．
+    @staticmethod
+    def write(path, entries, **meta):
+        book = dict(meta)
+        book["placements"] = sorted(entries, key=score, reverse=True)
+        with open(path, "w") as f:
+            json.dump(book, f)
+
+    # Walkerのエイリアス法の表を作る．
+    def _build_alias(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self._prob = [1.0] * n
+        self._alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import unittest
+
+    # 勝ち数の違う配置の一覧．
+    def entries(wins):
+        return [{"w": [0, k], "c": [1, k], "s": [2, k], "games": 10, "wins": w, "draws": 0}
+                for k, w in enumerate(wins)]
+
+    class OpeningBookTest(unittest.TestCase):
+
+        # エイリアス表が表す各配置の確率．
+        def table_probabilities(self, book):
+            n = len(book.entries)
+            p = [book._prob[i] / n for i in range(n)]
+            for i in range(n):
+                p[book._alias[i]] += (1.0 - book._prob[i]) / n
+            return p
+
+        def test_alias_table(self):
+            for wins in ([10, 0], [1, 2, 3, 4, 5], [0, 0, 0], [10, 9, 0, 0, 0, 0, 0, 7]):
+                book = OpeningBook(entries(wins))
+                total = sum(score(e) for e in book.entries)
+                for p, e in zip(self.table_probabilities(book), book.entries):
+                    self.assertAlmostEqual(p, score(e) / total)
+
+        def test_sample_frequency(self):
+            book = OpeningBook(entries([10, 6, 3, 0]))
+            rng = random.Random(1)
+            n = 200000
+            counts = {}
+            for _ in range(n):
+                placement = book.sample(rng)
+                counts[placement["w"][1]] = counts.get(placement["w"][1], 0) + 1
+            total = sum(score(e) for e in book.entries)
+            for k, e in enumerate(book.entries):
+                self.assertAlmostEqual(counts[k] / n, score(e) / total, delta=0.005)
+
+        def test_sample_shape(self):
+            placement = OpeningBook(entries([3])).sample(random.Random(0))
+            self.assertEqual(placement, {"w": [0, 0], "c": [1, 0], "s": [2, 0]})
+
+        def test_write_and_load(self):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "book.json")
+                OpeningBook.write(path, entries([1, 9, 5]), opponent="RandomPlayer", games=10)
+                with open(path) as f:
+                    book = json.load(f)
+                self.assertEqual((book["opponent"], book["games"]), ("RandomPlayer", 10))
+                # 評価値の高い順に並ぶ
+                self.assertEqual([e["wins"] for e in book["placements"]], [9, 5, 1])
+                loaded = OpeningBook.load(path)
+                self.assertIs(OpeningBook.load(path), loaded)
+                self.assertEqual(loaded.entries, book["placements"])
+                self.assertEqual([e["wins"] for e in OpeningBook.load(path, top=2).entries], [9, 5])
+
+        def test_empty(self):
+            with self.assertRaises(ValueError):
+                OpeningBook([])
+
+    unittest.main()
@@ -1,42 +1,37 @@
 import json
+import os
+import sys
 
+# python lib/player_base.py としてテストを実行した時もlibを読めるようにする
+sys.path.append(os.getcwd())
 
-# プレイヤーの船を表すクラスである．
-class PlayerShip:
-    # 船の種類と最大HPを定義している．
-    MAX_HPS = {"w": 3, "c": 2, "s": 1}
+from lib.engine import FIELD_SIZE, Ship, in_field
 
-    # 種類と場所を与えられる．HPは自動で決まる．
-    def __init__(self, ship_type, position):
-        if ship_type not in PlayerShip.MAX_HPS:
-            raise ValueError('invalid type supecified')
 
-        self.type = ship_type
-        self.position = position
-        self.hp = PlayerShip.MAX_HPS[ship_type]
-
-    # 座標を変更する．
-    def moved(self, to):
-        self.position = to
-
-    # ダメージを受けてHPが減る．
-    def damaged(self, d):
-        self.hp -= d
+# プレイヤーの船を表すクラスである．規則の処理はエンジンのShipと共通である．
+class PlayerShip(Ship):
+    __slots__ = ()
 
     # 座標が移動できる範囲(縦横)にあるか確認する．
     def can_reach(self, to):
-        return self.position[0] == to[0] or self.position[1] == to[1]
+        return self.reachable(to)
 
     # 座標が攻撃できる範囲(自分の座標及び周囲1マス)にあるか確認する．
     def can_attack(self, to):
-        return abs(to[0] - self.position[0]) <= 1\
-            and abs(to[1] - self.position[1]) <= 1
+        return self.attackable(to)
 
 
 # プレイヤーを表すクラスである．艦を複数保持している．
 class Player:
     # フィールドの大きさを定義している．
-    FIELD_SIZE = 5
+    FIELD_SIZE = FIELD_SIZE
+
+    # プレイヤーの名前．Noneでなければ初期配置と一緒にサーバに送り，対戦記録に使われる．
+    name = None
+    # プレイヤーを作った乱数の種．Noneでなければ初期配置と一緒にサーバに送り，対戦記録に残る．
+    seed = None
+    # 対戦相手の名前．名前を送ったプレイヤーにだけ，最初の行動の前にサーバから届く．
+    opponent = None
 
     #
     # 艦種ごとに座標を与えられるので，Shipオブジェクトを作成し，連想配列に加える．
@@ -49,12 +44,31 @@ class Player:
     # 初期状態をJSONで返す．
     def initial_condition(self):
         cond = {ship.type: ship.position for ship in self.ships.values()}
+        if self.name is not None:
+            cond["name"] = self.name
+        if self.seed is not None:
+            cond["seed"] = self.seed
         return json.dumps(cond)
 
+    #
+    # 対戦相手の名前nameを受け取る．最初のactionやupdateより前に呼ばれる．名前を送ってこなかった
+    # 相手ならNoneである．lib.profiles.ProfileStoreから相手の傾向を読むなら，ここで読むとよい．
+    #
+    def meet(self, name):
+        self.opponent = name
+
     # 行動する．行動を決定するアルゴリズムはサブクラスでそれぞれ記述するべきなので抽象メソッドである．
     def action(self):
         pass
 
+    #
+    # 相手の手番の間に別のスレッドで呼ばれる．探索を先に進めておくなど，次の行動の準備に使う．
+    # stop(threading.Event)が立ったらすぐに戻ること．戻るまでupdateは呼ばれないので，
+    # ここで作った結果はupdateやactionでそのまま使える．既定では何もしない．
+    #
+    def ponder(self, stop):
+        pass
+
     # 通知された情報で艦の状態を更新する．
     def update(self, json_):
         cond = json.loads(json_)['condition']['me']
@@ -63,7 +77,7 @@ class Player:
                 self.ships.pop(ship_type)
             else:
                 self.ships[ship_type].hp = cond[ship_type]['hp']
-                self.ships[ship_type].position = cond[ship_type]['position']
+                self.ships[ship_type].moved(cond[ship_type]['position'])
 
     # 移動の処理を行い，連想配列で結果を返す．
     def move(self, ship_type, to):
@@ -87,15 +101,14 @@ class Player:
     # 艦隊の攻撃可能な範囲を返す．
     def can_attack(self, to):
         return Player.in_field(to)\
-            and any([ship.can_attack(to) for ship in self.ships.values()])
+            and any(ship.can_attack(to) for ship in self.ships.values())
 
     # 与えられた座標がフィールドないかどうかを返す．
-    def in_field(position):
-        return position[0] < Player.FIELD_SIZE and position[1] < Player.FIELD_SIZE\
-            and position[0] >= 0 and position[1] >= 0
+    in_field = staticmethod(in_field)
 
     # 与えられた座標にいる艦を返す．
     def overlap(self, position):
+        position = (position[0], position[1])
         for ship in self.ships.values():
             if ship.position == position:
                 return ship
@@ -112,12 +125,12 @@ if __name__ == '__main__':
             w = PlayerShip('w', [1, 1])
             self.assertEqual("w", w.type)
             self.assertEqual(3, w.hp)
-            self.assertEqual([1, 1], w.position)
+            self.assertEqual((1, 1), w.position)
 
         def test_moved(self):
             w = PlayerShip("w", [1, 1])
             w.moved([1, 2])
-            self.assertEqual(w.position, [1, 2])
+            self.assertEqual(w.position, (1, 2))
 
         def test_damaged(self):
             w = PlayerShip("w", [1, 1])
@@ -141,9 +154,9 @@ if __name__ == '__main__':
 
         def test_init(self):
             p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
-            self.assertEqual([0, 0], p.ships["w"].position)
-            self.assertEqual([0, 1], p.ships["c"].position)
-            self.assertEqual([1, 0], p.ships["s"].position)
+            self.assertEqual((0, 0), p.ships["w"].position)
+            self.assertEqual((0, 1), p.ships["c"].position)
+            self.assertEqual((1, 0), p.ships["s"].position)
 
         def test_initial_condition(self):
             p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
@@ -172,7 +185,7 @@ if __name__ == '__main__':
             })
             p.update(json_)
             self.assertEqual(2, p.ships["w"].hp)
-            self.assertEqual([0, 4], p.ships["c"].position)
+            self.assertEqual((0, 4), p.ships["c"].position)
 
         def test_move(self):
             p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
@@ -182,7 +195,7 @@ if __name__ == '__main__':
                     "to": [0, 2]
                 }
             }, p.move("w", [0, 2]))
-            self.assertEqual([0, 2], p.ships["w"].position)
+            self.assertEqual((0, 2), p.ships["w"].position)
 
         def test_attack(self):
             p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
@@ -0,0 +1,320 @@
+import os
+import struct
+from array import array
+from collections import OrderedDict
+
+from lib.engine import FIELD_SIZE, SHIP_TYPES
+
+#
+# 対戦相手ごとの傾向(初期配置の頻度，移動と攻撃の割合，攻撃する位置の偏り)を試合をまたいで蓄積する．
+# ファイルには相手ごとに固定長のレコードを並べ，よく使う相手のレコードだけを
+# LRUキャッシュに持つ．キャッシュから追い出す時に変更があれば書き戻す．
+#
+# レコードは名前(NAME_SIZEバイト，UTF-8で0埋め)に続いて次の符号なし32bit整数を並べたものである．
+#
+#   games       試合数
+#   moves       移動の回数
+#   attacks     攻撃の回数
+#   placements  艦種ごとに初期配置したマスの回数(3 * 25)
+#   offsets     攻撃したマスの，攻撃できる自分の艦からの相対位置の回数(3 * 3)
+#
+
+# ファイルの先頭に置く識別子．
+MAGIC = b"SUBPF001"
+NAME_SIZE = 32
+
+CELLS = FIELD_SIZE * FIELD_SIZE
+_FIELDS = (("games", 1), ("moves", 1), ("attacks", 1),
+           ("placements", len(SHIP_TYPES) * CELLS), ("offsets", 9))
+_COUNTS = sum(n for _, n in _FIELDS)
+_HEADER = struct.Struct("<8sI")
+RECORD_SIZE = NAME_SIZE + 4 * _COUNTS
+
+
+# 名前をレコードに書くバイト列にする．文字列でないか長すぎる名前はValueErrorを送出する．
+def _encode_name(name):
+    if not isinstance(name, str):
+        raise ValueError(f"name {name!r} is not a string")
+    encoded = name.encode("utf-8")
+    if len(encoded) > NAME_SIZE:
+        raise ValueError(f"name {name} is longer than {NAME_SIZE} bytes")
+    return encoded
+
+
+# 1人の対戦相手の統計を表すクラスである．
+class Profile:
+
+    def __init__(self, name, counts=None):
+        self.name = name
+        self.counts = array("I", bytes(4 * _COUNTS)) if counts is None else counts
+        offset = 0
+        self._slices = {}
+        for field, n in _FIELDS:
+            self._slices[field] = (offset, offset + n)
+            offset += n
+
+    def _field(self, field):
+        start, stop = self._slices[field]
+        return self.counts[start:stop]
+
+    @property
+    def games(self):
+        return self.counts[0]
+
+    # 初期配置(艦種 -> 座標)を記録する．
+    def record_placement(self, placement):
+        start = self._slices["placements"][0]
+        for k, t in enumerate(SHIP_TYPES):
+            if t in placement:
+                x, y = placement[t]
+                self.counts[start + k * CELLS + x * FIELD_SIZE + y] += 1
+
+    #
+    # 行動を記録する．shipsはその時の自分の艦の座標のリストで，攻撃なら
+    # 攻撃したマスを最初に攻撃が届く艦からの相対位置として数える．
+    #
+    def record_action(self, act, ships):
+        if "move" in act:
+            self.counts[1] += 1
+        elif "attack" in act:
+            self.counts[2] += 1
+            to = act["attack"]["to"]
+            for x, y in ships:
+                dx, dy = to[0] - x, to[1] - y
+                if abs(dx) <= 1 and abs(dy) <= 1:
+                    self.counts[self._slices["offsets"][0] + (dx + 1) * 3 + (dy + 1)] += 1
+                    break
+
+    # 別の統計を足し込む．
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+
+    # 攻撃を選ぶ割合．記録がなければpriorを返す．
+    def attack_rate(self, prior=0.5):
+        total = self.counts[1] + self.counts[2]
+        return prior if total == 0 else self.counts[2] / total
+
+    # 艦種ship_typeを各マスに配置する確率を25マス分返す．smoothingは各マスに足す仮の回数である．
+    def placement_prior(self, ship_type, smoothing=1.0):
+        start = self._slices["placements"][0] + SHIP_TYPES.index(ship_type) * CELLS
+        counts = self.counts[start:start + CELLS]
+        total = sum(counts) + smoothing * CELLS
+        return [(n + smoothing) / total for n in counts]
+
+    # 攻撃の相対位置(dx, dy)ごとの確率を3x3のリストで返す．
+    def offset_prior(self, smoothing=1.0):
+        counts = self._field("offsets")
+        total = sum(counts) + smoothing * 9
+        return [[(counts[(dx + 1) * 3 + (dy + 1)] + smoothing) / total for dy in (-1, 0, 1)]
+                for dx in (-1, 0, 1)]
+
+
+#
+# 1試合の間，両プレイヤーの行動をサーバ側で記録するクラスである．
+# 行動をServer.applyに渡す前にactionを呼ぶ．
+#
+class ProfileRecorder:
+
+    def __init__(self, server, names):
+        self.profiles = [Profile(name) for name in names]
+        for profile, client in zip(self.profiles, server.clients):
+            profile.counts[0] = 1
+            profile.record_placement({t: ship.position for t, ship in client.ships.items()})
+        self._server = server
+
+    def action(self, c, act):
+        ships = [ship.position for ship in self._server.clients[c].ships.values()]
+        self.profiles[c].record_action(act, ships)
+
+
+#
+# 対戦相手の統計をファイルに保存し，LRUキャッシュを通して読み書きするクラスである．
+# capacityはキャッシュに持つ相手の数．同時に書き込むのは1つのプロセスだけにすること．
+# readonlyなら読むだけで，ファイルが無くても作らない．
+#
+class ProfileStore:
+
+    def __init__(self, path, capacity=1024, readonly=False):
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        self.path = path
+        self.capacity = capacity
+        self.readonly = readonly
+        if not readonly and not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, RECORD_SIZE))
+        self._file = open(path, "rb" if readonly else "r+b")
+        magic, record_size = _HEADER.unpack(self._file.read(_HEADER.size))
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            raise ValueError(f"{path} is not a profile store of this version")
+
+        # 名前からレコードの番号への索引．名前だけを読んで作る．
+        self._slots = {}
+        size = os.path.getsize(path) - _HEADER.size
+        for slot in range(size // RECORD_SIZE):
+            self._file.seek(self._offset(slot))
+            name = self._file.read(NAME_SIZE).rstrip(b"\0").decode("utf-8")
+            self._slots[name] = slot
+
+        self._cache = OrderedDict()
+        self._dirty = set()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, name):
+        return name in self._slots
+
+    # 名前の一覧．
+    def names(self):
+        return list(self._slots)
+
+    # 相手nameの統計を返す．記録がなければ空の統計を返す(ファイルには書かない)．
+    def get(self, name):
+        profile = self._cache.get(name)
+        if profile is not None:
+            self._cache.move_to_end(name)
+            return profile
+        slot = self._slots.get(name)
+        if slot is None:
+            return Profile(name)
+        self._file.seek(self._offset(slot) + NAME_SIZE)
+        counts = array("I")
+        counts.frombytes(self._file.read(4 * _COUNTS))
+        profile = Profile(name, counts)
+        self._insert(profile)
+        return profile
+
+    #
+    # 1試合分などの統計を相手nameの統計に足し込む．
+    # 書けない名前はここでValueErrorにし，他の相手の書き戻しを巻き込まないようにする．
+    #
+    def add(self, profile):
+        if self.readonly:
+            raise ValueError(f"{self.path} is opened read-only")
+        _encode_name(profile.name)
+        stored = self.get(profile.name)
+        stored.merge(profile)
+        if profile.name not in self._cache:
+            self._insert(stored)
+        self._dirty.add(profile.name)
+
+    # 変更のあった統計をすべて書き戻す．
+    def flush(self):
+        for name in list(self._dirty):
+            self._write(self._cache[name])
+        self._dirty.clear()
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _offset(self, slot):
+        return _HEADER.size + slot * RECORD_SIZE
+
+    # キャッシュに入れる．あふれたら最も長く使っていないものを追い出し，変更があれば書き戻す．
+    def _insert(self, profile):
+        self._cache[profile.name] = profile
+        self._cache.move_to_end(profile.name)
+        while len(self._cache) > self.capacity:
+            name, evicted = self._cache.popitem(last=False)
+            if name in self._dirty:
+                self._write(evicted)
+                self._dirty.discard(name)
+
+    def _write(self, profile):
+        encoded = _encode_name(profile.name)
+        slot = self._slots.get(profile.name)
+        if slot is None:
+            slot = len(self._slots)
+            self._slots[profile.name] = slot
+        self._file.seek(self._offset(slot))
+        self._file.write(encoded.ljust(NAME_SIZE, b"\0") + profile.counts.tobytes())
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    class ProfileStoreTest(unittest.TestCase):
+
+        def setUp(self):
+            self.directory = tempfile.TemporaryDirectory()
+            self.path = os.path.join(self.directory.name, "profiles.bin")
+
+        def tearDown(self):
+            self.directory.cleanup()
+
+        def profile(self, name):
+            profile = Profile(name)
+            profile.counts[0] = 1
+            profile.record_placement({"w": (0, 0), "c": (4, 4)})
+            profile.record_action({"attack": {"to": [1, 0]}}, [(0, 0)])
+            profile.record_action({"move": {"ship": "w", "to": [0, 3]}}, [(0, 0)])
+            return profile
+
+        def test_record(self):
+            profile = self.profile("a")
+            self.assertEqual(profile.attack_rate(), 0.5)
+            self.assertGreater(profile.placement_prior("w")[0], profile.placement_prior("w")[1])
+            offsets = profile.offset_prior()
+            self.assertEqual(max(max(row) for row in offsets), offsets[2][1])
+
+        def test_persist_and_evict(self):
+            with ProfileStore(self.path, capacity=2) as store:
+                for name in ("a", "b", "c", "a"):
+                    store.add(self.profile(name))
+                self.assertEqual(list(store._cache), ["c", "a"])
+                self.assertEqual(store.get("a").games, 2)
+                # 追い出されたbは書き戻されている
+                self.assertEqual(store.get("b").games, 1)
+            with ProfileStore(self.path) as store:
+                self.assertEqual(sorted(store.names()), ["a", "b", "c"])
+                self.assertEqual(store.get("a").games, 2)
+                self.assertEqual(store.get("c").counts[2], 1)
+                self.assertEqual(store.get("unknown").games, 0)
+                self.assertNotIn("unknown", store)
+            self.assertEqual(os.path.getsize(self.path), _HEADER.size + 3 * RECORD_SIZE)
+
+        def test_bad_name(self):
+            with ProfileStore(self.path, capacity=1) as store:
+                store.add(self.profile("a"))
+                for name in ("x" * (NAME_SIZE + 1), 7):
+                    with self.assertRaises(ValueError):
+                        store.add(self.profile(name))
+                # 追い出しや書き戻しで失敗せず，aは残る
+                store.add(self.profile("b"))
+            with ProfileStore(self.path, readonly=True) as store:
+                self.assertEqual(sorted(store.names()), ["a", "b"])
+
+        def test_capacity(self):
+            with self.assertRaises(ValueError):
+                ProfileStore(self.path, capacity=0)
+            self.assertFalse(os.path.exists(self.path))
+            with ProfileStore(self.path, capacity=1) as store:
+                store.add(self.profile("a"))
+                store.add(self.profile("b"))
+                store.flush()
+            with ProfileStore(self.path, readonly=True) as store:
+                self.assertEqual(sorted(store.names()), ["a", "b"])
+
+        def test_readonly(self):
+            with self.assertRaises(FileNotFoundError):
+                ProfileStore(self.path, readonly=True)
+            self.assertFalse(os.path.exists(self.path))
+            with ProfileStore(self.path) as store:
+                store.add(self.profile("a"))
+            with ProfileStore(self.path, readonly=True) as store:
+                self.assertEqual(store.get("a").games, 1)
+                with self.assertRaises(ValueError):
+                    store.add(self.profile("a"))
+
+    unittest.main()
@@ -0,0 +1,387 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections import Counter
+from itertools import compress
+
+from lib.engine import FIELD_SIZE, FOUL, QUIET, REPETITION, SHIP_TYPES, SUNK, TURNS
+
+#
+# 試合結果を固定長のレコードとして列ごとのファイルに追記し，メモリマップして集計する．
+# 列は型ごとにそのまま並べただけのファイルなので，NumPyのmemmapでも読める．
+# 書き込むのは1つのプロセスだけにすること(server.pyの監視プロセスやツールの親プロセス)．
+# 列は1つずつ追記するので，書き込みの途中で止まると列によってレコードの数が違うことがある．
+# 読む時は揃っているレコードだけを数え，次に書き込む時に揃っていない分を切り詰める．
+#
+
+# 試合が終わった理由．列にはこの添字を保存する．
+REASONS = (SUNK, FOUL, TURNS, REPETITION, QUIET)
+
+# 該当するターンが無いことを表す値．
+NO_TURN = 0xFFFF
+# 艦が無いことを表すマスの番号．
+NO_CELL = 0xFF
+# 名前の無いプレイヤーの番号．
+NO_PLAYER = 0xFFFF
+# 乱数の種が無いことを表す値．
+NO_SEED = 0xFFFFFFFFFFFFFFFF
+
+#
+# 列の定義．(名前, arrayの型コード, 1レコードあたりの要素数)である．
+#
+#   seeds       各プレイヤーの乱数の種．無ければNO_SEED
+#   turns       決着までのターン数
+#   players     各プレイヤーの名前の番号．名前はplayers.jsonにある．名前が無ければNO_PLAYER
+#   first_hit   各艦が最初に攻撃を受けたターン．艦は(プレイヤー, 艦種)の順に6隻分
+#   sunk        各艦が沈んだターン
+#   first       先手のプレイヤーの番号
+#   placements  各艦の初期配置のマスの番号(x * 5 + y)
+#   winner      勝者の番号．引き分けなら-1
+#   reason      試合が終わった理由のREASONSでの添字
+#
+COLUMNS = (
+    ("seeds", "Q", 2),
+    ("turns", "I", 1),
+    ("players", "H", 2),
+    ("first_hit", "H", 6),
+    ("sunk", "H", 6),
+    ("first", "B", 1),
+    ("placements", "B", 6),
+    ("winner", "b", 1),
+    ("reason", "B", 1),
+)
+
+PLAYERS = "players.json"
+META = "meta.json"
+
+
+# 試合結果を追記するクラスである．
+class ResultsWriter:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, META)
+        if os.path.exists(meta_path):
+            _check_meta(meta_path)
+        else:
+            with open(meta_path, "w") as f:
+                json.dump({"byteorder": sys.byteorder, "columns": _column_meta()}, f)
+
+        self._players = _load_players(directory)
+        self._ids = {name: i for i, name in enumerate(self._players)}
+        self._files = {name: open(os.path.join(directory, name + ".bin"), "ab")
+                       for name, _, _ in COLUMNS}
+        # 前回の書き込みが途中で止まっていれば，すべての列が揃っているレコードまで切り詰める
+        count = min(f.tell() // _record_size(code, width)
+                    for f, (_, code, width) in zip(self._files.values(), COLUMNS))
+        for f, (_, code, width) in zip(self._files.values(), COLUMNS):
+            f.truncate(count * _record_size(code, width))
+            f.seek(0, os.SEEK_END)
+
+    #
+    # lib.simulation.MatchResultを1件追記する．名前がNoneのプレイヤーは名前の無いプレイヤーとして，
+    # 乱数の種がNoneか列に入らない値なら種の無いものとして記録する．
+    #
+    def append(self, result):
+        players = [NO_PLAYER if name is None else self._player_id(name) for name in result.names]
+        seeds = [seed if isinstance(seed, int) and 0 <= seed < NO_SEED else NO_SEED for seed in result.seeds]
+        placements = []
+        for placement in result.placements:
+            for t in SHIP_TYPES:
+                p = placement.get(t)
+                placements.append(NO_CELL if p is None else p[0] * FIELD_SIZE + p[1])
+
+        record = {
+            "seeds": seeds,
+            "turns": [result.turns],
+            "players": players,
+            "first_hit": [NO_TURN if t is None else t for t in result.first_hit],
+            "sunk": [NO_TURN if t is None else t for t in result.sunk],
+            "first": [result.first],
+            "placements": placements,
+            "winner": [result.winner],
+            "reason": [REASONS.index(result.reason)],
+        }
+        for name, code, _ in COLUMNS:
+            array(code, record[name]).tofile(self._files[name])
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # 名前の番号を返す．初めての名前なら番号を割り当ててplayers.jsonに書き足す．
+    def _player_id(self, name):
+        name = str(name)
+        if name not in self._ids:
+            self._ids[name] = len(self._players)
+            self._players.append(name)
+            # 途中で止まっても壊れないように，別名で書いてから置き換える
+            path = os.path.join(self.directory, PLAYERS)
+            with open(path + ".tmp", "w") as f:
+                json.dump(self._players, f)
+            os.replace(path + ".tmp", path)
+        return self._ids[name]
+
+
+def _column_meta():
+    return [{"name": n, "typecode": c, "width": w} for n, c, w in COLUMNS]
+
+
+# 1レコードあたりの列のバイト数．
+def _record_size(code, width):
+    return array(code).itemsize * width
+
+
+# 別のバイト順や列の定義で書かれた記録に混ぜないようにする．
+def _check_meta(path):
+    with open(path) as f:
+        meta = json.load(f)
+    if meta["byteorder"] != sys.byteorder:
+        raise ValueError("results were written on a machine with different byte order")
+    if meta["columns"] != _column_meta():
+        raise ValueError("results were written with a different column layout")
+
+
+def _load_players(directory):
+    path = os.path.join(directory, PLAYERS)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+#
+# 試合結果をメモリマップして集計するクラスである．
+# 集計は必要な列のmemoryviewを要素数おきにスライスし，列ごとzipとitertools.compressで組にして
+# collections.Counterで数える．数えるのはCの中で進むので，レコードごとのPythonの処理は無い．
+# Pythonで回すのはキーと勝者の組の種類の数だけである．
+# 各集計は キー -> [試合数, 勝ち, 引き分け] の連想配列を返す．
+#
+class ResultsReader:
+
+    def __init__(self, directory):
+        _check_meta(os.path.join(directory, META))
+        self.players = _load_players(directory)
+
+        self._mmaps = []
+        self.columns = {}
+        sizes = {}
+        for name, code, width in COLUMNS:
+            path = os.path.join(directory, name + ".bin")
+            # 書き込み途中の半端なバイトは読まない
+            size = os.path.getsize(path) // _record_size(code, width) * _record_size(code, width)
+            if size == 0:
+                self.columns[name] = memoryview(b"").cast(code)
+            else:
+                with open(path, "rb") as f:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mmaps.append(m)
+                self.columns[name] = memoryview(m)[:size].cast(code)
+            sizes[name] = len(self.columns[name]) // width
+        # 書き込み途中の列があっても揃っているレコードだけを数える．
+        self.count = min(sizes.values())
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        for column in self.columns.values():
+            column.release()
+        for m in self._mmaps:
+            m.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #
+    # 列nameのj番目の要素をレコード順に並べたarrayを返す．メモリマップのコピーなので，
+    # 持ったままでもcloseできる．
+    #
+    def column(self, name, j=0):
+        code = dict((n, c) for n, c, _ in COLUMNS)[name]
+        return array(code, self._view(name, j).tobytes())
+
+    # 先手と後手それぞれの勝率．
+    def by_first_mover(self):
+        stats = {"first": [0, 0, 0], "second": [0, 0, 0]}
+        for (first, winner), n in Counter(zip(self._view("first"), self._view("winner"))).items():
+            _add(stats["first"], winner, first, n)
+            _add(stats["second"], winner, 1 - first, n)
+        return stats
+
+    # 初期配置ごとの勝率．キーは(w, c, s)の座標のタプルで，playerを与えるとその名前の側だけを数える．
+    def by_placement(self, player=None):
+        def key(cells):
+            return tuple(None if c == NO_CELL else (c // FIELD_SIZE, c % FIELD_SIZE) for c in cells)
+        return self._fold(self._tally(lambda side: [self._view("placements", side * 3 + j) for j in range(3)],
+                                      player, both=True), key)
+
+    #
+    # 決着までのターン数をbucketごとに区切った勝率．
+    # playerを与えるとその名前の側から，与えなければ先手の側から数える．
+    #
+    def by_turns(self, bucket=100, player=None):
+        turns = self._view("turns")
+        return self._fold(self._tally(lambda side: [turns], player), lambda k: k[0] // bucket * bucket)
+
+    # playerの対戦相手ごとの勝率．キーは相手の名前で，名前の無い相手はNoneにまとめる．
+    def by_opponent(self, player):
+        def key(k):
+            return None if k[0] == NO_PLAYER else self.players[k[0]]
+        return self._fold(self._tally(lambda side: [self._view("players", 1 - side)], player), key)
+
+    # 試合が終わった理由ごとの試合数．
+    def reasons(self):
+        counts = Counter(self._view("reason"))
+        return {reason: counts[r] for r, reason in enumerate(REASONS)}
+
+    # 列nameのj番目の要素をレコード順に並べたメモリマップのmemoryview．集計の中だけで使う．
+    def _view(self, name, j=0):
+        width = dict((n, w) for n, _, w in COLUMNS)[name]
+        return self.columns[name][j:self.count * width:width]
+
+    #
+    # 側ごとに(キーの列の値..., 勝者)の組の数を数え，(側, Counter)のリストを返す．
+    # keys(side)は側sideのキーにする列のリストを返す．playerを与えるとその名前が座った側を，
+    # 与えなければ先手の側(bothなら両方の側)を数える．
+    #
+    def _tally(self, keys, player=None, both=False):
+        winners = self._view("winner")
+        if player is None and both:
+            return [(side, Counter(zip(*keys(side), winners))) for side in range(2)]
+        if player is None:
+            selectors = [self._view("first")] * 2
+            pid = None
+        else:
+            pid = self._player_id(player)
+            if pid is None:
+                return []
+            selectors = [self._view("players", side) for side in range(2)]
+        tallies = []
+        for side in range(2):
+            # 数える側のレコードだけをcompressで選ぶ
+            mask = list(map((side if pid is None else pid).__eq__, selectors[side]))
+            columns = [compress(c, mask) for c in keys(side)]
+            tallies.append((side, Counter(zip(*columns, compress(winners, mask)))))
+        return tallies
+
+    # _tallyの結果をkey(キーの列の値のタプル)ごとの[試合数, 勝ち, 引き分け]にまとめる．
+    def _fold(self, tallies, key):
+        stats = {}
+        for side, counts in tallies:
+            for values, n in counts.items():
+                _add(stats.setdefault(key(values[:-1]), [0, 0, 0]), values[-1], side, n)
+        return stats
+
+    def _player_id(self, player):
+        if player is None or player not in self.players:
+            return None
+        return self.players.index(player)
+
+
+# 側sideから見た勝敗がwinnerのn試合を[試合数, 勝ち, 引き分け]に加える．
+def _add(stat, winner, side, n=1):
+    stat[0] += n
+    if winner == side:
+        stat[1] += n
+    elif winner == -1:
+        stat[2] += n
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    from lib.simulation import MatchResult
+
+    class ResultsTest(unittest.TestCase):
+
+        def setUp(self):
+            self.directory = tempfile.TemporaryDirectory()
+            self.path = self.directory.name
+
+        def tearDown(self):
+            self.directory.cleanup()
+
+        def result(self, winner, names=("a", "b"), seeds=(1, 2), first=0):
+            placements = [{"w": [0, 0], "c": [0, 1], "s": [4, 4]}, {"w": [2, 2], "c": [3, 3]}]
+            return MatchResult(winner, 30, first, placements, [3, 0], SUNK, names, seeds=seeds)
+
+        def write(self, results):
+            with ResultsWriter(self.path) as writer:
+                for result in results:
+                    writer.append(result)
+
+        def test_round_trip(self):
+            self.write([self.result(0), self.result(1, first=1), self.result(-1, names=("a", None), seeds=(None, -1))])
+            with ResultsReader(self.path) as reader:
+                self.assertEqual(len(reader), 3)
+                self.assertEqual(reader.players, ["a", "b"])
+                self.assertEqual(list(reader.column("seeds", 0)), [1, 1, NO_SEED])
+                self.assertEqual(list(reader.column("seeds", 1)), [2, 2, NO_SEED])
+                self.assertEqual(reader.by_first_mover(), {"first": [3, 2, 1], "second": [3, 0, 1]})
+                self.assertEqual(reader.by_opponent("a"), {"b": [2, 1, 0], None: [1, 0, 1]})
+                self.assertEqual(reader.by_placement("b"), {((2, 2), (3, 3), None): [2, 1, 0]})
+                self.assertEqual(reader.by_turns(bucket=100), {0: [3, 2, 1]})
+                self.assertEqual(reader.reasons()[SUNK], 3)
+
+        def test_queries(self):
+            self.write([self.result(0), self.result(1, first=1), self.result(-1, names=("b", "a")),
+                        self.result(1, names=("b", "a"), first=1)])
+            with ResultsReader(self.path) as reader:
+                # 名前を与えなければ両方の側の配置を数える
+                self.assertEqual(reader.by_placement(), {((0, 0), (0, 1), (4, 4)): [4, 1, 1],
+                                                         ((2, 2), (3, 3), None): [4, 2, 1]})
+                self.assertEqual(reader.by_placement("a"), {((0, 0), (0, 1), (4, 4)): [2, 1, 0],
+                                                            ((2, 2), (3, 3), None): [2, 1, 1]})
+                self.assertEqual(reader.by_turns(bucket=20, player="a"), {20: [4, 2, 1]})
+                self.assertEqual(reader.by_opponent("b"), {"a": [4, 1, 1]})
+                self.assertEqual(reader.by_opponent("nobody"), {})
+
+        def test_close_with_columns(self):
+            self.write([self.result(0), self.result(1)])
+            reader = ResultsReader(self.path)
+            winners = reader.column("winner")
+            reader.close()
+            self.assertEqual(list(winners), [0, 1])
+
+        def test_truncated_write(self):
+            self.write([self.result(0), self.result(1)])
+            # 3件目の書き込みがturnsの列の途中で止まった状態を作る
+            for name, code, width in COLUMNS[:1]:
+                with open(os.path.join(self.path, name + ".bin"), "ab") as f:
+                    array(code, [7] * width).tofile(f)
+            with open(os.path.join(self.path, "turns.bin"), "ab") as f:
+                f.write(b"\x01\x02")
+            with ResultsReader(self.path) as reader:
+                self.assertEqual(len(reader), 2)
+            self.write([self.result(-1)])
+            for name, code, width in COLUMNS:
+                self.assertEqual(os.path.getsize(os.path.join(self.path, name + ".bin")),
+                                 3 * _record_size(code, width))
+            with ResultsReader(self.path) as reader:
+                self.assertEqual(list(reader.column("winner")), [0, 1, -1])
+                self.assertEqual(list(reader.column("seeds", 0)), [1, 1, 1])
+
+        def test_layout_mismatch(self):
+            self.write([])
+            with open(os.path.join(self.path, META), "w") as f:
+                json.dump({"byteorder": sys.byteorder, "columns": []}, f)
+            with self.assertRaises(ValueError):
+                ResultsWriter(self.path)
+
+    unittest.main()
@@ -0,0 +1,79 @@
+import hashlib
+import random
+
+#
+# プレイヤーやシミュレーションごとに持たせる乱数生成器．
+# グローバルなrandomの状態を共有しないので，並列に動かしても互いに影響しない．
+#
+# spawnで子の生成器を作ると，その種は親の種とキーの並びだけから決まり，親がいくつ乱数を
+# 使ったかには依存しない．ゲームの通し番号などをキーにすれば，何プロセスで分担しても
+# 各ゲームの乱数列は同じになる．
+#
+
+
+# 種とキーの並びから子の種を決める．
+def _derive(seed, path):
+    digest = hashlib.sha256(repr((seed, path)).encode()).digest()
+    return int.from_bytes(digest[:16], "little")
+
+
+#
+# 種とキーの並びから，RandomStreamにそのまま渡せる63bitの整数の種を作る．
+# 対戦記録に残す種に使う．RandomStream(seed).spawn(*key)とは別の乱数列になる．
+#
+def derive_seed(seed, *key):
+    return _derive(seed, key) >> 65
+
+
+# 分割できる乱数生成器を表すクラスである．random.Randomのメソッドはすべて使える．
+class RandomStream(random.Random):
+
+    def __init__(self, seed=0, path=()):
+        self.root = seed
+        self.path = tuple(path)
+        super().__init__(_derive(seed, self.path) if self.path else seed)
+
+    # キーに対応する独立した子の生成器を返す．キーは整数か文字列である．
+    def spawn(self, *key):
+        return RandomStream(self.root, self.path + key)
+
+    # プロセスプールに渡しても種とキーの並びが失われないようにする．
+    def __reduce__(self):
+        return self.__class__, (self.root, self.path), self.getstate()
+
+
+if __name__ == '__main__':
+    import pickle
+    import unittest
+
+    class RandomStreamTest(unittest.TestCase):
+
+        def test_reproducible(self):
+            a = [RandomStream(1).spawn(3).random() for _ in range(2)]
+            self.assertEqual(a[0], a[1])
+
+        def test_spawn_independent_of_parent_state(self):
+            parent = RandomStream(1)
+            x = parent.spawn("game", 5).random()
+            parent.random()
+            self.assertEqual(x, parent.spawn("game", 5).random())
+            self.assertNotEqual(x, parent.spawn("game", 6).random())
+
+        def test_root_matches_random(self):
+            self.assertEqual(random.Random(7).random(), RandomStream(7).random())
+
+        def test_derive_seed(self):
+            s = derive_seed(1, "game", 5)
+            self.assertEqual(s, derive_seed(1, "game", 5))
+            self.assertNotEqual(s, derive_seed(1, "game", 6))
+            self.assertLess(s, 1 << 63)
+            self.assertEqual(RandomStream(s).random(), random.Random(s).random())
+
+        def test_pickle(self):
+            rng = RandomStream(2).spawn(1)
+            rng.random()
+            copied = pickle.loads(pickle.dumps(rng))
+            self.assertEqual(rng.random(), copied.random())
+            self.assertEqual(rng.spawn(4).random(), copied.spawn(4).random())
+
+    unittest.main()
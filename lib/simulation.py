@@ -0,0 +1,160 @@
+import importlib
+import json
+
+from lib.engine import SHIP_TYPES, TURNS, Server
+from lib.rng import RandomStream, derive_seed
+
+#
+# ソケットを使わずに，サーバの処理と2人のプレイヤーを同じプロセス内で対戦させる．
+# 大量の対戦を行うツールから使う．
+#
+
+# 引き分けになるまでのターン数．server.pyと同じである．
+MAX_TURNS = 10000
+
+
+#
+# 各艦が最初に攻撃を受けたターンと沈んだターンを記録するクラスである．
+# 艦は(プレイヤー, 艦種)の順に並べた6隻分で，該当しなければNoneである．
+#
+class DamageTimeline:
+
+    def __init__(self, server):
+        self.first_hit = [None] * 6
+        self.sunk = [None] * 6
+        self._hps = self._current(server)
+
+    # 行動を処理した後に呼び，HPが減った艦を記録する．turnはその行動のターン数である．
+    def update(self, server, turn):
+        hps = self._current(server)
+        for i, (before, after) in enumerate(zip(self._hps, hps)):
+            if after < before:
+                if self.first_hit[i] is None:
+                    self.first_hit[i] = turn
+                if after == 0:
+                    self.sunk[i] = turn
+        self._hps = hps
+
+    @staticmethod
+    def _current(server):
+        hps = []
+        for client in server.clients:
+            for ship_type in SHIP_TYPES:
+                ship = client.ships.get(ship_type)
+                hps.append(0 if ship is None else ship.hp)
+        return hps
+
+
+# 対戦結果を表すクラスである．
+class MatchResult:
+
+    def __init__(self, winner, turns, first, placements, hps, reason,
+                 names=(None, None), timeline=None, profiles=None, seeds=(None, None)):
+        # 勝ったプレイヤーの番号．引き分けなら-1である．
+        self.winner = winner
+        # 決着までのターン数．
+        self.turns = turns
+        # 先手のプレイヤーの番号．
+        self.first = first
+        # 各プレイヤーの初期配置(連想配列)．
+        self.placements = placements
+        # 終了時の各プレイヤーの残りHPの合計．
+        self.hps = hps
+        # 試合が終わった理由．lib.engineのSUNK，FOUL，TURNS，REPETITION，QUIETのいずれか．
+        self.reason = reason
+        # 各プレイヤーの名前．名前の無いプレイヤーはNoneである．
+        self.names = names
+        # 各プレイヤーの乱数の種．同じ種でプレイヤーを作り直すと同じ試合になる．無ければNoneである．
+        self.seeds = seeds
+        # 各艦が最初に攻撃を受けたターンと沈んだターン．
+        self.first_hit = [None] * 6 if timeline is None else timeline.first_hit
+        self.sunk = [None] * 6 if timeline is None else timeline.sunk
+        # 各プレイヤーのこの試合での行動の統計(lib.profiles.Profile)．記録しなければNoneである．
+        self.profiles = profiles
+
+
+# 試合開始時の各プレイヤーの配置を連想配列で返す．
+def placements_of(server):
+    return [{t: list(ship.position) for t, ship in client.ships.items()}
+            for client in server.clients]
+
+
+#
+# "module:Class"の形の文字列からプレイヤーのクラスを読み込む．
+# 例えば"players.random_player:RandomPlayer"である．
+#
+def load_player(spec):
+    module_name, _, class_name = spec.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)
+
+
+#
+# クラスのリストclassesからプレイヤーを作る．k番目のプレイヤーの乱数はderive_seed(seed, *key, k)から作り，
+# その種をプレイヤーのseedに入れるので，対戦記録の種から同じプレイヤーを作り直せる．
+# kwargsを与えると，k番目の連想配列をk番目のコンストラクタに渡す．
+#
+def make_players(classes, seed, key, kwargs=None):
+    players = []
+    for k, cls in enumerate(classes):
+        s = derive_seed(seed, *key, k)
+        player = cls(rng=RandomStream(s), **({} if kwargs is None else kwargs[k]))
+        player.seed = s
+        players.append(player)
+    return players
+
+
+#
+# プレイヤー2人を対戦させて結果を返す．firstが先手のプレイヤーの番号である．
+# 通信の流れはserver.pyのmainと同じで，行動の結果を両プレイヤーのupdateに渡す．
+# observerを与えると，行動のたびに(プレイヤー番号, ターン数, 直前に受け取ったJSON, 行動のJSON)で呼ばれる．
+# reporterを与えると，行動を処理した後に(プレイヤー番号, ターン数, Server.actionの結果)で呼ばれる．
+# ruleにlib.engine.DrawRuleを与えると，繰り返しや膠着で早めに引き分けにする．
+# 名前と乱数の種はserver.pyと同じく各プレイヤーのnameとseedを初期配置と一緒に受け取って記録する．
+#
+def play(players, first=0, max_turns=MAX_TURNS, observer=None, rule=None, reporter=None):
+    initial = [player.initial_condition() for player in players]
+    server = Server(initial[0], initial[1])
+    placements = placements_of(server)
+    timeline = DamageTimeline(server)
+    if rule is not None:
+        rule.start(server, first)
+    # 各プレイヤーが最後に受け取った情報．
+    last = [json.dumps(server.condition(0)), json.dumps(server.condition(1))]
+
+    winner = -1
+    reason = TURNS
+    i = 0
+    c = first
+    while winner == -1 and i < max_turns:
+        act = players[c].action()
+        if observer is not None:
+            observer(c, i, last[c], act)
+        results = server.action(c, act)
+        if reporter is not None:
+            reporter(c, i, results)
+        players[c].update(results[0])
+        players[1-c].update(results[1])
+        last[c] = results[0]
+        last[1-c] = results[1]
+        timeline.update(server, i)
+
+        outcome = json.loads(results[0]).get("outcome")
+        if outcome is not None:
+            winner = c if outcome else 1 - c
+            reason = server.decided_reason(winner)
+        elif rule is not None:
+            drawn = rule.update(server, c)
+            if drawn is not None:
+                reason = drawn
+                i += 1
+                break
+        c = 1 - c
+        i += 1
+
+    if winner == -1 and rule is not None:
+        winner = rule.adjudicated_winner(server)
+
+    names = tuple(type(p).__name__ if n is None else n for p, n in zip(players, server.names))
+    hps = [server.total_hp(0), server.total_hp(1)]
+    return MatchResult(winner, i, first, placements, hps, reason, names, timeline, seeds=server.seeds)
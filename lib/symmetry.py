@@ -0,0 +1,197 @@
+from lib.engine import FIELD_SIZE, SHIP_TYPES
+
+#
+# 5x5のフィールドの対称性(二面体群D4の8つの変換)を扱う．
+# 移動(縦横)と攻撃範囲(周囲1マス)のルールはどの変換でも変わらないので，
+# 変換で移り合う局面は同じ価値を持つ．代表(正準形)にそろえると，
+# 定跡やテーブルベース，学習データ，キャッシュの大きさを最大で1/8にできる．
+#
+# 変換は番号0から7で表し，0は恒等変換である．マスの番号はx * 5 + yである．
+#
+
+# マスの数．
+CELLS = FIELD_SIZE * FIELD_SIZE
+
+_N = FIELD_SIZE - 1
+
+# 各変換を座標の関数として定義する．回転4つと，それぞれを転置したもの．
+_TRANSFORMS = (
+    lambda x, y: (x, y),
+    lambda x, y: (y, _N - x),
+    lambda x, y: (_N - x, _N - y),
+    lambda x, y: (_N - y, x),
+    lambda x, y: (y, x),
+    lambda x, y: (x, _N - y),
+    lambda x, y: (_N - y, _N - x),
+    lambda x, y: (_N - x, y),
+)
+
+# 変換の数．
+COUNT = len(_TRANSFORMS)
+
+
+# 変換fでマスcellが移るマスの番号．
+def _moved_cell(f, cell):
+    x, y = f(cell // FIELD_SIZE, cell % FIELD_SIZE)
+    return x * FIELD_SIZE + y
+
+
+# PERMUTATIONS[k][cell]は変換kでマスcellが移るマスである．
+PERMUTATIONS = tuple(tuple(_moved_cell(f, cell) for cell in range(CELLS)) for f in _TRANSFORMS)
+
+# INVERSE[k]は変換kを元に戻す変換の番号である．
+INVERSE = tuple(next(j for j in range(COUNT)
+                     if all(PERMUTATIONS[j][PERMUTATIONS[k][cell]] == cell for cell in range(CELLS)))
+                for k in range(COUNT))
+
+# 移動量(ベクトル)の変換．平行移動の成分を除いた線形部分である．
+# VECTORS[k]は(dxへの係数x, dxへの係数y, dyへの係数x, dyへの係数y)．
+VECTORS = tuple(
+    (f(1, 0)[0] - f(0, 0)[0], f(0, 1)[0] - f(0, 0)[0], f(1, 0)[1] - f(0, 0)[1], f(0, 1)[1] - f(0, 0)[1])
+    for f in _TRANSFORMS)
+
+
+# 座標を変換kで移す．座標はタプルで返す．
+def transform(position, k):
+    cell = PERMUTATIONS[k][position[0] * FIELD_SIZE + position[1]]
+    return (cell // FIELD_SIZE, cell % FIELD_SIZE)
+
+
+# 移動量[dx, dy]を変換kで移す．
+def transform_vector(distance, k):
+    a, b, c, d = VECTORS[k]
+    return (a * distance[0] + b * distance[1], c * distance[0] + d * distance[1])
+
+
+# 初期配置(艦種 -> 座標の連想配列)を変換kで移す．艦種以外のキーはそのまま残す．
+def transform_placement(placement, k):
+    return {key: transform(value, k) if key in SHIP_TYPES else value
+            for key, value in placement.items()}
+
+
+# 艦隊の状態(艦種 -> {"hp", "position"}の連想配列．conditionの"me"の形)を変換kで移す．
+def transform_fleet(fleet, k):
+    result = {}
+    for t, ship in fleet.items():
+        result[t] = dict(ship)
+        if "position" in ship:
+            result[t]["position"] = transform(ship["position"], k)
+    return result
+
+
+#
+# 行動(Player.moveやPlayer.attackが返す連想配列)を変換kで移す．
+# 正準形の局面で選んだ行動を元の局面の行動に戻すには，INVERSE[k]で移す．
+#
+def transform_action(action, k):
+    if "attack" in action:
+        return {"attack": {"to": transform(action["attack"]["to"], k)}}
+    return {"move": {"ship": action["move"]["ship"], "to": transform(action["move"]["to"], k)}}
+
+
+# 初期配置をマスの番号の並びにする．比較のキーに使う．
+def _placement_key(placement):
+    return tuple(-1 if placement.get(t) is None else placement[t][0] * FIELD_SIZE + placement[t][1]
+                 for t in SHIP_TYPES)
+
+
+# 艦隊の状態を(HP, マスの番号)の並びにする．比較のキーに使う．
+def _fleet_key(fleet):
+    return tuple((fleet[t].get("hp", 0), fleet[t]["position"][0] * FIELD_SIZE + fleet[t]["position"][1])
+                 if t in fleet else (0, -1)
+                 for t in SHIP_TYPES)
+
+
+#
+# 初期配置の正準形を返す．8つの変換で移した中でマスの番号の並びが最小のものである．
+# (正準形, 変換の番号)を返し，transform_placement(placement, 変換の番号)が正準形になる．
+#
+def canonical_placement(placement):
+    k = min(range(COUNT), key=lambda k: _placement_key(transform_placement(placement, k)))
+    return transform_placement(placement, k), k
+
+
+#
+# 両プレイヤーの艦隊の状態の正準形を返す．meとenemyはどちらも位置を含む艦隊の状態で，
+# 両方に同じ変換をかける．(meの正準形, enemyの正準形, 変換の番号)を返す．
+#
+def canonical_state(me, enemy):
+    k = min(range(COUNT), key=lambda k: (_fleet_key(transform_fleet(me, k)),
+                                         _fleet_key(transform_fleet(enemy, k))))
+    return transform_fleet(me, k), transform_fleet(enemy, k), k
+
+
+#
+# 初期配置のすべての変換を重複なく返す．正準形から元の配置の集合を作るのに使う．
+#
+def orbit(placement):
+    result = {}
+    for k in range(COUNT):
+        p = transform_placement(placement, k)
+        result.setdefault(_placement_key(p), p)
+    return list(result.values())
+
+
+if __name__ == '__main__':
+    import itertools
+    import unittest
+
+    from lib.engine import Ship
+
+    class SymmetryTest(unittest.TestCase):
+
+        def test_group(self):
+            self.assertEqual(PERMUTATIONS[0], tuple(range(CELLS)))
+            self.assertEqual(len(set(PERMUTATIONS)), COUNT)
+            for a, b in itertools.product(range(COUNT), repeat=2):
+                composed = tuple(PERMUTATIONS[b][PERMUTATIONS[a][cell]] for cell in range(CELLS))
+                self.assertIn(composed, PERMUTATIONS)
+            for k in range(COUNT):
+                self.assertEqual(transform(transform((1, 3), k), INVERSE[k]), (1, 3))
+
+        def test_rules_are_invariant(self):
+            cells = [(x, y) for x in range(FIELD_SIZE) for y in range(FIELD_SIZE)]
+            for k, a, b in itertools.product(range(COUNT), cells, cells):
+                ship = Ship("w", a)
+                moved = Ship("w", transform(a, k))
+                self.assertEqual(ship.reachable(b), moved.reachable(transform(b, k)))
+                self.assertEqual(ship.attackable(b), moved.attackable(transform(b, k)))
+
+        def test_vector(self):
+            for k in range(COUNT):
+                a, b = (1, 2), (1, 4)
+                ta, tb = transform(a, k), transform(b, k)
+                self.assertEqual(transform_vector((b[0] - a[0], b[1] - a[1]), k),
+                                 (tb[0] - ta[0], tb[1] - ta[1]))
+
+        def test_canonical_placement(self):
+            placement = {"w": (0, 1), "c": (3, 3), "s": (4, 0)}
+            canonical, k = canonical_placement(placement)
+            self.assertEqual(transform_placement(placement, k), canonical)
+            for member in orbit(placement):
+                self.assertEqual(canonical_placement(member)[0], canonical)
+
+        def test_orbit_sizes(self):
+            cells = [(x, y) for x in range(FIELD_SIZE) for y in range(FIELD_SIZE)]
+            placements = [{"w": w, "c": c, "s": s} for w, c, s in itertools.permutations(cells, 3)]
+            classes = {tuple(sorted(canonical_placement(p)[0].items())) for p in placements}
+            self.assertEqual(sum(len(orbit(dict(c))) for c in classes), len(placements))
+            self.assertLess(len(classes), len(placements) // 7)
+
+        def test_canonical_state(self):
+            me = {"w": {"hp": 3, "position": [0, 1]}, "s": {"hp": 1, "position": [2, 2]}}
+            enemy = {"c": {"hp": 1, "position": [4, 3]}}
+            cme, cenemy, k = canonical_state(me, enemy)
+            for j in range(COUNT):
+                self.assertEqual(canonical_state(transform_fleet(me, j), transform_fleet(enemy, j))[:2],
+                                 (cme, cenemy))
+            self.assertEqual(transform_fleet(me, k), cme)
+
+        def test_action(self):
+            action = {"move": {"ship": "c", "to": [1, 4]}}
+            for k in range(COUNT):
+                back = transform_action(transform_action(action, k), INVERSE[k])
+                self.assertEqual(back, {"move": {"ship": "c", "to": (1, 4)}})
+            self.assertEqual(transform_action({"attack": {"to": [0, 0]}}, 2), {"attack": {"to": (4, 4)}})
+
+    unittest.main()
@@ -0,0 +1,358 @@
+import itertools
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from lib.engine import FIELD_SIZE, MAX_HPS, SHIP_TYPES
+
+#
+# 完全情報での終盤データベース(テーブルベース)．
+# お互いの艦の位置がすべて分かっているとして，後退解析で各局面の勝敗と決着までの手数を求める．
+# 結果はメモリマップされたファイルに保存し，プロセスのヒープに読み込まずにO(1)で引けるようにする．
+#
+# 局面は常に手番側から見て表す．値は符号付き16bit整数で，
+# 正なら手番側がその手数(プライ数)で勝ち，負なら負け，0なら引き分けである．
+#
+
+# マスの数．
+CELLS = FIELD_SIZE * FIELD_SIZE
+
+# ファイルの先頭に置く識別子．
+MAGIC = b"SUBTB001"
+_HEADER_LEN = struct.Struct("<I")
+
+# 値の意味．
+DRAW = 0
+
+
+# 座標をマスの番号に変換する．
+def cell_of(position):
+    return position[0] * FIELD_SIZE + position[1]
+
+
+# マスの番号を座標に変換する．
+def position_of(cell):
+    return [cell // FIELD_SIZE, cell % FIELD_SIZE]
+
+
+# 各マスから縦横に移動できるマスの一覧．
+_REACH = [[cell_of([x, y]) for x in range(FIELD_SIZE) for y in range(FIELD_SIZE)
+           if (x == cx) != (y == cy)]
+          for cx in range(FIELD_SIZE) for cy in range(FIELD_SIZE)]
+
+# 各マスから攻撃できるマス(自分のマス及び周囲1マス)の一覧．
+_AROUND = [[cell_of([x, y]) for x in range(FIELD_SIZE) for y in range(FIELD_SIZE)
+            if abs(x - cx) <= 1 and abs(y - cy) <= 1]
+           for cx in range(FIELD_SIZE) for cy in range(FIELD_SIZE)]
+
+
+#
+# 片方の艦隊の戦力を表すタプルを列挙する．戦力は(艦種, HP)のタプルを艦種順に並べたもの．
+# 1隻からmax_ships隻までのすべての組み合わせを返す．
+#
+def materials(max_ships):
+    result = []
+    for k in range(1, max_ships + 1):
+        for types in itertools.combinations(SHIP_TYPES, k):
+            for hps in itertools.product(*[range(1, MAX_HPS[t] + 1) for t in types]):
+                result.append(tuple(zip(types, hps)))
+    return result
+
+
+# 戦力を文字列のキーにする．例えば戦艦HP3と潜水艦HP1なら"w3s1"．
+def material_key(material):
+    return "".join(t + str(hp) for t, hp in material)
+
+
+# 艦の並び(マスの番号の列)を25進数の添字にする．
+def _index(cells):
+    i = 0
+    for cell in reversed(cells):
+        i = i * CELLS + cell
+    return i
+
+
+# 25進数の添字を艦の並びに戻す．
+def _cells(i, n):
+    cells = []
+    for _ in range(n):
+        cells.append(i % CELLS)
+        i //= CELLS
+    return cells
+
+
+#
+# 手番側と相手側の戦力の組ごとの表である．
+# 添字は 手番側の並び * 25^相手の隻数 + 相手側の並び で，同じ側の艦が重なる無効な局面も含む．
+#
+class _Block:
+
+    def __init__(self, mover, enemy):
+        self.mover = mover
+        self.enemy = enemy
+        self.stride = CELLS ** len(enemy)
+        self.size = CELLS ** (len(mover) + len(enemy))
+        self.values = array("h", bytes(2 * self.size))
+
+    # 有効な局面の(添字, 手番側の並び, 相手側の並び)を列挙する．
+    def states(self):
+        for mc in itertools.permutations(range(CELLS), len(self.mover)):
+            base = _index(mc) * self.stride
+            for ec in itertools.permutations(range(CELLS), len(self.enemy)):
+                yield base + _index(ec), list(mc), list(ec)
+
+
+# 手番側の艦のいずれかから攻撃でき，相手の艦がいないマスがあるかどうかを返す．
+def _can_pass(mover_cells, enemy_cells):
+    for cell in mover_cells:
+        for to in _AROUND[cell]:
+            if to not in enemy_cells:
+                return True
+    return False
+
+
+# 手番側の艦が移動してできる並びを列挙する．
+def _moves(cells):
+    for i, cell in enumerate(cells):
+        for to in _REACH[cell]:
+            if to not in cells:
+                yield cells[:i] + [to] + cells[i + 1:]
+
+
+#
+# 戦力の組(a, b)と(b, a)の局面をまとめて解く．
+# 攻撃が命中すると戦力が減るので，HPの合計が少ない組はすでに解かれている前提である．
+# 移動と空振りの攻撃だけが組の中を行き来するので，その部分を後退解析で解く．
+#
+def _solve_pair(blocks, a, b):
+    keys = [(a, b)] if a == b else [(a, b), (b, a)]
+    for key in keys:
+        blocks[key] = _Block(*key)
+
+    resolved = {key: bytearray(blocks[key].size) for key in keys}
+    remaining = {key: array("H", bytes(2 * blocks[key].size)) for key in keys}
+    longest = {key: array("h", bytes(2 * blocks[key].size)) for key in keys}
+    buckets = {}
+
+    def push(d, key, i, value):
+        buckets.setdefault(d, []).append((key, i, value))
+
+    for key in keys:
+        block = blocks[key]
+        mover, enemy = key
+        for i, mc, ec in block.states():
+            win = None
+            ext_longest = 0
+            draw = False
+
+            # 命中する攻撃は戦力の少ない組へ進む．
+            targets = set()
+            for cell in mc:
+                targets.update(_AROUND[cell])
+            for j, cell in enumerate(ec):
+                if cell not in targets:
+                    continue
+                t, hp = enemy[j]
+                if hp == 1 and len(enemy) == 1:
+                    win = 1
+                    break
+                if hp == 1:
+                    hit = enemy[:j] + enemy[j + 1:]
+                    hit_cells = ec[:j] + ec[j + 1:]
+                else:
+                    hit = enemy[:j] + ((t, hp - 1),) + enemy[j + 1:]
+                    hit_cells = ec
+                after = blocks[(hit, mover)]
+                v = after.values[_index(hit_cells) * after.stride + _index(mc)]
+                if v < 0:
+                    if win is None or -v + 1 < win:
+                        win = -v + 1
+                elif v > 0:
+                    ext_longest = max(ext_longest, v)
+                else:
+                    draw = True
+
+            n = sum(1 for _ in _moves(mc))
+            if _can_pass(mc, ec):
+                n += 1
+            # 命中で勝てる，あるいは引き分けに逃げられる局面は負けにならないので，
+            # 残りの数が0にならないようにする．
+            remaining[key][i] = n + 1 if draw or win is not None else n
+            longest[key][i] = ext_longest
+
+            if win is not None:
+                push(win, key, i, win)
+            elif n == 0 and not draw:
+                push(ext_longest + 1, key, i, -(ext_longest + 1))
+
+    d = 1
+    while buckets:
+        for key, i, value in buckets.pop(d, []):
+            if resolved[key][i]:
+                continue
+            resolved[key][i] = 1
+            blocks[key].values[i] = value
+
+            # この局面に移動あるいは空振りで到達する，相手が手番の局面をたどる．
+            mover, enemy = key
+            prev_key = (enemy, mover)
+            prev = blocks[prev_key]
+            mc = _cells(i // blocks[key].stride, len(mover))
+            ec = _cells(i % blocks[key].stride, len(enemy))
+            mi = _index(mc)
+            preds = [_index(cells) * prev.stride + mi for cells in _moves(ec)]
+            if _can_pass(ec, mc):
+                preds.append(_index(ec) * prev.stride + mi)
+
+            for p in preds:
+                if resolved[prev_key][p]:
+                    continue
+                if value < 0:
+                    push(-value + 1, prev_key, p, -value + 1)
+                else:
+                    remaining[prev_key][p] -= 1
+                    if longest[prev_key][p] < value:
+                        longest[prev_key][p] = value
+                    if remaining[prev_key][p] == 0:
+                        dist = longest[prev_key][p] + 1
+                        push(dist, prev_key, p, -dist)
+        d += 1
+
+
+#
+# 1隻からmax_ships隻までの終盤を解いてファイルに書き出す．
+# 2隻ずつの終盤は局面数が多く，純Pythonでは時間がかかる．
+#
+def build(path, max_ships=1, verbose=False):
+    mats = materials(max_ships)
+    total = {m: sum(hp for _, hp in m) for m in mats}
+    pairs = sorted({tuple(sorted([a, b])) for a in mats for b in mats},
+                   key=lambda p: (total[p[0]] + total[p[1]], p))
+
+    blocks = {}
+    for a, b in pairs:
+        if verbose:
+            print(f"solving {material_key(a)} vs {material_key(b)}")
+        _solve_pair(blocks, a, b)
+
+    offsets = {}
+    offset = 0
+    for key in sorted(blocks, key=lambda k: (material_key(k[0]), material_key(k[1]))):
+        offsets[material_key(key[0]) + "|" + material_key(key[1])] = offset
+        offset += blocks[key].size
+
+    header = json.dumps({
+        "max_ships": max_ships,
+        "byteorder": sys.byteorder,
+        "blocks": offsets,
+    }).encode()
+    # データ部分が8バイト境界から始まるように詰める．
+    pad = -(len(MAGIC) + _HEADER_LEN.size + len(header)) % 8
+    header += b" " * pad
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for key in sorted(blocks, key=lambda k: (material_key(k[0]), material_key(k[1]))):
+            blocks[key].values.tofile(f)
+
+
+#
+# メモリマップされたテーブルベースを読むクラスである．
+# 表は読み込まずにマップするだけなので，複数のプロセスで開いてもページキャッシュを共有する．
+#
+class Tablebase:
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a tablebase file")
+        start = len(MAGIC) + _HEADER_LEN.size
+        (length,) = _HEADER_LEN.unpack_from(self._mmap, len(MAGIC))
+        header = json.loads(self._mmap[start:start + length].decode())
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError("tablebase was built on a machine with different byte order")
+
+        self.max_ships = header["max_ships"]
+        self._blocks = header["blocks"]
+        self._values = memoryview(self._mmap)[start + length:].cast("h")
+
+    #
+    # 手番側の艦隊meと相手の艦隊enemyを，conditionと同じ形の連想配列で与えて局面の値を返す．
+    # 例えば {"w": {"hp": 3, "position": [0, 0]}} である．表に含まれない戦力ならNoneを返す．
+    #
+    def probe(self, me, enemy):
+        key = self._side_key(me) + "|" + self._side_key(enemy)
+        offset = self._blocks.get(key)
+        if offset is None:
+            return None
+        stride = CELLS ** len(enemy)
+        return self._values[offset + self._side_index(me) * stride + self._side_index(enemy)]
+
+    def close(self):
+        self._values.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _side_key(fleet):
+        return "".join(t + str(fleet[t]["hp"]) for t in SHIP_TYPES if t in fleet)
+
+    @staticmethod
+    def _side_index(fleet):
+        return _index([cell_of(fleet[t]["position"]) for t in SHIP_TYPES if t in fleet])
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import unittest
+
+    class TablebaseTest(unittest.TestCase):
+
+        @classmethod
+        def setUpClass(cls):
+            cls.dir = tempfile.TemporaryDirectory()
+            cls.path = os.path.join(cls.dir.name, "tb.bin")
+            build(cls.path, max_ships=1)
+            cls.tb = Tablebase(cls.path)
+
+        @classmethod
+        def tearDownClass(cls):
+            cls.tb.close()
+            cls.dir.cleanup()
+
+        def test_immediate_win(self):
+            me = {"w": {"hp": 3, "position": [0, 0]}}
+            enemy = {"s": {"hp": 1, "position": [1, 1]}}
+            self.assertEqual(1, self.tb.probe(me, enemy))
+
+        def test_escape(self):
+            # 命中させても反撃で沈められるので，逃げて引き分けにするのが最善である．
+            me = {"c": {"hp": 1, "position": [0, 0]}}
+            enemy = {"c": {"hp": 2, "position": [0, 1]}}
+            self.assertEqual(DRAW, self.tb.probe(me, enemy))
+
+        def test_symmetric_positions(self):
+            me = {"w": {"hp": 1, "position": [0, 0]}}
+            enemy = {"c": {"hp": 2, "position": [4, 4]}}
+            mirrored_me = {"w": {"hp": 1, "position": [4, 4]}}
+            mirrored_enemy = {"c": {"hp": 2, "position": [0, 0]}}
+            self.assertEqual(self.tb.probe(me, enemy),
+                             self.tb.probe(mirrored_me, mirrored_enemy))
+
+        def test_missing_material(self):
+            me = {"w": {"hp": 3, "position": [0, 0]}, "s": {"hp": 1, "position": [0, 1]}}
+            enemy = {"c": {"hp": 2, "position": [4, 4]}}
+            self.assertIsNone(self.tb.probe(me, enemy))
+
+    unittest.main()
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+#
+# 処理にかかった時間を区間(span)として記録し，Chrome trace event形式のJSONに書き出す．
+# 書き出したファイルはchrome://tracingやPerfetto(https://ui.perfetto.dev)で開ける．
+# 時刻はtime.perf_counter_nsで，Linuxではプロセスをまたいで同じ時計なので，
+# サーバとクライアントのファイルをmergeでまとめると1つの時間軸に並ぶ．
+#
+
+
+# 1つの区間を計る．Tracer.spanが返す．
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer.complete(self.name, self.start, end - self.start, self.args)
+
+
+#
+# 区間を記録するクラスである．nameはトレースビューアに表示するプロセス名．
+# 記録は新しい方からlimit個だけ残す．
+#
+class Tracer:
+
+    def __init__(self, name=None, limit=1000000):
+        self.pid = os.getpid()
+        self.events = deque(maxlen=limit)
+        self._metadata = []
+        if name is not None:
+            self._metadata.append({"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                                   "args": {"name": name}})
+
+    # withで囲んだ処理の区間を記録する．argsはビューアで区間を選んだ時に表示される．
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    # 開始時刻startと長さduration(ナノ秒)の区間を記録する．
+    def complete(self, name, start, duration, args=None):
+        event = {"name": name, "ph": "X", "ts": start / 1000, "dur": duration / 1000,
+                 "pid": self.pid, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    # 今の時刻に印をつける．
+    def instant(self, name, **args):
+        event = {"name": name, "ph": "i", "s": "t", "ts": time.perf_counter_ns() / 1000,
+                 "pid": self.pid, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    # 記録をファイルに書き出す．
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self._metadata + list(self.events),
+                       "displayTimeUnit": "ms"}, f)
+
+
+#
+# 何も記録しないTracerである．トレースしない時に使い，計測の処理を省く．
+#
+class NullTracer:
+
+    class _NullSpan:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            pass
+
+    _span = _NullSpan()
+
+    def span(self, name, **args):
+        return NullTracer._span
+
+    def complete(self, name, start, duration, args=None):
+        pass
+
+    def instant(self, name, **args):
+        pass
+
+    def dump(self, path):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+# mergeでプロセスIDをずらす幅．Linuxのプロセスの番号の上限(pid_max)より大きい．
+PID_OFFSET = 1 << 22
+
+
+#
+# 複数のトレースファイルを1つにまとめる．同じワーカーの試合ごとのファイルのように，
+# 前のファイルと同じプロセスIDを含むファイルはプロセスIDを(ファイルの順番 * PID_OFFSET)だけずらし，
+# プロセス名にファイル名を添えて別の行に並べる．スレッドIDはプロセスごとの番号なのでそのままにする．
+#
+def merge(paths, output):
+    events = []
+    seen = set()
+    for k, path in enumerate(paths):
+        with open(path) as f:
+            trace = json.load(f)["traceEvents"]
+        pids = {event["pid"] for event in trace}
+        offset = k * PID_OFFSET if pids & seen else 0
+        for event in trace:
+            event["pid"] += offset
+            if offset and event["ph"] == "M" and event["name"] == "process_name":
+                event["args"]["name"] += f" ({os.path.basename(path)})"
+        seen |= {pid + offset for pid in pids}
+        events.extend(trace)
+    with open(output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    class TracerTest(unittest.TestCase):
+
+        def setUp(self):
+            self.directory = tempfile.TemporaryDirectory()
+
+        def tearDown(self):
+            self.directory.cleanup()
+
+        def load(self, name):
+            with open(os.path.join(self.directory.name, name)) as f:
+                return json.load(f)
+
+        def test_nested_spans(self):
+            tracer = Tracer("server")
+            with tracer.span("turn", turn=3):
+                with tracer.span("read"):
+                    time.sleep(0.001)
+            tracer.dump(os.path.join(self.directory.name, "trace.json"))
+            trace = self.load("trace.json")
+            self.assertEqual(trace["displayTimeUnit"], "ms")
+            meta, inner, outer = trace["traceEvents"]
+            self.assertEqual(meta, {"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0,
+                                    "args": {"name": "server"}})
+            # 内側の区間が先に終わるので先に記録され，外側の区間に含まれる
+            self.assertEqual([inner["name"], outer["name"]], ["read", "turn"])
+            self.assertEqual(outer["args"], {"turn": 3})
+            self.assertNotIn("args", inner)
+            for event in (inner, outer):
+                self.assertEqual(event["ph"], "X")
+                self.assertEqual((event["pid"], event["tid"]), (os.getpid(), threading.get_ident()))
+            self.assertGreaterEqual(inner["ts"], outer["ts"])
+            self.assertLessEqual(inner["ts"] + inner["dur"], outer["ts"] + outer["dur"])
+            self.assertGreaterEqual(inner["dur"], 1000)
+
+        def test_limit(self):
+            tracer = Tracer(limit=3)
+            for k in range(5):
+                tracer.instant("mark", k=k)
+            self.assertEqual([e["args"]["k"] for e in tracer.events], [2, 3, 4])
+            self.assertEqual(tracer.events[0]["ph"], "i")
+
+        def test_null_tracer(self):
+            path = os.path.join(self.directory.name, "null.json")
+            with NULL_TRACER.span("turn", turn=0) as span:
+                self.assertIsNotNone(span)
+            NULL_TRACER.complete("x", 0, 1)
+            NULL_TRACER.instant("x")
+            NULL_TRACER.dump(path)
+            self.assertFalse(os.path.exists(path))
+
+        def test_merge(self):
+            # 同じワーカーの2試合分のファイルと，別のプロセスのファイルをまとめる
+            paths = [os.path.join(self.directory.name, name) for name in ("t-0-0.json", "t-0-1.json", "player.json")]
+            for path in paths[:2]:
+                tracer = Tracer("server worker 0")
+                with tracer.span("turn"):
+                    pass
+                tracer.dump(path)
+            player = Tracer("player")
+            player.pid = 1
+            player._metadata[0]["pid"] = 1
+            player.instant("action")
+            player.dump(paths[2])
+            merge(paths, os.path.join(self.directory.name, "merged.json"))
+
+            events = self.load("merged.json")["traceEvents"]
+            self.assertEqual(len(events), 6)
+            pid = os.getpid()
+            self.assertEqual([e["pid"] for e in events], [pid, pid, pid + PID_OFFSET, pid + PID_OFFSET, 1, 1])
+            self.assertEqual([e["args"]["name"] for e in events if e["ph"] == "M"],
+                             ["server worker 0", "server worker 0 (t-0-1.json)", "player"])
+            self.assertEqual({e["tid"] for e in events if e["ph"] != "M"}, {threading.get_ident()})
+
+    unittest.main()
@@ -0,0 +1,328 @@
+import _multiprocessing
+import socket
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.synchronize import SEM_VALUE_MAX, SEMAPHORE
+
+#
+# 1行を1つのメッセージとしてソケットあるいは共有メモリで送受信する．
+# makefile('rw', buffering=1)と違って書き込みは明示的にflushするまで溜めておけるので，
+# 同じ相手に1ターンで送る行をまとめて1回のsendallで送れる．
+# 読み込む前には必ず溜めた分を送るので，相手の返事を待ったまま止まることはない．
+#
+
+
+# 行単位でメッセージをやりとりする接続を表すクラスである．
+class Connection:
+
+    #
+    # batchがFalseなら書き込むたびに送る(従来と同じ)．
+    # nodelayならTCP_NODELAYを設定してNagleアルゴリズムによる送信の遅れを無くす．
+    #
+    def __init__(self, sock, batch=False, nodelay=False):
+        self.sock = sock
+        self.batch = batch
+        if nodelay and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = sock.makefile("r", encoding="utf-8", newline="\n")
+        self._pending = []
+
+    # 改行を含む1行を返す．接続が閉じられていれば空文字列を返す．
+    def readline(self):
+        self.flush()
+        return self._reader.readline()
+
+    # 文字列を送る．batchなら次のflushまで溜めておく．
+    def write(self, s):
+        self._pending.append(s)
+        if not self.batch:
+            self.flush()
+
+    # 溜めている文字列をまとめて送る．
+    def flush(self):
+        if self._pending:
+            self.sock.sendall("".join(self._pending).encode("utf-8"))
+            self._pending.clear()
+
+    def close(self):
+        try:
+            self.flush()
+        except OSError:
+            pass
+        self._reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#
+# 名前付きのPOSIXセマフォを作る・開く・消す．別々に起動したプロセスの間で共有できる同期の仕組みは
+# 標準ライブラリではmultiprocessingの内部のSemLockしかないので，それを直接使う．
+# 作った側が消し忘れても，共有メモリと同じくプロセスの終了時にresource_trackerが消す．
+#
+def _create_semaphore(name, value, maxvalue):
+    sem = _multiprocessing.SemLock(SEMAPHORE, value, maxvalue, name, False)
+    resource_tracker.register(name, "semaphore")
+    return sem
+
+
+def _open_semaphore(name, maxvalue):
+    return _multiprocessing.SemLock._rebuild(0, SEMAPHORE, maxvalue, name)
+
+
+def _unlink_semaphore(name):
+    _multiprocessing.sem_unlink(name)
+    resource_tracker.unregister(name, "semaphore")
+
+
+#
+# 共有メモリ上の単一送信者・単一受信者のリングバッファである．
+# 先頭にheader(書き込んだ総バイト数，読み込んだ総バイト数，閉じたかどうか)を置き，
+# その後ろにcapacityバイトのデータ領域が続く．headは送信側だけが，tailは受信側だけが書き換える．
+#
+# 共有メモリへの書き込みが相手から見える順番はCPUによって違うので，headerとデータの読み書きは
+# すべてlockのセマフォを持って行う(セマフォの操作はメモリの同期を伴う)．
+# 書き込んだらitemsを，読んで空きを作ったらspaceを1つ増やし，相手はそれを待って眠る．
+#
+class Ring:
+
+    HEADER = 32
+    # セマフォの数．lock，items，spaceの順である．
+    SEMAPHORES = 3
+
+    def __init__(self, buf, capacity, semaphores):
+        self.capacity = capacity
+        self.counters = buf[:Ring.HEADER].cast("Q")
+        self.data = buf[Ring.HEADER:Ring.HEADER + capacity]
+        self.lock, self.items, self.space = semaphores
+
+    # 初期化する．作った側が1回だけ呼ぶ．
+    def reset(self):
+        with self.lock:
+            self.counters[0] = 0
+            self.counters[1] = 0
+            self.counters[2] = 0
+
+    # 書き込めるだけ書き込み，書き込んだバイト数を返す．いっぱいなら0である．
+    def put(self, data):
+        with self.lock:
+            head = self.counters[0]
+            n = min(len(data), self.capacity - (head - self.counters[1]))
+            start = head % self.capacity
+            first = min(n, self.capacity - start)
+            self.data[start:start + first] = data[:first]
+            self.data[:n - first] = data[first:n]
+            self.counters[0] = head + n
+        if n:
+            self.items.release()
+        return n
+
+    # 読めるだけ読んでbytesで返す．空ならb""である．
+    def get(self):
+        with self.lock:
+            tail = self.counters[1]
+            n = self.counters[0] - tail
+            if n == 0:
+                return b""
+            start = tail % self.capacity
+            first = min(n, self.capacity - start)
+            data = bytes(self.data[start:start + first]) + bytes(self.data[:n - first])
+            self.counters[1] = tail + n
+        self.space.release()
+        return data
+
+    @property
+    def closed(self):
+        with self.lock:
+            return self.counters[2] != 0
+
+    # 閉じたことを書き込み，待っている相手を起こす．
+    def close(self):
+        with self.lock:
+            self.counters[2] = 1
+        self.items.release()
+
+    def release(self):
+        self.counters.release()
+        self.data.release()
+
+
+#
+# 共有メモリのリングバッファで行単位のメッセージをやりとりする接続を表すクラスである．
+# Connectionと同じように使える．共有メモリの名前は最初にソケットで受け渡し，
+# その後のメッセージはすべてリングバッファを通す．ソケットは相手が落ちたことを知るためだけに残す．
+# 相手を待つ間はセマフォで眠り，PEER_CHECK秒ごとにソケットを見て相手が落ちていないか確かめる．
+# セマフォの名前は共有メモリの名前から決まる．
+#
+class SharedMemoryConnection:
+
+    # 相手が落ちていないか確かめる間隔(秒)．
+    PEER_CHECK = 0.5
+
+    def __init__(self, sock, shm, owner, batch=False):
+        self.sock = sock
+        self.shm = shm
+        self.owner = owner
+        self.batch = batch
+        capacity = (shm.size // 2) - Ring.HEADER
+        self._semaphore_names = [f"/{shm.name}-{k}" for k in range(2 * Ring.SEMAPHORES)]
+        # lockは同時に1つしか取れないセマフォ，items，spaceは数を数えるセマフォである
+        maxvalues = [1, SEM_VALUE_MAX, SEM_VALUE_MAX] * 2
+        if owner:
+            semaphores = [_create_semaphore(name, 1 if maxvalue == 1 else 0, maxvalue)
+                          for name, maxvalue in zip(self._semaphore_names, maxvalues)]
+        else:
+            semaphores = [_open_semaphore(name, maxvalue)
+                          for name, maxvalue in zip(self._semaphore_names, maxvalues)]
+        rings = [Ring(shm.buf[:shm.size // 2], capacity, semaphores[:Ring.SEMAPHORES]),
+                 Ring(shm.buf[shm.size // 2:], capacity, semaphores[Ring.SEMAPHORES:])]
+        # 作った側(サーバ)は前半に書き込み，後半から読み込む
+        self._send, self._recv = rings if owner else rings[::-1]
+        self._pending = []
+        self._buffer = b""
+
+    #
+    # サーバ側で，接続したソケットsockに対して共有メモリを作り，その名前を送る．
+    # capacityはリングバッファ1本あたりの大きさ(バイト)である．
+    #
+    @staticmethod
+    def serve(sock, batch=False, capacity=65536):
+        shm = shared_memory.SharedMemory(create=True, size=2 * (Ring.HEADER + capacity))
+        conn = SharedMemoryConnection(sock, shm, True, batch)
+        conn._send.reset()
+        conn._recv.reset()
+        sock.sendall(f"shm {shm.name}\n".encode("utf-8"))
+        return conn
+
+    # クライアント側で，サーバから共有メモリの名前を受け取って接続する．
+    @staticmethod
+    def attach(sock, batch=False):
+        line = b""
+        while not line.endswith(b"\n"):
+            c = sock.recv(1)
+            if not c:
+                raise ConnectionError("server closed the connection before sending shared memory")
+            line += c
+        kind, _, name = line.decode("utf-8").strip().partition(" ")
+        if kind != "shm":
+            raise RuntimeError("server does not use shared memory transport")
+        shm = shared_memory.SharedMemory(name=name)
+        # 消すのはサーバなので，このプロセスの終了時に消されないようにする(Python 3.13より前の挙動)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return SharedMemoryConnection(sock, shm, False, batch)
+
+    # 改行を含む1行を返す．接続が閉じられていれば空文字列を返す．
+    def readline(self):
+        self.flush()
+        while b"\n" not in self._buffer:
+            data = self._recv.get()
+            if data:
+                self._buffer += data
+            elif self._recv.closed or not self._wait(self._recv.items):
+                # 相手が閉じる直前に書いた分を読み残さないようにもう一度読む
+                self._buffer += self._recv.get()
+                if b"\n" not in self._buffer:
+                    line, self._buffer = self._buffer, b""
+                    return line.decode("utf-8")
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line.decode("utf-8") + "\n"
+
+    # 文字列を送る．batchなら次のflushまで溜めておく．
+    def write(self, s):
+        self._pending.append(s)
+        if not self.batch:
+            self.flush()
+
+    # 溜めている文字列をまとめてリングバッファに書き込む．いっぱいなら空くまで待つ．
+    def flush(self):
+        if not self._pending:
+            return
+        data = memoryview("".join(self._pending).encode("utf-8"))
+        self._pending.clear()
+        while data:
+            n = self._send.put(data)
+            data = data[n:]
+            if not n and not self._wait(self._send.space):
+                raise ConnectionError("peer closed the connection")
+
+    #
+    # セマフォsemaphoreが増えるのを待つ．PEER_CHECK秒たっても増えなければソケットを見て，
+    # 相手が落ちていればFalseを返す．増えても待っていたものが来たとは限らないので，呼ぶ側で確かめ直す．
+    #
+    def _wait(self, semaphore):
+        if semaphore.acquire(True, SharedMemoryConnection.PEER_CHECK):
+            return True
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b""
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        try:
+            self.flush()
+        except ConnectionError:
+            pass
+        self._send.close()
+        self._send.release()
+        self._recv.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            for name in self._semaphore_names:
+                _unlink_semaphore(name)
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import unittest
+
+    # 別のプロセスで共有メモリにつなぎ，受け取った行をそのまま送り返す．
+    def echo(sock):
+        with SharedMemoryConnection.attach(sock, batch=True) as conn:
+            while True:
+                line = conn.readline()
+                if not line:
+                    return
+                conn.write(line)
+
+    class SharedMemoryConnectionTest(unittest.TestCase):
+
+        def test_echo(self):
+            server_sock, client_sock = socket.socketpair()
+            process = multiprocessing.Process(target=echo, args=(client_sock,))
+            process.start()
+            client_sock.close()
+            conn = SharedMemoryConnection.serve(server_sock, batch=True, capacity=64)
+            # リングバッファより長い行も分けて送れる
+            lines = [f"{k} " + "x" * (k * 7 % 150) + "\n" for k in range(200)]
+            for line in lines:
+                conn.write(line)
+                self.assertEqual(conn.readline(), line)
+            names = list(conn._semaphore_names)
+            conn.close()
+            process.join(10)
+            self.assertEqual(process.exitcode, 0)
+            for name in names:
+                with self.assertRaises(FileNotFoundError):
+                    _open_semaphore(name, 1)
+
+        def test_peer_exit(self):
+            server_sock, client_sock = socket.socketpair()
+            conn = SharedMemoryConnection.serve(server_sock)
+            client_sock.close()
+            self.assertEqual(conn.readline(), "")
+            conn.close()
+
+    unittest.main()
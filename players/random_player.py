@@ -1,26 +1,34 @@
 import json
 import os
-import random
-import socket
 import sys
 
 sys.path.append(os.getcwd())
 
-from lib.player_base import Player, PlayerShip
+from lib.client import connect, play
+from lib.opening_book import OpeningBook
+from lib.player_base import Player
+from lib.rng import RandomStream
+from lib.tracing import NULL_TRACER, Tracer
 
 
 class RandomPlayer(Player):
 
-    def __init__(self, seed=0):
-        random.seed(seed)
+    #
+    # 乱数生成器rngを与えなければseedから作る．グローバルなrandomの状態は使わない．
+    # attack_rateは移動ではなく攻撃を選ぶ確率である．
+    #
+    def __init__(self, seed=0, positions=None, rng=None, attack_rate=0.5):
+        self.rng = RandomStream(seed) if rng is None else rng
+        self.attack_rate = attack_rate
 
         # フィールドを2x2の配列として持っている．
-        self.field = [[i, j] for i in range(Player.FIELD_SIZE)
+        self.field = [(i, j) for i in range(Player.FIELD_SIZE)
                       for j in range(Player.FIELD_SIZE)]
 
-        # 初期配置を非復元抽出でランダムに決める．
-        ps = random.sample(self.field, 3)
-        positions = {'w': ps[0], 'c': ps[1], 's': ps[2]}
+        # 初期配置が与えられなければ非復元抽出でランダムに決める．
+        if positions is None:
+            ps = self.rng.sample(self.field, 3)
+            positions = {'w': ps[0], 'c': ps[1], 's': ps[2]}
         super().__init__(positions)
 
     #
@@ -28,53 +36,37 @@ class RandomPlayer(Player):
     # どれがどこへ移動するか，あるいはどこに攻撃するかもランダム．
     #
     def action(self):
-        act = random.choice(["move", "attack"])
+        act = "attack" if self.rng.random() < self.attack_rate else "move"
 
         if act == "move":
-            ship = random.choice(list(self.ships.values()))
-            to = random.choice(self.field)
+            ship = self.rng.choice(list(self.ships.values()))
+            to = self.rng.choice(self.field)
             while not ship.can_reach(to) or not self.overlap(to) is None:
-                to = random.choice(self.field)
+                to = self.rng.choice(self.field)
 
             return json.dumps(self.move(ship.type, to))
         elif act == "attack":
-            to = random.choice(self.field)
+            to = self.rng.choice(self.field)
             while not self.can_attack(to):
-                to = random.choice(self.field)
+                to = self.rng.choice(self.field)
 
             return json.dumps(self.attack(to))
 
 
-# 仕様に従ってサーバとソケット通信を行う．
-def main(host, port, seed=0):
+# 仕様に従ってサーバとソケット通信を行う．通信の処理はlib/client.pyにある．
+def main(host, port, seed=0, book=None, name=None, unix=None, shm=False, trace=None):
     assert isinstance(host, str) and isinstance(port, int)
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.connect((host, port))
-        with sock.makefile(mode='rw', buffering=1) as sockfile:
-            get_msg = sockfile.readline()
-            print(get_msg)
-            player = RandomPlayer()
-            sockfile.write(player.initial_condition()+'\n')
-
-            while True:
-                info = sockfile.readline().rstrip()
-                print(info)
-                if info == "your turn":
-                    sockfile.write(player.action()+'\n')
-                    get_msg = sockfile.readline()
-                    player.update(get_msg)
-                elif info == "waiting":
-                    get_msg = sockfile.readline()
-                    player.update(get_msg)
-                elif info == "you win":
-                    break
-                elif info == "you lose":
-                    break
-                elif info == "even":
-                    break
-                else:
-                    raise RuntimeError("unknown information")
+    # 定跡ファイルが与えられればそこから初期配置を選ぶ．
+    rng = RandomStream(seed)
+    positions = None if book is None else OpeningBook.load(book).sample(rng.spawn("book"))
+    player = RandomPlayer(positions=positions, rng=rng.spawn("player"))
+    player.name = name
+    player.seed = seed
+    tracer = NULL_TRACER if trace is None else Tracer(f"random player {seed}")
+    with connect(host, port, unix=unix, shm=shm) as conn:
+        play(player, conn, tracer=tracer)
+    tracer.dump(trace)
 
 
 if __name__ == '__main__':
@@ -85,13 +77,17 @@ if __name__ == '__main__':
         "host",
         metavar="H",
         type=str,
+        nargs="?",
         help="Hostname of the server. E.g., localhost",
+        default="localhost",
     )
     parser.add_argument(
         "port",
         metavar="P",
         type=int,
+        nargs="?",
         help="Port of the server. E.g., 2000",
+        default=2000,
     )
     parser.add_argument(
         "--seed",
@@ -100,6 +96,40 @@ if __name__ == '__main__':
         required=False,
         default=0,
     )
+    parser.add_argument(
+        "--book",
+        type=str,
+        help="Opening book to sample the initial placement from",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--name",
+        type=str,
+        help="Name sent to the server and recorded in the match results",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--unix",
+        type=str,
+        help="Connect to this Unix domain socket path instead of host and port",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--shm",
+        action="store_true",
+        help="Exchange messages through shared memory. The server must also use --shm",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="Write timing spans of action and update to this file in Chrome trace event format",
+        required=False,
+        default=None,
+    )
     args = parser.parse_args()
 
-    main(args.host, args.port, seed=args.seed)
+    main(args.host, args.port, seed=args.seed, book=args.book, name=args.name,
+         unix=args.unix, shm=args.shm, trace=args.trace)
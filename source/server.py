@@ -3,192 +3,26 @@ import json
 import socket
 import argparse
 import warnings
+import os
+import sys
+import time
+import queue
+import contextlib
+import signal
+import multiprocessing
+import fcntl
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from lib.engine import TURNS, DrawRule, Server
+from lib.feed import MatchFeed, parse_address
+from lib.profiles import ProfileRecorder, ProfileStore
+from lib.results import ResultsWriter
+from lib.simulation import DamageTimeline, MatchResult, placements_of
+from lib.tracing import NULL_TRACER, Tracer
+from lib.transport import Connection, SharedMemoryConnection
 
-# プレイヤーの船を表すクラスである．
-class Ship:
-    MAX_HPS = {"w" : 3,
-                "c" : 2,
-                "s" : 1}
-    def __init__(self,ship_type, position): 
-        if not ship_type in Ship.MAX_HPS.keys():
-            raise Exception("invalid type supecified")
-        # 船の種類と最大HPを定義している．
-        
-        # 種類と座標とHPにアクセスできる．
-        self.type = ship_type
-        self.position = position
-        self.hp = Ship.MAX_HPS[ship_type]
-
-  # 座標を変更する．
-    def moved(self,to):
-        self.position = to
-
-  # ダメージを受けてHPが減る．
-    def damaged(self,d):
-        self.hp -= d
-
-    # 座標が移動できる範囲(縦横)にあるか確認する．
-    def reachable(self,to):
-        return self.position[0] == to[0] or self.position[1] == to[1]
-
-    # 座標が攻撃できる範囲(自分の座標及び周囲1マス)にあるか確認する．
-    def attackable(self,to):
-        return abs(to[0] - self.position[0] <= 1) and abs(to[1] - self.position[1]) <= 1
-
-
-# プレイヤーを表すクラスである．艦を複数保持している．
-class Client:
-
-    # フィールドの大きさを定義している．
-    FIELD_SIZE = 5
-
-    #
-    # 艦種ごとに座標を与えられるので，Shipオブジェクトを作成し，連想配列に加える．
-    # 艦のtypeがkeyになる．
-    #
-    def __init__(self,positions):
-        self.ships = {}
-        for ship_type, position in positions.items():
-            if self.__overlap(position):
-                raise Exception("given overlapping positions")
-            if not Client.in_field(position):
-                raise Exception("given overlapping positions")
-            self.ships[ship_type] = Ship(ship_type, position)
-
-    # 艦が座標に移動可能か確かめてから移動させる．相手プレイヤーに渡す情報を連想配列で返す．
-    def move(self,ship_type, to):
-        ship = self.ships[ship_type]
-
-        if (ship is None) or (not Client.in_field(to)) or (not ship.reachable(to)) or (self.__overlap(to) is not None):
-            return False
-
-        distance = [to[0] - ship.position[0], to[1] - ship.position[1]]
-        ship.moved(to)
-        return {"ship":ship_type, "distance":distance}
-
-    #
-    # 攻撃された時の処理．攻撃を受けた艦，あるいは周囲1マスにいる艦を調べ，状態を更新する．
-    # 相手プレイヤーに渡す情報を連想配列で返す．
-    #
-    def attacked(self,to):
-        if not Client.in_field(to):
-            return False
-
-        info = {"position":to}
-        ship = self.__overlap(to)
-        near = self.__near(to)
-
-        if not ship == None:
-            ship.damaged(1)
-            info["hit"] = ship.type
-            if ship.hp == 0:
-                del self.ships[ship.type]
-        
-
-        info["near"] = [s.type for s in near]
-
-        return info
-
-    # 艦の座標とHPを返す．meで自分かどうかを判定し，違うならpositionは教えない．
-    def condition(self,me):
-        cond = {}
-        for ship in self.ships.values():
-            cond[ship.type] = {"hp" : ship.hp}
-            if me:
-                cond[ship.type]["position"] = ship.position
-        return cond
-
-    # 艦隊の攻撃可能な範囲を返す．
-    def attackable(self,to):
-        return Client.in_field(to) and any([ship.attackable(to) for ship in self.ships.values()])
-
-    # 与えられた座標にいる艦を返す．
-    def __overlap(self,position):
-        for ship in self.ships.values():
-            if ship.position == position:
-                return ship
-        return None
-
-    # 与えられた座標の周り1マスにいる艦を配列で返す．
-    def __near(self,to):
-        near = []
-        for ship in self.ships.values():
-            if ship.position != to and abs(ship.position[0] - to[0]) <= 1 and abs(ship.position[1] - to[1]) <= 1:
-                near.append(ship)
-        return near
-
-    # 与えられた座標がフィールドないかどうかを返す．
-    @staticmethod
-    def in_field(position):
-        return position[0] < Client.FIELD_SIZE and position[1] < Client.FIELD_SIZE and position[0] >= 0 and position[1] >= 0
-
-#
-# 処理を行うクラスである．プレイヤー2人を保持している． ．
-#
-class Server:
-
-    #
-    # プレイヤーの配列である．
-    # 行動プレイヤーのインデックスをcとする．
-    # 今プレイヤーが2人であるという前提なので， 待機プレイヤーのインデックスは1-cである．
-    #
-
-    # 両プレイヤーからJSONを受け取って初期配置を設定する．
-    def __init__(self,json1, json2):
-        self.clients = []
-        self.clients.append(Client(json.loads(json1))) #loadsは文字列をパースする
-        self.clients.append(Client(json.loads(json2)))
-
-    # 初期配置をJSONで返す．
-    def initial_condition(self,c):
-        return [json.dumps(self.condition(c)), json.dumps(self.condition(1-c))] #dumpsは文字列にjson化する
-
-    #
-    # 可能かどうかチェックしてから攻撃，あるいは移動の処理を行い，両プレイヤーに結果を通知するJSONを作る．
-    # JSONの配列を返す．0番目の要素が行動プレイヤー宛，1番目の要素が待機プレイヤー宛である．
-    #
-    def action(self,c, json_str):
-        info = [{},{}]
-        active = self.clients[c]
-        passive = self.clients[1-c]
-        act = json.loads(json_str)#loadsは文字列をパースする
-
-        if "attack" in act.keys():
-            to = act["attack"]["to"]
-
-            if not active.attackable(to):
-                result = False
-            else:
-                result = passive.attacked(to)
-
-            info[c]["result"] = {"attacked":result}
-            info[1-c]["result"] = {"attacked":result}
-
-            if len(passive.ships) == 0:
-                info[c]["outcome"] = True
-                info[1-c]["outcome"] = False
-        
-        elif "move" in act.keys():
-            result = active.move(act["move"]["ship"], act["move"]["to"])
-            info[1-c]["result"] = {"moved":result}
-
-        if not result:
-            info[c]["outcome"] = False
-            info[1-c]["outcome"] = True
-
-        info[c] = {**info[c],**self.condition(c)}
-        info[1-c] = {**info[1-c],**self.condition(1-c)}
-
-        return [json.dumps(info[c]), json.dumps(info[1-c])] #dumpsは文字列に変換 
-
-  # 自分と相手の状態を連想配列で返す．
-    def condition(self,c):
-        return {
-            "condition" : {
-                "me" : self.clients[c].condition(True),
-                "enemy" : self.clients[1-c].condition(False)
-            }
-        }
 
 # 処理結果をターミナルにわかりやすく出力するためのモジュール．
 # を静的関数のみ持つクラスとして実装
@@ -295,44 +129,123 @@ RECV_BUFFER_SIZE = 4096
 #
 # プレイヤーの行動をソケットから取得して処理し，結果を通知する．
 # 勝利したプレイヤーを返す．勝敗が決していない時は-1を返す．
+# tracerには読み込み，JSONの解釈，Server.action，状態の作成，出力，書き込みの区間を記録する．
+# recorder(lib.profiles.ProfileRecorder)を与えると行動を記録し，feed(lib.feed.MatchFeed)を与えると結果を送る．
 #
-def one_action(active, passive, c, server):
-    act = active.readline()
+def one_action(active, passive, c, server, tracer=NULL_TRACER, recorder=None, feed=None):
+    with tracer.span("read"):
+        act = active.readline()
     act = act[:act.find('\n')]#改行文字以外がjsonとしての値
-    results = server.action(c, act)
+    with tracer.span("decode"):
+        act = json.loads(act)
+    if recorder is not None:
+        recorder.action(c, act)
+    with tracer.span("Server.action"):
+        info = server.apply(c, act)
+    with tracer.span("condition"):
+        results = server.respond(c, info)
     if verbose:
-        Reporter.report_field(results, c)
-    active.write(results[0]+"\n")
-    passive.write(results[1]+"\n")
-
-    if "outcome" in json.loads(results[0]).keys():
-        if json.loads(results[0])["outcome"]:
+        with tracer.span("report"):
+            Reporter.report_field(results, c)
+    if feed is not None:
+        with tracer.span("feed"):
+            feed.report(c, results)
+    with tracer.span("write"):
+        active.write(results[0]+"\n")
+        passive.write(results[1]+"\n")
+
+    if "outcome" in info[c]:
+        if info[c]["outcome"]:
             return c
         else:
             return 1 - c
     else:
         return -1
 
-# TCPコネクション上で処理を行う．
-def main(args):
-    warnings.warn(f"listening {args.ipaddr} {args.port}")
+#
+# 待ち受け用のソケットを作る．
+# --unixが与えられればTCPの代わりにそのパスのUnixドメインソケットで待ち受ける．
+# backlogは受け付け待ちの接続の数で，ワーカーで共有する時は多くの接続が一度に来ても落とさないように大きくする．
+#
+def listen(args, backlog=2):
+    if args.unix is not None:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)                                  #前回残ったソケットファイルを消す
+        unix_server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix_server.bind(args.unix)
+        unix_server.listen(backlog)
+        return unix_server
     tcp_server = socket.socket(socket.AF_INET,socket.SOCK_STREAM) #IPv4を用いてTCP通信をすることにする
     tcp_server.bind((args.ipaddr, args.port))                     #指定されたIPアドレスとポートを紐づける
+    tcp_server.listen(backlog)
+    return tcp_server
+
+#
+# ワーカーの間で1試合分の受け付けを排他するロックである．ファイルのPOSIXロック(lockf)を使うので，
+# ロックを持ったワーカーがSIGKILLなどで落ちてもカーネルが解放し，起動し直したワーカーが止まらない．
+# POSIXロックはプロセスごとなので，ファイルはプロセスごとに開き直す．
+#
+class AcceptLock:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._pid = None
+
+    def __enter__(self):
+        if self._pid != os.getpid():
+            self._file = open(self.path, "r+b")
+            self._pid = os.getpid()
+        fcntl.lockf(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self._file, fcntl.LOCK_UN)
+
+    # 別のプロセスに渡す時は開いたファイルを渡さない．
+    def __getstate__(self):
+        return {"path": self.path, "_file": None, "_pid": None}
+
+#
+# 2つのclientと接続して1試合を行う．
+# 結果をlib.simulation.MatchResultで返す．勝者は引き分けの時は-1である．
+# 待ち受けソケットを複数のプロセスで共有している時は，accept_lockで2つの接続をまとめて受け付ける．
+# tracerを与えるとターンごとの処理の区間を記録する．
+#
+def play_match(tcp_server, args, accept_lock=None, tracer=NULL_TRACER):
     clients = []
     addresses = []
+    # --batchか--piggybackなら1ターンに同じ相手へ送る行をまとめて送り，TCP_NODELAYを設定する
+    batch = args.batch or args.piggyback
     #2つのclientと接続
-    tcp_server.listen(2) 
-    print("listening...")
-    for i in range(2):
-        tmp = tcp_server.accept()
-        clients.append(tmp[0].makefile('rw',buffering=1))   #textfileのようなインターフェースを通じて通信 改行記号までが一つの通信として扱われる
-        addresses.append(tmp[1])
-        print(f"connected {i}")
+    with accept_lock if accept_lock is not None else contextlib.nullcontext():
+        for i in range(2):
+            tmp = tcp_server.accept()
+            if args.shm:
+                #共有メモリの名前だけをソケットで送り，以降のメッセージはリングバッファでやりとりする
+                clients.append(SharedMemoryConnection.serve(tmp[0], batch=batch))
+            else:
+                clients.append(Connection(tmp[0], batch=batch, nodelay=batch))   #改行記号までが一つの通信として扱われる
+            addresses.append(tmp[1])
+            print(f"connected {i}")
 
     for client in clients:
         client.write("you are connected. please send me initial state.\n")
 
     server = Server(clients[0].readline(), clients[1].readline())
+    placements = placements_of(server)
+    timeline = DamageTimeline(server)
+    # 名前と乱数の種は初期配置のJSONで送られたもの．送ってこなかったプレイヤーはNoneである．
+    names = server.names
+    # 名前を送ってきたプレイヤーには，最初の"your turn"や"waiting"の前に対戦相手の名前(無ければnull)を送る．
+    # 名前を送らないクライアントに届く行は変わらない
+    for c, client in enumerate(clients):
+        if names[c] is not None:
+            client.write(json.dumps({"opponent": {"name": names[1-c]}}) + "\n")
+    # --profilesなら対戦相手の傾向を記録する
+    recorder = None if args.profiles is None else ProfileRecorder(server, names)
+    # --feedなら盤面をダッシュボードに送る
+    feed = None if args.feed is None else MatchFeed(parse_address(args.feed))
 
     #勝者を保持する変数
     winner = -1
@@ -340,14 +253,43 @@ def main(args):
     i = 0
     # 行動プレイヤーを保持する変数．
     c = 0
+    # 繰り返しや膠着による引き分けを判定する．
+    rule = DrawRule(args.repetitions, args.quiet_turns, args.adjudicate)
+    rule.start(server, c)
+    # 試合が終わった理由を保持する変数．
+    reason = TURNS
     if verbose : 
         Reporter.report_field(server.initial_condition(c), c)
+    if feed is not None:
+        feed.report(c, server.initial_condition(c))
     while (winner == -1 and i < 10000):
-        clients[c].write("your turn\n")
-        clients[1-c].write("waiting\n")
-        winner = one_action(clients[c], clients[1-c], c, server)
+        with tracer.span("turn", turn=i, player=c+1):
+            with tracer.span("write"):
+                clients[c].write("your turn\n")
+                clients[1-c].write("waiting\n")
+                if args.piggyback:
+                    # 前のターンの結果を次の"your turn"や"waiting"と一緒に送る
+                    clients[1-c].flush()
+                clients[c].flush()
+            winner = one_action(clients[c], clients[1-c], c, server, tracer, recorder, feed)
+            if not args.piggyback:
+                with tracer.span("write"):
+                    for client in clients:
+                        client.flush()
+        timeline.update(server, i)
+        if winner != -1:
+            reason = server.decided_reason(winner)
+        else:
+            drawn = rule.update(server, c)
+            if drawn is not None:
+                reason = drawn
+                i += 1
+                break
         c = 1 - c
         i += 1
+    if winner == -1:
+        winner = rule.adjudicated_winner(server)
+        print(f"no decision by {reason}")
     if winner == -1:
         for client in clients:
             client.write("even\n")
@@ -356,16 +298,166 @@ def main(args):
         clients[winner].write("you win\n")
         clients[1-winner].write("you lose\n")
         print("player" + str(1+winner) + " win")
+    if feed is not None:
+        feed.end("EVEN" if winner == -1 else f"PLAYER {1+winner} WIN")
+        feed.close()
 
     for client in clients:
         client.close()
+
+    hps = [server.total_hp(0), server.total_hp(1)]
+    profiles = None if recorder is None else recorder.profiles
+    return MatchResult(winner, i, 0, placements, hps, reason, names, timeline, profiles, server.seeds)
+
+#
+# 試合結果を--resultsと--profilesのファイルに書き込む．
+# 名前の無いプレイヤーは誰なのかわからないので，傾向には記録しない．
+# 記録できない名前は警告して飛ばす．傾向は試合ごとにファイルに書き戻す．
+#
+def record(result, writer, store):
+    if writer is not None:
+        writer.append(result)
+    if store is not None:
+        for profile in result.profiles:
+            if profile.name is not None:
+                try:
+                    store.add(profile)
+                except ValueError as e:
+                    warnings.warn(f"profile not recorded: {e}")
+        store.flush()
+
+# TCPコネクション上で処理を行う．
+def main(args):
+    if args.workers != 1:
+        supervise(args)
+        return
+
+    warnings.warn(f"listening {address(args)}")
+    tcp_server = listen(args)
+    print("listening...")
+    tracer = NULL_TRACER if args.trace is None else Tracer("server")
+    result = play_match(tcp_server, args, tracer=tracer)
     tcp_server.close()
+    tracer.dump(args.trace)
+    if args.unix is not None:
+        os.unlink(args.unix)
+    writer = None if args.results is None else ResultsWriter(args.results)
+    store = None if args.profiles is None else ProfileStore(args.profiles)
+    record(result, writer, store)
+    for f in (writer, store):
+        if f is not None:
+            f.close()
+
+#
+# ワーカープロセスの処理．監視プロセスが作った待ち受けソケットshared_serverで試合を繰り返し，
+# 試合ごとに(ワーカーの番号, 試合結果)をqueueで監視プロセスに送る．
+# 1試合の2つの接続はaccept_lockを持ったまま続けて受け付ける．
+#
+def worker(args, index, queue, shared_server, accept_lock):
+    global verbose
+    verbose = not args.quiet
+    tcp_server = shared_server
+    # トレースは1試合ごとに新しいTracerで記録し，ワーカーの番号と試合の番号をつけたファイルに書き出す．
+    # 同じTracerに溜め続けると，試合のたびにそれまでの全試合を書き直すことになる
+    match = 0
+    while True:
+        tracer = NULL_TRACER if args.trace is None else Tracer(f"server worker {index}")
+        result = play_match(tcp_server, args, accept_lock, tracer)
+        if args.trace is not None:
+            root, ext = os.path.splitext(args.trace)
+            tracer.dump(f"{root}-{index}-{match}{ext}")
+        match += 1
+        queue.put((index, result))
+
+#
+# 監視プロセスの処理．コアの数(あるいは--workersの数)だけワーカーを起動し，
+# 試合結果を集計して定期的に出力する．落ちたワーカーは起動し直す．
+# --resultsや--profilesを与えると，その書き込みは監視プロセスだけが行う．
+#
+def supervise(args):
+    # 監視プロセスで待ち受けたソケットをすべてのワーカーで共有する．ワーカーごとにSO_REUSEPORTで
+    # 待ち受けると，カーネルが1試合の2つの接続を別々のワーカーに振り分けてしまい，どちらも相手を待ち続ける．
+    # 対戦相手が別々のワーカーに分かれないように，1つのワーカーが2つ続けて受け付ける．
+    # 多くのクライアントが一度に接続しても落とさないように，受け付け待ちの数は上限まで取る
+    shared_server = listen(args, socket.SOMAXCONN)
+    fd, lock_path = tempfile.mkstemp(prefix="submarine-accept-")
+    os.close(fd)
+    accept_lock = AcceptLock(lock_path)
+    n = args.workers if args.workers > 0 else os.cpu_count()
+    results = multiprocessing.Queue()
+
+    def start(index):
+        process = multiprocessing.Process(target=worker, args=(args, index, results, shared_server, accept_lock), daemon=True)
+        process.start()
+        return process
+
+    warnings.warn(f"listening {address(args)} with {n} workers")
+    workers = [start(index) for index in range(n)]
+    stats = {"matches": 0, "player1": 0, "player2": 0, "even": 0, "restarts": 0}
+    writer = None if args.results is None else ResultsWriter(args.results)
+    store = None if args.profiles is None else ProfileStore(args.profiles)
+    reported = time.monotonic()
+
+    def report():
+        print(" ".join(f"{key}={value}" for key, value in stats.items()), flush=True)
+
+    #SIGTERMで止められた時もワーカーを止めてから終了する
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            try:
+                index, result = results.get(timeout=1.0)
+                stats["matches"] += 1
+                stats["even" if result.winner == -1 else f"player{result.winner+1}"] += 1
+                record(result, writer, store)
+            except queue.Empty:
+                pass
+
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    warnings.warn(f"worker {index} exited with code {process.exitcode}. restarting")
+                    workers[index] = start(index)
+                    stats["restarts"] += 1
+
+            if time.monotonic() - reported >= args.stats_interval:
+                report()
+                reported = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers:
+            process.terminate()
+        for f in (writer, store):
+            if f is not None:
+                f.close()
+        shared_server.close()
+        os.unlink(lock_path)
+        if args.unix is not None:
+            os.unlink(args.unix)
+        report()
+
+# 待ち受けている場所を表す文字列．
+def address(args):
+    return args.unix if args.unix is not None else f"{args.ipaddr} {args.port}"
 
 
 parser = argparse.ArgumentParser()
-parser.add_argument("ipaddr", default="127.0.0.1")
-parser.add_argument("port", default=2000,type=int)
+parser.add_argument("ipaddr", nargs="?", default="127.0.0.1")
+parser.add_argument("port", nargs="?", default=2000,type=int)
 parser.add_argument("--quiet", action="store_true")
+parser.add_argument("--repetitions", default=0, type=int, help="declare a draw when the same position appears this many times. 0 disables")
+parser.add_argument("--quiet-turns", default=0, type=int, help="declare a draw after this many turns without damage. 0 disables")
+parser.add_argument("--adjudicate", action="store_true", help="give undecided games to the player with more remaining HP")
+parser.add_argument("--workers", default=1, type=int, help="number of worker processes sharing one listening socket. 0 means one per core")
+parser.add_argument("--batch", action="store_true", help="send the lines for one client in a turn with a single write and set TCP_NODELAY")
+parser.add_argument("--piggyback", action="store_true", help="like --batch, and also hold each result until the next prompt so that every client gets one write per turn")
+parser.add_argument("--unix", default=None, type=str, help="listen on this Unix domain socket path instead of ipaddr and port")
+parser.add_argument("--shm", action="store_true", help="exchange messages through shared memory ring buffers. Clients must also use --shm")
+parser.add_argument("--trace", default=None, type=str, help="write per-turn timing spans to this file in Chrome trace event format. Workers write one file per match named with -WORKER-MATCH")
+parser.add_argument("--results", default=None, type=str, help="directory to append match results to. See lib/results.py")
+parser.add_argument("--profiles", default=None, type=str, help="file to accumulate per-opponent statistics in. See lib/profiles.py")
+parser.add_argument("--feed", default=None, type=str, help="send every position to a dashboard at HOST:PORT over UDP. See visual_server.py --listen-feed")
+parser.add_argument("--stats-interval", default=10.0, type=float, help="seconds between aggregated stats reports of the workers")
 
 if __name__ == "__main__": #直接実行したときのみ処理を行う(__FILE__ == $0に対応)
     args = parser.parse_args()
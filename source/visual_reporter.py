@@ -0,0 +1,316 @@
+# coding: utf-8
+import json
+import os
+import itertools
+import math
+import threading
+import tkinter as tk #GUIモジュール
+
+#
+# visual_server.pyで盤面をウィンドウに表示するためのモジュール．
+# tkinterやPILを読み込むので，ウィンドウを開く時にだけimportする．
+#
+
+FIGS_PATH = "./figs"
+SUBMARINES_PATH = f"{FIGS_PATH}/Submarines"
+#リサイズ済みのスプライトをまとめた画像(アトラス)を置く場所
+CACHE_PATH = f"{FIGS_PATH}/cache"
+
+# スプライトの名前と元画像のパスの一覧を返す．名前は"explosion"か"{プレイヤー}{艦種}{HP}"である．
+def sprite_sources():
+    sources = {"explosion": f"{FIGS_PATH}/explosion.png"}
+    for hp_1, name in enumerate(["s","c","w"]):
+        for (player, color), hp_var in itertools.product(enumerate(["Blue","Red"]),range(1,hp_1+2)):
+            sources[f"{player}{name}{hp_var}"] = f"{SUBMARINES_PATH}/{color}{name.upper()}{hp_var}.png"
+    return sources
+
+# グリッドの大きさに合わせたスプライトの大きさを返す．
+def sprite_size(name, grid_size):
+    if name == "explosion":
+        return (grid_size*2//3, grid_size*2//3)
+    return (grid_size*2//3, grid_size*10//18)
+
+# アトラスの画像と索引のパスを返す．グリッドの大きさごとに別のファイルになる．
+def atlas_paths(grid_size):
+    return f"{CACHE_PATH}/atlas-{grid_size}.png", f"{CACHE_PATH}/atlas-{grid_size}.json"
+
+#
+# 元画像をリサイズして横1列に並べたアトラスを作り，キャッシュに保存する．
+# 索引はスプライトの名前から[x, y, 幅, 高さ]への連想配列である．PILはここでしか使わない．
+#
+def build_atlas(grid_size):
+    from PIL import Image #アトラスを作り直す時だけ必要
+    
+    sprites = {}
+    for name, path in sprite_sources().items():
+        with Image.open(path) as img:
+            sprites[name] = img.convert("RGBA").resize(sprite_size(name, grid_size))
+    
+    width = sum(img.width for img in sprites.values())
+    height = max(img.height for img in sprites.values())
+    atlas = Image.new("RGBA", (width, height))
+    index = {}
+    x = 0
+    for name, img in sprites.items():
+        atlas.paste(img, (x, 0))
+        index[name] = [x, 0, img.width, img.height]
+        x += img.width
+    
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    image_path, index_path = atlas_paths(grid_size)
+    atlas.save(image_path)
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+
+# キャッシュのアトラスが無いか，元画像より古ければTrueを返す．
+def atlas_is_stale(grid_size):
+    image_path, index_path = atlas_paths(grid_size)
+    if not (os.path.exists(image_path) and os.path.exists(index_path)):
+        return True
+    built = min(os.path.getmtime(image_path), os.path.getmtime(index_path))
+    return any(os.path.getmtime(path) > built for path in sprite_sources().values())
+
+#
+# アトラスを読み込み，スプライトごとのPhotoImageに切り出す．
+# 爆発の画像と，艦の画像の連想配列を返す．Tkのroot作成後に呼ぶこと．
+#
+def load_sprites(grid_size):
+    if atlas_is_stale(grid_size):
+        build_atlas(grid_size)
+    image_path, index_path = atlas_paths(grid_size)
+    with open(index_path) as f:
+        index = json.load(f)
+    atlas = tk.PhotoImage(file=image_path)
+    
+    sprites = {}
+    for name, (x, y, w, h) in index.items():
+        sprite = tk.PhotoImage(width=w, height=h)
+        sprite.tk.call(sprite, "copy", atlas, "-from", x, y, x+w, y+h)
+        sprites[name] = sprite
+    explosion = sprites.pop("explosion")
+    return explosion, sprites
+
+#
+# Server.actionの結果resultと行動プレイヤーcから，盤面に置くスプライトを(名前, x, y, d)のリストで返す．
+# dが0のものはグリッドの左上に，1のものは右下に置く．
+#
+def field_sprites(result, c):
+    results = [json.loads(result[0]), json.loads(result[1])]
+
+    fleets = [results[c]["condition"]["me"], results[1-c]["condition"]["me"]]
+    if results[1].get("result")== None:
+        attacked = None
+    else:
+        attacked = None if results[1]["result"].get("attacked") is None else results[1]["result"]["attacked"]["position"]
+
+    sprites = []
+    for d in range(1+1):
+        for ship_type, ship in fleets[d].items():
+            x, y = ship["position"]
+            sprites.append((f"{d}{ship_type}{ship['hp']}", x, y, d))
+    if attacked is not None:
+        sprites.append(("explosion", attacked[0], attacked[1], 1-c))
+    return sprites
+
+
+# 処理結果をわかりやすくみせるためクラスとして実装
+class VisualReporter(tk.Frame):
+    GRID_SIZE = 120
+    INTERVAL = 1000
+    
+    def __init__(self,master,field_size):
+        super().__init__(master)
+        self.pack()
+        #mainloopに入ったかどうかを保持する変数
+        self.hasEnteredMainloop = False
+        #フィールドの大きさを初期化
+        self._field_size = field_size
+        #windowを初期化
+        self.master.title("Submarine Game")
+        self.master.geometry(f"{VisualReporter.GRID_SIZE*field_size}x{VisualReporter.GRID_SIZE*field_size}")
+        
+        #キャンバスを設置
+        self._canvas = tk.Canvas(self,bg="#88ccff",height=VisualReporter.GRID_SIZE*self._field_size,width=VisualReporter.GRID_SIZE*self._field_size)
+        self._canvas.pack()
+        
+        #線分を配置
+        self._lines = []
+        for i in range(1,self._field_size):
+            self._lines.append(self._canvas.create_line(i*VisualReporter.GRID_SIZE,0,i*VisualReporter.GRID_SIZE,self._field_size*VisualReporter.GRID_SIZE,fill="Blue"))
+            self._lines.append(self._canvas.create_line(0,i*VisualReporter.GRID_SIZE,self._field_size*VisualReporter.GRID_SIZE,i*VisualReporter.GRID_SIZE,fill="Blue"))
+        
+        #画像のロード．リサイズ済みの画像をまとめたアトラスをキャッシュから読み，切り出す
+        self._explosion_img, self._submaline_imgs = load_sprites(VisualReporter.GRID_SIZE)
+        
+        #何回report_fieldが呼ばれたかによって今が何ターン目かを保持する変数
+        self.report_call_num = 0
+        #レポートするべきフィールドのリスト
+        self._field_list = []
+        #二重でreportfieldの列ができないようにするためのアフターキャンセル用変数
+        self._report_field_after_id = None
+        
+        #その他ループをまたいで保持したい変数をまとめる辞書
+        self._loop_dict = {}
+        
+        #独自のloop(1msおきに呼ばれる)を実行
+        self.after(1,self._loop)
+        
+    @property
+    def has_unshowed_field(self):
+        return len(self._field_list)>0
+        
+    def _loop(self):
+        if not self.hasEnteredMainloop:
+            self.hasEnteredMainloop = True
+        if self._loop_dict.get("quit") is not None and self._loop_dict["quit"] == True:
+            self.master.destroy() 
+        
+        if self.has_unshowed_field and self._report_field_after_id is None:
+            self._report_field_after_id = self.after(VisualReporter.INTERVAL,self._report_field)
+        
+        #次のループを1ms後に行う
+        self.after(1,self._loop)
+       
+    def end_report(self):
+        self._loop_dict["quit"] = True
+
+    def report_field(self, result, c):
+        self._field_list.append((result,c))
+    
+    def _report_field(self):
+        result, c = self._field_list.pop(0)
+        
+        #前回の盤面をすべて消去
+        self._canvas.delete("report_field")
+        
+        #ターン数の表示
+        self.message_in_title(f"Turn {self.report_call_num}")
+        self.report_call_num += 1
+        
+        #潜水艦と爆発を表示
+        for name, x, y, d in field_sprites(result, c):
+            #dを位置に加え、さらに画像のアンカー位置も変えることで、プレイヤー0に関する情報はグリッドの左上に、プレイヤー1に関する情報はグリッドの右下に表示されるようにした
+            image = self._explosion_img if name == "explosion" else self._submaline_imgs[name]
+            self._canvas.create_image(VisualReporter.GRID_SIZE*(x+d), VisualReporter.GRID_SIZE*(y+d), image=image, tags="report_field",
+                                      anchor= tk.NW if d == 0 else tk.SE)
+        
+        #まだ表示しきっていないフィールドがあれば VisualReporter.INTERVAL ms 後に描画
+        if self.has_unshowed_field:
+            if self._report_field_after_id is not None:
+                self.after_cancel(self._report_field_after_id)
+            self._report_field_after_id = self.after(VisualReporter.INTERVAL,self._report_field)
+        else:
+            self._report_field_after_id = None
+
+    def message_in_title(self,message):
+        self.master.title(f"Submarine Game : {message}")
+
+
+#
+# 多数の試合の盤面を1つのウィンドウに並べて表示するクラスである．盤面は0からboards-1の番号で区別する．
+# report_fieldとmessageはどのスレッドから呼んでもよく，盤面ごとに最新の状態だけを残す(途中の状態は描かない)．
+# 描画は1秒にFPS回までで，1回に変化のあった盤面を古い順に最大BOARDS_PER_FRAME個だけ描き直す．
+# 変化のない盤面には触らないので，描画の量は盤面の数ではなく変化の量で決まる．
+# スプライトはGRID_SIZEに縮小したアトラスから一度だけ切り出し，すべての盤面で共有する．
+#
+class Dashboard(tk.Frame):
+    GRID_SIZE = 24
+    MARGIN = 6
+    LABEL_HEIGHT = 14
+    FPS = 10
+    BOARDS_PER_FRAME = 32
+
+    def __init__(self,master,field_size,boards,columns=None):
+        super().__init__(master)
+        self.pack()
+        #mainloopに入ったかどうかを保持する変数
+        self.hasEnteredMainloop = False
+        self._field_size = field_size
+        self._columns = math.ceil(math.sqrt(boards)) if columns is None else columns
+        rows = math.ceil(boards/self._columns)
+        board_size = Dashboard.GRID_SIZE*field_size
+        #盤面の間隔
+        self._pitch = (board_size+Dashboard.MARGIN, board_size+Dashboard.LABEL_HEIGHT+Dashboard.MARGIN)
+        width = self._columns*self._pitch[0]+Dashboard.MARGIN
+        height = rows*self._pitch[1]+Dashboard.MARGIN
+        self.master.title("Submarine Game")
+        self.master.geometry(f"{width}x{height}")
+        
+        self._canvas = tk.Canvas(self,bg="white",height=height,width=width,highlightthickness=0)
+        self._canvas.pack()
+        
+        #盤面の背景，線分，見出しは最初に一度だけ作り，以降は艦と爆発だけを描き直す
+        self._labels = []
+        for i in range(boards):
+            x0, y0 = self._origin(i)
+            self._canvas.create_rectangle(x0,y0,x0+board_size,y0+board_size,fill="#88ccff",outline="Blue")
+            for k in range(1,field_size):
+                self._canvas.create_line(x0+k*Dashboard.GRID_SIZE,y0,x0+k*Dashboard.GRID_SIZE,y0+board_size,fill="Blue")
+                self._canvas.create_line(x0,y0+k*Dashboard.GRID_SIZE,x0+board_size,y0+k*Dashboard.GRID_SIZE,fill="Blue")
+            self._labels.append(self._canvas.create_text(x0,y0+board_size+1,anchor=tk.NW,text="",font="TkSmallCaptionFont"))
+        
+        #縮小したスプライトをすべての盤面で共有する
+        self._explosion_img, self._submaline_imgs = load_sprites(Dashboard.GRID_SIZE)
+        
+        #盤面の番号から，まだ描いていない最新の(結果, 行動プレイヤー)と見出しへの連想配列．挿入順が古い順になる
+        self._lock = threading.Lock()
+        self._fields = {}
+        self._messages = {}
+        self._quit = False
+        #盤面を描き直した回数
+        self.redraws = 0
+        
+        self.after(1,self._loop)
+    
+    # まだ描いていない盤面の数．
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._fields)
+    
+    def report_field(self, board, result, c):
+        with self._lock:
+            self._fields[board] = (result, c)
+    
+    # 盤面の下に見出しを表示する．
+    def message(self, board, message):
+        with self._lock:
+            self._messages[board] = message
+    
+    def message_in_title(self,message):
+        self.master.title(f"Submarine Game : {message}")
+    
+    def end_report(self):
+        self._quit = True
+    
+    # 盤面boardの左上の座標．
+    def _origin(self, board):
+        column, row = board % self._columns, board // self._columns
+        return Dashboard.MARGIN+column*self._pitch[0], Dashboard.MARGIN+row*self._pitch[1]
+    
+    def _loop(self):
+        self.hasEnteredMainloop = True
+        if self._quit:
+            self.master.destroy()
+            return
+        
+        with self._lock:
+            boards = list(itertools.islice(self._fields, Dashboard.BOARDS_PER_FRAME))
+            fields = [(board, self._fields.pop(board)) for board in boards]
+            messages, self._messages = self._messages, {}
+        for board, message in messages.items():
+            self._canvas.itemconfigure(self._labels[board], text=message)
+        for board, (result, c) in fields:
+            self._draw(board, result, c)
+        
+        self.after(1000//Dashboard.FPS,self._loop)
+    
+    def _draw(self, board, result, c):
+        tag = f"board{board}"
+        self._canvas.delete(tag)
+        x0, y0 = self._origin(board)
+        for name, x, y, d in field_sprites(result, c):
+            image = self._explosion_img if name == "explosion" else self._submaline_imgs[name]
+            self._canvas.create_image(x0+Dashboard.GRID_SIZE*(x+d), y0+Dashboard.GRID_SIZE*(y+d), image=image, tags=tag,
+                                      anchor= tk.NW if d == 0 else tk.SE)
+        self.redraws += 1
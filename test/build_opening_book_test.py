@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+#
+# tools/build_opening_book.pyの正準形の列挙と，評価を対称な配置に広げる処理を確かめる．
+# python test/build_opening_book_test.py として実行する．
+#
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from lib.symmetry import canonical_placement
+from tools.build_opening_book import canonical_placements, expand, placements
+
+
+# 配置を比べられるタプルにする．
+def key(placement):
+    return tuple(tuple(placement[t]) for t in ("w", "c", "s"))
+
+
+class BuildOpeningBookTest(unittest.TestCase):
+
+    def test_expand(self):
+        for canonical in canonical_placements()[:50]:
+            entry = {**canonical, "games": 16, "wins": 9, "draws": 2, "losses": 5, "hp": 1.5}
+            expanded = expand(entry)
+            self.assertEqual(len({key(e) for e in expanded}), len(expanded))
+            self.assertIn(key(canonical), {key(e) for e in expanded})
+            for e in expanded:
+                # 軌道のどの配置も正準形の評価を持ち，正準形に戻すと元の配置になる
+                self.assertEqual({k: v for k, v in e.items() if k not in ("w", "c", "s")},
+                                 {"games": 16, "wins": 9, "draws": 2, "losses": 5, "hp": 1.5})
+                self.assertEqual(key(canonical_placement(e)[0]), key(canonical))
+
+    def test_orbits_cover_all_placements(self):
+        expanded = [key(e) for c in canonical_placements() for e in expand({**c, "games": 0})]
+        self.assertEqual(len(expanded), len(set(expanded)))
+        self.assertEqual(set(expanded), {key(p) for p in placements()})
+
+    def test_build(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "book.json")
+            done = subprocess.run([sys.executable, "tools/build_opening_book.py", path,
+                                   "--games", "2", "--limit", "3", "--processes", "1"],
+                                  cwd=ROOT, capture_output=True, text=True)
+            self.assertEqual(done.returncode, 0, done.stderr)
+            with open(path) as f:
+                book = json.load(f)
+        finally:
+            shutil.rmtree(directory)
+        expected = sum(len(expand(c)) for c in canonical_placements()[:3])
+        self.assertEqual(len(book["placements"]), expected)
+        self.assertTrue(all(e["games"] == 2 for e in book["placements"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+#
+# tools/merge_traces.pyで試合ごとのトレースファイルを1つにまとめる．
+# python test/merge_traces_test.py として実行する．
+#
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from lib.tracing import PID_OFFSET, Tracer
+
+
+class MergeTracesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_per_match_files(self):
+        paths = []
+        for match in range(2):
+            tracer = Tracer("server worker 0")
+            for turn in range(3):
+                with tracer.span("turn", turn=turn):
+                    pass
+            paths.append(os.path.join(self.directory, f"server-0-{match}.json"))
+            tracer.dump(paths[-1])
+        output = os.path.join(self.directory, "match.json")
+        done = subprocess.run([sys.executable, "tools/merge_traces.py", output] + paths,
+                              cwd=ROOT, capture_output=True, text=True)
+        self.assertEqual(done.returncode, 0, done.stderr)
+        self.assertIn("merged 2 traces", done.stdout)
+
+        with open(output) as f:
+            events = json.load(f)["traceEvents"]
+        turns = [e for e in events if e["name"] == "turn"]
+        self.assertEqual([e["args"]["turn"] for e in turns], [0, 1, 2, 0, 1, 2])
+        # 2試合目は別のプロセスとして並ぶ
+        pid = os.getpid()
+        self.assertEqual([e["pid"] for e in turns], [pid] * 3 + [pid + PID_OFFSET] * 3)
+        self.assertEqual([e["args"]["name"] for e in events if e["ph"] == "M"],
+                         ["server worker 0", "server worker 0 (server-0-1.json)"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+#
+# source/server.pyを別プロセスで起動し，ランダムプレイヤーを実際に接続して試合をさせる．
+# python test/server_test.py として実行する．
+#
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from lib.feed import FeedReceiver
+
+
+# 空いているTCPのポートを返す．
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# 監視プロセスpidのワーカーのプロセスIDのリスト．multiprocessingのresource_trackerは除く．
+def workers(pid):
+    children = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True).stdout.split()
+    found = []
+    for child in children:
+        with open(f"/proc/{child}/cmdline", "rb") as f:
+            if b"resource_tracker" not in f.read():
+                found.append(int(child))
+    return found
+
+
+class WorkersTest(unittest.TestCase):
+
+    # サーバを起動し，待ち受けを始めるまで待つ．
+    def start_server(self, server_args):
+        server = subprocess.Popen(
+            [sys.executable, "source/server.py", "--quiet", "--stats-interval", "0.2"] + list(server_args),
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        # 待ち受けを始めたという警告が出るまで待つ
+        for line in server.stderr:
+            if "listening" in line:
+                break
+        time.sleep(0.5)
+        return server
+
+    # サーバを止め，監視プロセスが最後に出力した集計の連想配列を返す．
+    def stop_server(self, server):
+        server.send_signal(signal.SIGTERM)
+        out, _ = server.communicate(timeout=30)
+        server.stderr.close()
+        stats = dict(item.split("=") for item in out.strip().splitlines()[-1].split())
+        return {key: int(value) for key, value in stats.items()}
+
+    #
+    # clients個のランダムプレイヤーを同時に接続して終わるのを待ち，出力のリストを返す．
+    # namesを与えるとk番目のプレイヤーはnames[k]を名乗る(Noneなら名乗らない)．
+    #
+    def run_players(self, clients, client_args=(), names=None):
+        players = []
+        for k in range(clients):
+            name = [] if names is None or names[k] is None else ["--name", names[k]]
+            players.append(subprocess.Popen(
+                [sys.executable, "players/random_player.py", "--seed", str(k)] + name + list(client_args),
+                cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True))
+            # 接続した順に組になるように少し待つ
+            if names is not None:
+                time.sleep(0.3)
+        outputs = []
+        for player in players:
+            try:
+                out, _ = player.communicate(timeout=30)
+            except subprocess.TimeoutExpired:
+                for p in players:
+                    p.kill()
+                self.fail("a client did not finish its match")
+            self.assertEqual(player.returncode, 0, out)
+            outputs.append(out)
+        return outputs
+
+    # サーバを起動し，clients個のランダムプレイヤーを同時に接続して終わるのを待つ．
+    # (プレイヤーの出力のリスト, 監視プロセスが最後に出力した集計の連想配列)を返す．
+    def run_matches(self, server_args, clients, client_args=()):
+        server = self.start_server(server_args)
+        try:
+            outputs = self.run_players(clients, client_args)
+        finally:
+            stats = self.stop_server(server)
+        return outputs, stats
+
+    def check(self, outputs, stats, matches):
+        results = [out.strip().splitlines()[-1] for out in outputs]
+        self.assertTrue(all(r in ("you win", "you lose", "even") for r in results), results)
+        self.assertEqual(results.count("you win"), results.count("you lose"))
+        self.assertEqual(stats["matches"], matches)
+
+    def test_tcp_workers(self):
+        port = free_port()
+        outputs, stats = self.run_matches(["127.0.0.1", str(port), "--workers", "4"], 6,
+                                          ["127.0.0.1", str(port)])
+        self.check(outputs, stats, 3)
+        self.assertEqual(stats["restarts"], 0)
+
+    def test_unix_workers(self):
+        path = os.path.join(ROOT, f"test-{os.getpid()}.sock")
+        outputs, stats = self.run_matches(["--unix", path, "--workers", "3", "--batch"], 4,
+                                          ["--unix", path])
+        self.check(outputs, stats, 2)
+        self.assertFalse(os.path.exists(path))
+
+    def test_opponent_names(self):
+        path = os.path.join(ROOT, f"test-{os.getpid()}.sock")
+        server = self.start_server(["--unix", path, "--workers", "2"])
+        try:
+            outputs = self.run_players(2, ["--unix", path], names=["alice", None])
+        finally:
+            stats = self.stop_server(server)
+        self.check(outputs, stats, 1)
+        # 名乗ったプレイヤーにだけ相手の名前(名乗らなければnull)が届く
+        self.assertIn('{"opponent": {"name": null}}', outputs[0].splitlines())
+        self.assertFalse(any("opponent" in line for line in outputs[1].splitlines()))
+
+    def test_killed_worker(self):
+        # 1人だけ接続して，2人目を待っているワーカー(受け付けのロックを持っている)をSIGKILLで止める
+        path = os.path.join(ROOT, f"test-{os.getpid()}.sock")
+        server = self.start_server(["--unix", path, "--workers", "2"])
+        try:
+            lone = subprocess.Popen([sys.executable, "players/random_player.py", "--unix", path],
+                                    cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            time.sleep(1.0)
+            for pid in workers(server.pid):
+                os.kill(pid, signal.SIGKILL)
+            lone.wait(timeout=30)
+            # 起動し直したワーカーで試合ができる
+            time.sleep(1.5)
+            outputs = self.run_players(2, ["--unix", path])
+        finally:
+            stats = self.stop_server(server)
+        self.check(outputs, stats, 1)
+
+    def test_feed(self):
+        receiver = FeedReceiver(("127.0.0.1", 0))
+        messages = []
+
+        def receive():
+            while True:
+                message = receiver.receive(5)
+                if message is None:
+                    return
+                messages.append(message)
+
+        thread = threading.Thread(target=receive)
+        thread.start()
+        port = free_port()
+        outputs, stats = self.run_matches(["127.0.0.1", str(port), "--workers", "2",
+                                           "--feed", f"127.0.0.1:{receiver.address[1]}"], 4,
+                                          ["127.0.0.1", str(port)])
+        thread.join()
+        receiver.close()
+        self.check(outputs, stats, 2)
+        # 試合ごとに最初の盤面から終わりまで届く
+        ends = {m["key"]: m["message"] for m in messages if "message" in m}
+        self.assertEqual(len(ends), 2)
+        for key in ends:
+            turns = [m["turn"] for m in messages if m["key"] == key and "turn" in m]
+            self.assertEqual(turns, list(range(len(turns))))
+            self.assertGreater(len(turns), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
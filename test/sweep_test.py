@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+#
+# tools/sweep.pyの逐次半減法を小さな設定で実行し，集計した成績を確かめる．
+# python test/sweep_test.py として実行する．
+#
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from lib.results import ResultsReader
+from tools.sweep import evaluate, sweep
+
+PLAYER = "players.random_player:RandomPlayer"
+OPPONENT = "players.random_player:RandomPlayer"
+
+
+class SweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # 3つの設定を2試合ずつ評価し，1つだけを6試合まで評価する探索の引数．
+    def args(self, processes=1, checkpoint=None, results=None):
+        return argparse.Namespace(player=PLAYER, opponents=[OPPONENT], param=["attack_rate=0.1,0.5,0.9"],
+                                  games=2, eta=3, rungs=2, seed=7, quiet_turns=100, games_per_task=1,
+                                  processes=processes, checkpoint=checkpoint, results=results)
+
+    def test_halving(self):
+        configs = sweep(self.args())
+        self.assertEqual([c["alive"] for c in configs], [True, False, False])
+        self.assertEqual([c["games"] for c in configs], [6, 2, 2])
+        self.assertEqual(sorted(c["params"]["attack_rate"] for c in configs), [0.1, 0.5, 0.9])
+        # 試合のまとまりごとに足し合わせた成績は，同じ試合を1度に行った成績と同じ
+        index = [0.1, 0.5, 0.9].index(configs[0]["params"]["attack_rate"])
+        _, games, wins, draws, _ = evaluate((index, configs[0]["params"], 0, 6, PLAYER, [OPPONENT], 7, 100, False))
+        self.assertEqual((configs[0]["games"], configs[0]["wins"], configs[0]["draws"]), (games, wins, draws))
+
+    def test_deterministic(self):
+        self.assertEqual(sweep(self.args(processes=1)), sweep(self.args(processes=2)))
+
+    def test_resume(self):
+        checkpoint = os.path.join(self.directory, "sweep.json")
+        configs = sweep(self.args(checkpoint=checkpoint))
+        with open(checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual(state["rung"], 1)
+        # 終わった探索を再開しても試合は増えない
+        self.assertEqual(sweep(self.args(checkpoint=checkpoint)), configs)
+
+    def test_results(self):
+        results = os.path.join(self.directory, "results")
+        configs = sweep(self.args(results=results))
+        with ResultsReader(results) as reader:
+            self.assertEqual(len(reader), sum(c["games"] for c in configs))
+            for c in configs:
+                # 名前の無い対戦相手はクラス名で記録される
+                name = f"{PLAYER} {json.dumps(c['params'], sort_keys=True)}"
+                self.assertEqual(reader.by_opponent(name), {"RandomPlayer": [c["games"], c["wins"], c["draws"]]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import itertools
+import multiprocessing
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.opening_book import OpeningBook
+from lib.results import ResultsWriter
+from lib.simulation import make_players, play
+from lib.symmetry import canonical_placement, orbit
+from players.random_player import RandomPlayer
+
+# フィールドの大きさ．
+FIELD_SIZE = 5
+
+
+# 配置の候補をすべて列挙する．艦同士が重ならない25*24*23=13800通りである．
+def placements():
+    field = [[i, j] for i in range(FIELD_SIZE) for j in range(FIELD_SIZE)]
+    return [{"w": w, "c": c, "s": s} for w, c, s in itertools.permutations(field, 3)]
+
+
+#
+# フィールドの対称性で移り合う配置は同じ強さなので，正準形だけを評価すれば良い．
+# 評価する正準形の配置を列挙する．
+#
+def canonical_placements():
+    seen = set()
+    result = []
+    for placement in placements():
+        canonical, _ = canonical_placement(placement)
+        key = tuple(canonical[t] for t in ("w", "c", "s"))
+        if key not in seen:
+            seen.add(key)
+            result.append(canonical)
+    return result
+
+
+# 正準形の配置の評価を，対称な配置すべての評価に広げる．
+def expand(entry):
+    placement = {t: entry[t] for t in ("w", "c", "s")}
+    stats = {key: value for key, value in entry.items() if key not in placement}
+    return [{**{t: list(p[t]) for t in placement}, **stats} for p in orbit(placement)]
+
+
+#
+# 1つの配置をランダムプレイヤー相手に何度も対戦させて(統計, 試合結果のリスト)を返す．
+# 先手と後手は交互に入れ替える．試合結果はkeep_resultsの時だけ集める．
+#
+def evaluate(task):
+    index, placement, games, seed, keep_results = task
+    entry = {**placement, "games": games, "wins": 0, "draws": 0, "losses": 0, "hp": 0.0}
+    results = []
+    for g in range(games):
+        players = make_players([RandomPlayer, RandomPlayer], seed, (index, g), [{"positions": placement}, {}])
+        result = play(players, first=g % 2)
+        if keep_results:
+            results.append(result)
+        if result.winner == 0:
+            entry["wins"] += 1
+        elif result.winner == 1:
+            entry["losses"] += 1
+        else:
+            entry["draws"] += 1
+        entry["hp"] += result.hps[0] / games
+    return entry, results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build opening book for Submarine Game by self-play")
+    parser.add_argument(
+        "output",
+        metavar="OUT",
+        type=str,
+        help="Path of the opening book. E.g., book.json",
+    )
+    parser.add_argument(
+        "--games",
+        type=int,
+        help="Number of games per placement",
+        required=False,
+        default=16,
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        help="Evaluate only the first N placements up to symmetry",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        help="Directory to also append the match results to. See lib/results.py",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Number of worker processes",
+        required=False,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Random seed of the simulation",
+        required=False,
+        default=0,
+    )
+    args = parser.parse_args()
+
+    candidates = canonical_placements()[:args.limit]
+    tasks = [(i, p, args.games, args.seed, args.results is not None) for i, p in enumerate(candidates)]
+    entries = []
+    # 試合結果は親プロセスだけが書き込む
+    results = None if args.results is None else ResultsWriter(args.results)
+    with multiprocessing.Pool(args.processes) as pool:
+        for entry, matches in pool.imap(evaluate, tasks, chunksize=16):
+            entries.extend(expand(entry))
+            for match in matches:
+                results.append(match)
+    if results is not None:
+        results.close()
+
+    OpeningBook.write(args.output, entries,
+                      opponent="RandomPlayer", games=args.games, seed=args.seed)
+    print(f"wrote {len(entries)} placements to {args.output}")
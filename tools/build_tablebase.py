@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.tablebase import build
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build endgame tablebase for Submarine Game")
+    parser.add_argument(
+        "output",
+        metavar="OUT",
+        type=str,
+        help="Path of the tablebase file. E.g., tablebase.bin",
+    )
+    parser.add_argument(
+        "--max-ships",
+        type=int,
+        help="Maximum number of ships per side (2 takes a long time)",
+        required=False,
+        default=1,
+    )
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    build(args.output, max_ships=args.max_ships, verbose=not args.quiet)
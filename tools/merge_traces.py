@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.tracing import merge
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Merge trace files of the server and players into one timeline")
+    parser.add_argument(
+        "output",
+        metavar="OUT",
+        type=str,
+        help="Path of the merged trace. E.g., match.json",
+    )
+    parser.add_argument(
+        "traces",
+        metavar="TRACE",
+        nargs="+",
+        type=str,
+        help="Trace files written with --trace",
+    )
+    args = parser.parse_args()
+
+    merge(args.traces, args.output)
+    print(f"merged {len(args.traces)} traces into {args.output}")
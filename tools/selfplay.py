@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.dataset import ShardWriter, empty_columns, encode_game, write_manifest
+from lib.results import ResultsWriter
+from lib.simulation import load_player, make_players, play
+
+
+#
+# 担当するゲームをすべて対戦させ，行を列ごとのarrayにためる．
+# (列の連想配列, 試合結果のリスト)を返す．試合結果はkeep_resultsの時だけ集める．
+# シャードに分けるのは親プロセスのShardWriterだけなので，短いシャードは最後の1つだけになる．
+#
+def run(task):
+    start, stop, specs, seed, keep_results = task
+    classes = [load_player(spec) for spec in specs]
+    columns = empty_columns()
+    results = []
+
+    # 乱数はゲームの通し番号から分割するので，プロセス数やタスクの分け方によらず同じ結果になる．
+    for game in range(start, stop):
+        players = make_players(classes, seed, (game,))
+        moves = []
+
+        def observer(c, turn, observation, action):
+            moves.append((game, turn, c, observation, action))
+
+        result = play(players, first=game % 2, observer=observer)
+        encode_game(moves, result.winner, columns)
+        if keep_results:
+            results.append(result)
+
+    return columns, results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate self-play dataset for Submarine Game")
+    parser.add_argument(
+        "output",
+        metavar="DIR",
+        type=str,
+        help="Directory to write shards and manifest into",
+    )
+    parser.add_argument(
+        "--players",
+        nargs=2,
+        type=str,
+        help="Player classes as module:Class. They must accept an rng argument",
+        required=False,
+        default=["players.random_player:RandomPlayer", "players.random_player:RandomPlayer"],
+    )
+    parser.add_argument(
+        "--games",
+        type=int,
+        help="Number of games",
+        required=False,
+        default=1000,
+    )
+    parser.add_argument(
+        "--games-per-task",
+        type=int,
+        help="Number of games played by one task of the pool",
+        required=False,
+        default=256,
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        help="Number of rows per shard",
+        required=False,
+        default=65536,
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        help="Directory to also append the match results to. See lib/results.py",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Number of worker processes",
+        required=False,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Random seed of the simulation",
+        required=False,
+        default=0,
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    tasks = [(start, min(start + args.games_per_task, args.games), args.players,
+              args.seed, args.results is not None)
+             for start in range(0, args.games, args.games_per_task)]
+    # シャードと試合結果は親プロセスだけが書き込む．タスクの順に足すのでゲームの通し番号順に並ぶ
+    writer = ShardWriter(args.output, "part", args.shard_size)
+    results = None if args.results is None else ResultsWriter(args.results)
+    with multiprocessing.Pool(args.processes) as pool:
+        for columns, matches in pool.imap(run, tasks):
+            writer.extend(columns)
+            for match in matches:
+                results.append(match)
+    shards = writer.close()
+    if results is not None:
+        results.close()
+
+    write_manifest(args.output, shards, players=args.players, games=args.games, seed=args.seed)
+    print(f"wrote {sum(s['rows'] for s in shards)} rows in {len(shards)} shards to {args.output}")
@@ -0,0 +1,246 @@
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.engine import DrawRule
+from lib.results import ResultsWriter
+from lib.simulation import load_player, make_players, play
+
+#
+# プレイヤーのパラメータを逐次半減法(successive halving)で探索する．
+# すべての設定を少ない試合数で評価し，成績の良い1/etaだけを残して試合数をeta倍にする，を
+# 設定が1つになるか段の上限に達するまで繰り返す．悪い設定には少ない試合しか使わない．
+#
+# 各試合の乱数は(--seed, 設定の番号, 試合の番号)から分割して作るので，
+# プロセス数や中断・再開によらず同じ結果になる．進み具合は試合のまとまりごとにチェックポイントに書き出す．
+#
+
+
+#
+# "name=v1,v2,..."の形のパラメータ指定を(name, 値のリスト)にする．
+# 値はJSONとして読めればその値，読めなければ文字列である．
+#
+def parse_param(spec):
+    name, _, values = spec.partition("=")
+    parsed = []
+    for value in values.split(","):
+        try:
+            parsed.append(json.loads(value))
+        except json.JSONDecodeError:
+            parsed.append(value)
+    return name, parsed
+
+
+# パラメータの格子のすべての組み合わせを連想配列のリストで返す．
+def grid(params):
+    names = [name for name, _ in params]
+    return [dict(zip(names, values)) for values in itertools.product(*[v for _, v in params])]
+
+
+# 成績．勝ちを1，引き分けを0.5として平均する．
+def score(config):
+    if config["games"] == 0:
+        return 0.0
+    return (config["wins"] + 0.5 * config["draws"]) / config["games"]
+
+
+#
+# 1つの設定で試合番号start以上stop未満の試合を行い，(設定の番号, 試合数, 勝ち, 引き分け, 試合結果のリスト)を返す．
+# 対戦相手と先手は試合番号で順に入れ替える．試合結果はkeep_resultsの時だけ集め，
+# 調べているプレイヤーの名前は"PLAYER パラメータのJSON"にする．
+#
+def evaluate(task):
+    index, params, start, stop, spec, opponents, seed, quiet_turns, keep_results = task
+    cls = load_player(spec)
+    opponent_classes = [load_player(o) for o in opponents]
+    wins = draws = 0
+    results = []
+    for game in range(start, stop):
+        opponent = opponent_classes[game % len(opponent_classes)]
+        players = make_players([cls, opponent], seed, (index, game), [params, {}])
+        players[0].name = f"{spec} {json.dumps(params, sort_keys=True)}"
+        rule = DrawRule(quiet_turns=quiet_turns) if quiet_turns > 0 else None
+        result = play(players, first=(game // len(opponent_classes)) % 2, rule=rule)
+        if keep_results:
+            results.append(result)
+        if result.winner == 0:
+            wins += 1
+        elif result.winner == -1:
+            draws += 1
+    return index, stop - start, wins, draws, results
+
+
+# チェックポイントを書き出す．途中で止められても壊れないように，別名で書いてから置き換える．
+def save(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+#
+# 探索の状態を作る．チェックポイントがあれば読み込んで続きから始める．
+# 設定や段の作り方が変わっていたら混ぜないようにエラーにする．
+#
+def load_state(path, args):
+    settings = {"player": args.player, "opponents": args.opponents, "params": args.param,
+                "games": args.games, "eta": args.eta, "rungs": args.rungs, "seed": args.seed,
+                "quiet_turns": args.quiet_turns}
+    if path is not None and os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        if state["settings"] != settings:
+            raise ValueError(f"checkpoint {path} was made with different settings")
+        return state
+    configs = [{"params": p, "games": 0, "wins": 0, "draws": 0, "alive": True}
+               for p in grid([parse_param(spec) for spec in args.param])]
+    return {"settings": settings, "rung": 0, "configs": configs}
+
+
+#
+# 逐次半減法を行う．各段で生き残っている設定をgames * eta**rung試合まで評価し，
+# 上位1/etaを次の段に残す．
+# --resultsの試合結果はチェックポイントより先に書くので，中断したところから再開すると
+# 最後のまとまりの試合が重複して記録されることがある．
+#
+def sweep(args):
+    state = load_state(args.checkpoint, args)
+    configs = state["configs"]
+    settings = state["settings"]
+    writer = None if args.results is None else ResultsWriter(args.results)
+    with multiprocessing.Pool(args.processes) as pool:
+        while True:
+            rung = state["rung"]
+            target = settings["games"] * settings["eta"] ** rung
+            alive = [i for i, c in enumerate(configs) if c["alive"]]
+            print(f"rung {rung}: {len(alive)} configs, {target} games each", flush=True)
+
+            # 足りない分の試合をまとまりに分けてプールに渡す
+            tasks = []
+            for i in alive:
+                for start in range(configs[i]["games"], target, args.games_per_task):
+                    tasks.append((i, configs[i]["params"], start, min(start + args.games_per_task, target),
+                                  settings["player"], settings["opponents"], settings["seed"],
+                                  settings["quiet_turns"], writer is not None))
+            # 設定ごとの試合は番号順に渡し，番号順に終わった分だけを数えるので，
+            # チェックポイントの試合数より前の試合はすべて終わっている
+            for index, games, wins, draws, results in pool.imap(evaluate, tasks):
+                for result in results:
+                    writer.append(result)
+                config = configs[index]
+                config["games"] += games
+                config["wins"] += wins
+                config["draws"] += draws
+                if args.checkpoint is not None:
+                    save(args.checkpoint, state)
+
+            if len(alive) <= 1 or rung + 1 >= settings["rungs"]:
+                break
+            ranked = sorted(alive, key=lambda i: score(configs[i]), reverse=True)
+            for i in ranked[max(1, len(alive) // settings["eta"]):]:
+                configs[i]["alive"] = False
+            state["rung"] = rung + 1
+            if args.checkpoint is not None:
+                save(args.checkpoint, state)
+
+    if writer is not None:
+        writer.close()
+    return sorted(configs, key=lambda c: (c["alive"], c["games"], score(c)), reverse=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tune player parameters for Submarine Game by successive halving")
+    parser.add_argument(
+        "player",
+        metavar="PLAYER",
+        type=str,
+        help="Player class to tune as module:Class. It must accept rng and the parameters as keyword arguments",
+    )
+    parser.add_argument(
+        "--param",
+        action="append",
+        type=str,
+        help="Parameter values as name=v1,v2,... Repeat for several parameters. E.g., attack_rate=0.1,0.5,0.9",
+        required=True,
+    )
+    parser.add_argument(
+        "--opponents",
+        nargs="+",
+        type=str,
+        help="Reference opponents as module:Class. They must accept an rng argument",
+        required=False,
+        default=["players.random_player:RandomPlayer"],
+    )
+    parser.add_argument(
+        "--games",
+        type=int,
+        help="Number of games per config in the first rung",
+        required=False,
+        default=16,
+    )
+    parser.add_argument(
+        "--eta",
+        type=int,
+        help="Keep the best 1/eta configs and multiply the games by eta at each rung",
+        required=False,
+        default=3,
+    )
+    parser.add_argument(
+        "--rungs",
+        type=int,
+        help="Maximum number of rungs",
+        required=False,
+        default=5,
+    )
+    parser.add_argument(
+        "--quiet-turns",
+        type=int,
+        help="Declare a draw after this many turns without damage. 0 disables",
+        required=False,
+        default=200,
+    )
+    parser.add_argument(
+        "--games-per-task",
+        type=int,
+        help="Number of games played by one task of the pool",
+        required=False,
+        default=16,
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        help="JSON file to save progress to. An existing file is resumed",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        help="Directory to also append the match results to. See lib/results.py",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Number of worker processes",
+        required=False,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Random seed of the simulation",
+        required=False,
+        default=0,
+    )
+    args = parser.parse_args()
+
+    for config in sweep(args)[:10]:
+        print(f"{score(config):.3f} {config['games']:6d} games {json.dumps(config['params'])}")